@@ -1,26 +1,348 @@
+from django import template
 from django.contrib import admin
-from django.contrib.auth.models import Permission
+from django.contrib.admin.util import unquote
+from django.contrib.auth.models import User, Group, Permission
+from django.contrib.admin.widgets import ForeignKeyRawIdWidget
+from django.contrib.contenttypes.generic import BaseGenericInlineFormSet
 from django.contrib.contenttypes.generic import GenericTabularInline
 from django.contrib.admin.sites import NotRegistered
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator, InvalidPage
+from django.http import Http404, HttpResponseRedirect
+from django.shortcuts import render_to_response
+from django.utils.encoding import force_unicode
+from django.utils.html import escape
+from django.utils.text import truncate_words
+from django.utils.translation import ugettext as _
 
+from guardian.core import ObjectPermissionChecker, get_perm_ids
 from guardian.models import UserObjectPermission, GroupObjectPermission
+from guardian.sharding import is_sharded
+from guardian.shortcuts import get_objs, get_perms_for_model
+from guardian.utils import get_content_type
+from guardian.utils import get_user_obj_perms_model
+from guardian.utils import get_group_obj_perms_model
+from guardian.utils import prefetch_obj_perms_related
 
-class GroupObjectPermissionInline(GenericTabularInline):
+class PrefetchedRawIdWidget(ForeignKeyRawIdWidget):
+    """
+    Raw id widget rendering labels of objects prefetched by
+    :class:`ObjectPermissionInlineFormSet` instead of fetching each of them.
+    """
+    def __init__(self, *args, **kwargs):
+        super(PrefetchedRawIdWidget, self).__init__(*args, **kwargs)
+        self.objects = {}
+
+    def label_for_value(self, value):
+        obj = self.objects.get(unicode(value))
+        if obj is None:
+            return super(PrefetchedRawIdWidget, self).label_for_value(value)
+        return '&nbsp;<strong>%s</strong>' % escape(truncate_words(obj, 14))
+
+class ObjectPermissionInlineFormSet(BaseGenericInlineFormSet):
+    """
+    Formset fetching objects, users/groups and permissions related to the
+    object permissions with constant number of queries (see
+    :func:`guardian.utils.prefetch_obj_perms_related`).
+    """
+    def get_queryset(self):
+        queryset = super(ObjectPermissionInlineFormSet, self).get_queryset()
+        if queryset._result_cache is None:
+            # fills result cache of the queryset with prefetched instances
+            obj_perms = prefetch_obj_perms_related(queryset)
+            for name, field in self.form.base_fields.items():
+                if not isinstance(field.widget, PrefetchedRawIdWidget):
+                    continue
+                for obj_perm in obj_perms:
+                    obj = getattr(obj_perm, name)
+                    if obj is not None:
+                        field.widget.objects[unicode(obj.pk)] = obj
+        return queryset
+
+class ObjectPermissionInline(GenericTabularInline):
+    """
+    Base of object permission inlines; renders object permissions without
+    a query per row.
+    """
+    formset = ObjectPermissionInlineFormSet
+
+    def formfield_for_foreignkey(self, db_field, request=None, **kwargs):
+        formfield = super(ObjectPermissionInline, self)\
+            .formfield_for_foreignkey(db_field, request, **kwargs)
+        if db_field.name in self.raw_id_fields:
+            formfield.widget = PrefetchedRawIdWidget(db_field.rel,
+                using=kwargs.get('using'))
+        return formfield
+
+class GroupObjectPermissionInline(ObjectPermissionInline):
     model = GroupObjectPermission
     raw_id_fields = ['group', 'permission']
 
-class UserObjectPermissionInline(GenericTabularInline):
+class UserObjectPermissionInline(ObjectPermissionInline):
     model = UserObjectPermission
     raw_id_fields = ['user', 'permission']
 
 class ObjectPermissionMixin(object):
+    """
+    Mixin for ``ModelAdmin`` classes. Besides object level
+    ``has_change_permission``/``has_delete_permission`` it limits the
+    changelist to objects user has permissions for and adds *Object
+    permissions* page (at ``<object_id>/permissions/``) showing grid of
+    users (or groups) and permissions of the object.
+
+    Only one page of users/groups (``obj_perms_per_page``) is rendered at once
+    and its permissions are fetched by a single query, so objects with
+    thousands of grants are handled fine. Changes made at the page are saved
+    using ``bulk_assign``/``bulk_remove_perm`` of object permission managers.
+    The page requires change permission for the object and model level change
+    permission for object permissions of users (or groups) - see
+    :meth:`has_obj_perms_manage_permission`.
+    """
+    change_form_template = 'admin/guardian/change_form.html'
+    obj_perms_manage_template = 'admin/guardian/obj_perms_manage.html'
+    obj_perms_per_page = 50
+
     def has_change_permission(self, request, obj=None):
         opts = self.opts
-        return request.user.has_perm(opts.app_label + '.' + opts.get_change_permission(), obj)
+        if self.has_obj_perm(request, opts.get_change_permission(), obj):
+            return True
+        # changelist is available as long as there is anything to show there
+        return obj is None and self.has_changelist_objs(request)
 
     def has_delete_permission(self, request, obj=None):
         opts = self.opts
-        return request.user.has_perm(opts.app_label + '.' + opts.get_delete_permission(), obj)
+        return self.has_obj_perm(request, opts.get_delete_permission(), obj)
+
+    def has_obj_perm(self, request, perm, obj=None):
+        """
+        Returns ``True`` if request's user has global ``perm`` or, if ``obj``
+        is given, object permission ``perm`` for it. Object permissions are
+        checked using request bound ``ObjectPermissionChecker`` (see
+        :meth:`get_obj_perms_checker`).
+        """
+        opts = self.opts
+        if request.user.has_perm(opts.app_label + '.' + perm):
+            return True
+        if obj is None:
+            return False
+        return self.get_obj_perms_checker(request).has_perm(perm, obj)
+
+    def has_obj_perms_manage_permission(self, request, obj, kind):
+        """
+        Returns ``True`` if request's user may manage object permissions of
+        users (or groups, depending on ``kind``) for ``obj``, i.e. has model
+        level change permission for the object permission model used for
+        ``obj``. Object level permissions don't count here - otherwise anyone
+        allowed to change single object could grant themselves everything
+        else for it.
+        """
+        if kind == 'user':
+            perms_model = get_user_obj_perms_model(obj)
+        else:
+            perms_model = get_group_obj_perms_model(obj)
+        opts = perms_model._meta
+        return request.user.has_perm(opts.app_label + '.' +
+            opts.get_change_permission())
+
+    def get_obj_perms_checker(self, request):
+        """
+        Returns ``ObjectPermissionChecker`` for request's user, created once
+        per request so permissions fetched (or prefetched by the changelist)
+        are reused.
+        """
+        if not hasattr(request, '_guardian_obj_perms_checker'):
+            request._guardian_obj_perms_checker = \
+                ObjectPermissionChecker(request.user)
+        return request._guardian_obj_perms_checker
+
+    def get_changelist_perms(self):
+        """
+        Returns list of permission codenames any of which is required for the
+        object to be shown at the changelist (``view_<model>`` and
+        ``change_<model>``).
+        """
+        opts = self.opts
+        return ['view_%s' % opts.object_name.lower(),
+            opts.get_change_permission()]
+
+    def has_changelist_objs(self, request):
+        """
+        Returns ``True`` if request's user has object permissions (any of
+        :meth:`get_changelist_perms`) for at least one object. Result is
+        stored at the request.
+        """
+        if not hasattr(request, '_guardian_has_changelist_objs'):
+            objs = get_objs(self.model, self.get_changelist_perms(),
+                request.user)
+            request._guardian_has_changelist_objs = bool(objs[:1])
+        return request._guardian_has_changelist_objs
+
+    def queryset(self, request):
+        """
+        Returns objects for which request's user has any of
+        :meth:`get_changelist_perms` object permissions, unless user has
+        global change permission. Filtering is done by the database.
+        """
+        qs = super(ObjectPermissionMixin, self).queryset(request)
+        opts = self.opts
+        if request.user.has_perm(
+            opts.app_label + '.' + opts.get_change_permission()):
+            return qs
+        return get_objs(qs, self.get_changelist_perms(), request.user)
+
+    def get_changelist(self, request, **kwargs):
+        """
+        Returns ``ChangeList`` class prefetching object permissions for all
+        objects of the displayed page at once.
+        """
+        changelist = super(ObjectPermissionMixin, self).get_changelist(
+            request, **kwargs)
+        model_admin = self
+
+        class ObjectPermissionChangeList(changelist):
+            def get_results(self, request):
+                super(ObjectPermissionChangeList, self).get_results(request)
+                model_admin.get_obj_perms_checker(request).prefetch_perms(
+                    self.result_list)
+
+        return ObjectPermissionChangeList
+
+    def get_urls(self):
+        from django.conf.urls.defaults import patterns, url
+        info = self.model._meta.app_label, self.model._meta.module_name
+        urls = patterns('',
+            url(r'^(.+)/permissions/$',
+                self.admin_site.admin_view(self.obj_perms_manage_view),
+                name='%s_%s_permissions' % info),
+        )
+        return urls + super(ObjectPermissionMixin, self).get_urls()
+
+    def get_obj_perms_identities(self, request, obj, kind):
+        """
+        Returns queryset of users or groups (depending on ``kind``) listed at
+        object permissions page. By default these are identities having any
+        permission for ``obj`` or, if search query is given, all identities
+        matching it (so permissions may be granted to new ones).
+        """
+        if kind == 'user':
+            model, perms_model, search_field = User, \
+                get_user_obj_perms_model(obj), 'username'
+        else:
+            model, perms_model, search_field = Group, \
+                get_group_obj_perms_model(obj), 'name'
+        query = request.GET.get('q', '').strip()
+        if query:
+            identities = model.objects.filter(
+                **{search_field + '__icontains': query})
+        else:
+            obj_perms = perms_model.objects.for_object(obj).active().filter(
+                **perms_model.objects.object_lookups(obj)).values(kind)
+            if is_sharded():
+                # shard can't be used by subqueries
+                obj_perms = [row[kind] for row in obj_perms]
+            identities = model.objects.filter(pk__in=obj_perms)
+        return identities.order_by(search_field)
+
+    def get_obj_perms_grid(self, obj, kind, identities):
+        """
+        Returns dict mapping primary keys of given ``identities`` to dicts
+        mapping codenames of permissions they have object permissions for
+        ``obj`` to ``deny`` flags of these (``False`` for grants, ``True``
+        for deny entries). Uses one query.
+        """
+        if kind == 'user':
+            perms_model = get_user_obj_perms_model(obj)
+        else:
+            perms_model = get_group_obj_perms_model(obj)
+        ctype = get_content_type(obj)
+        codenames = dict((perm_id, codename)
+            for codename, perm_id in get_perm_ids(ctype).iteritems())
+        grid = dict((identity.pk, {}) for identity in identities)
+        rows = perms_model.objects.for_object(obj, ctype).active()\
+            .filter(**perms_model.objects.object_lookups(obj))\
+            .filter(**{kind + '__in': identities})\
+            .values_list(kind, 'permission', 'deny')
+        for identity_id, perm_id, deny in rows:
+            grid[identity_id][codenames[perm_id]] = deny
+        return grid
+
+    def obj_perms_manage_view(self, request, object_id):
+        """
+        Manages object permissions of users and groups for single object.
+        """
+        opts = self.model._meta
+        obj = self.get_object(request, unquote(object_id))
+        if obj is None:
+            raise Http404
+        kind = request.GET.get('kind') == 'group' and 'group' or 'user'
+        if not self.has_change_permission(request, obj) or \
+            not self.has_obj_perms_manage_permission(request, obj, kind):
+            raise PermissionDenied
+        perms = get_perms_for_model(obj).order_by('codename')
+        codenames = [perm.codename for perm in perms]
+
+        if request.method == 'POST':
+            model = kind == 'user' and User or Group
+            identities = list(model.objects.filter(
+                pk__in=request.POST.getlist('identities')))
+            grid = self.get_obj_perms_grid(obj, kind, identities)
+            if kind == 'user':
+                manager = get_user_obj_perms_model(obj).objects
+            else:
+                manager = get_group_obj_perms_model(obj).objects
+            for codename in codenames:
+                to_assign, to_remove, denied = [], [], []
+                for identity in identities:
+                    checked = 'perm_%s_%s' % (identity.pk, codename) \
+                        in request.POST
+                    deny = grid[identity.pk].get(codename)
+                    if checked and deny is not False:
+                        to_assign.append(identity)
+                        if deny:
+                            # checked deny entry is replaced by grant
+                            denied.append(identity)
+                    elif deny is False and not checked:
+                        to_remove.append(identity)
+                if denied:
+                    manager.bulk_remove_perm(codename, denied, obj)
+                if to_assign:
+                    manager.bulk_assign(codename, to_assign, obj)
+                if to_remove:
+                    manager.bulk_remove_perm(codename, to_remove, obj)
+            self.message_user(request, _('Object permissions of "%s" were '
+                'changed successfully.') % force_unicode(obj))
+            return HttpResponseRedirect(request.get_full_path())
+
+        paginator = Paginator(self.get_obj_perms_identities(request, obj,
+            kind), self.obj_perms_per_page)
+        try:
+            page = paginator.page(int(request.GET.get('p', 1)))
+        except (ValueError, InvalidPage):
+            page = paginator.page(1)
+        identities = list(page.object_list)
+        grid = self.get_obj_perms_grid(obj, kind, identities)
+        rows = [(identity, [('perm_%s_%s' % (identity.pk, codename),
+            grid[identity.pk].get(codename) is False,
+            grid[identity.pk].get(codename) is True)
+            for codename in codenames])
+            for identity in identities]
+
+        context = {
+            'title': _('Object permissions: %s') % force_unicode(obj),
+            'object': obj,
+            'opts': opts,
+            'app_label': opts.app_label,
+            'kind': kind,
+            'query': request.GET.get('q', ''),
+            'perms': perms,
+            'rows': rows,
+            'page': page,
+            'paginator': paginator,
+        }
+        context_instance = template.RequestContext(request,
+            current_app=self.admin_site.name)
+        return render_to_response(self.obj_perms_manage_template, context,
+            context_instance=context_instance)
 
 class PermissionAdmin(admin.ModelAdmin):
     search_fields = ('name',)
@@ -29,4 +351,4 @@ try:
     admin.site.unregister(Permission)
 except NotRegistered:
     pass
-admin.site.register(Permission, PermissionAdmin)
\ No newline at end of file
+admin.site.register(Permission, PermissionAdmin)
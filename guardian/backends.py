@@ -1,8 +1,7 @@
 from django.contrib.auth.models import User
 
 from guardian.conf import settings
-from guardian.exceptions import WrongAppError
-from guardian.core import ObjectPermissionChecker
+from guardian.core import ObjectPermissionChecker, resolve_perm
 
 class ObjectPermissionBackend(object):
     supports_object_permissions = True
@@ -26,12 +25,10 @@ class ObjectPermissionBackend(object):
         if not user_obj.is_authenticated():
             user_obj = User.objects.get(pk=settings.ANONYMOUS_USER_ID)
 
-        if len(perm.split('.')) > 1:
-            app_label, perm = perm.split('.')
-            if app_label != obj._meta.app_label:
-                raise WrongAppError("Passed perm has app label of '%s' and "
-                    "given obj has '%s'" % (app_label, obj._meta.app_label))
-
+        # raises WrongAppError if app labels differ
+        spec = resolve_perm(perm, obj)
+        if spec is None:
+            return False
         check = ObjectPermissionChecker(user_obj)
-        return check.has_perm(perm, obj)
+        return check.has_perm(spec[2], obj)
 
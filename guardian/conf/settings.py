@@ -7,3 +7,57 @@ if ANONYMOUS_USER_ID is None:
         "ObjectPermissionBackend authorization backend you have to configure "
         "ANONYMOUS_USER_ID at your settings module")
 
+
+# Type of the ``object_id`` column of generic object permission tables; should
+# match primary keys of models permissions are assigned for so that databases
+# may join on them without casts. One of ``integer``, ``bigint``, ``uuid`` or
+# ``char``.
+OBJECT_ID_FIELD = getattr(settings, 'GUARDIAN_OBJECT_ID_FIELD', 'integer')
+
+# If ``True``, ``ObjectPermissionChecker`` treats model level permissions as
+# granted for every object of the model.
+GLOBAL_PERMS_FALLBACK = getattr(settings, 'GUARDIAN_GLOBAL_PERMS_FALLBACK',
+    False)
+
+# Database aliases (replicas) ``guardian.routers.ObjectPermissionRouter`` sends
+# permission reads to; empty (default) means reads are not routed at all.
+READ_DATABASES = list(getattr(settings, 'GUARDIAN_READ_DATABASES', []))
+
+# If ``True``, ``guardian.routers.ObjectPermissionRouter`` sends reads of
+# ``django.contrib.auth`` models to ``READ_DATABASES`` too - all of them, not
+# only the ones made by guardian.
+ROUTE_AUTH_MODELS = getattr(settings, 'GUARDIAN_ROUTE_AUTH_MODELS', False)
+
+# Database alias ``guardian.routers.ObjectPermissionRouter`` sends writes (and,
+# after a write, reads made during the same request) to.
+WRITE_DATABASE = getattr(settings, 'GUARDIAN_WRITE_DATABASE', 'default')
+
+# Database aliases object permissions are sharded across (see
+# ``guardian.sharding``); empty (default) means no sharding.
+SHARDS = list(getattr(settings, 'GUARDIAN_SHARDS', []))
+
+# How object permissions are assigned to shards: by ``content_type`` of the
+# object (all permissions for a model are stored by the same shard) or by
+# hash of ``object_id``.
+SHARD_BY = getattr(settings, 'GUARDIAN_SHARD_BY', 'object_id')
+if SHARD_BY not in ('content_type', 'object_id'):
+    raise ImproperlyConfigured("GUARDIAN_SHARD_BY should be one of "
+        "'content_type' or 'object_id' (got %r)" % SHARD_BY)
+
+# Maximal number of object permission rows (and ids of objects)
+# ``guardian.shortcuts.get_objs`` collects from shards; ids are passed to the
+# database as query parameters, so default fits SQLite's limit of 999.
+SHARDED_OBJS_LIMIT = getattr(settings, 'GUARDIAN_SHARDED_OBJS_LIMIT', 900)
+
+# Dotted path to class object permission changes are passed to (see
+# ``guardian.feed``); ``None`` (default) means changes are not recorded.
+CHANGE_SINK = getattr(settings, 'GUARDIAN_CHANGE_SINK', None)
+
+# If ``True``, permissions of groups are granted to members of groups nested
+# in them (see ``guardian.groups``).
+NESTED_GROUPS = getattr(settings, 'GUARDIAN_NESTED_GROUPS', False)
+
+# Dict mapping models (``app_label.ModelName``) to models their object
+# permissions are stored and checked for; proxy models are always mapped to
+# their concrete models.
+PERMS_MODELS = dict(getattr(settings, 'GUARDIAN_PERMS_MODELS', {}))
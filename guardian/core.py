@@ -1,16 +1,297 @@
+import datetime
+import marshal
+import random
+import time
+import zlib
 from itertools import chain
 
-from django.contrib.auth.models import Permission
+from django.contrib.auth.models import User, Group, Permission
 from django.contrib.contenttypes.models import ContentType
-from django.db.models import Q, F
+from django.core.cache import cache
+from django.db import router
+from django.db.backends.util import typecast_timestamp
+from django.db.models import Model, Q
+from django.utils.datastructures import SortedDict
 
-from guardian.utils import get_identity
+from guardian.conf import settings as guardian_settings
+from guardian.exceptions import WrongAppError
+from guardian.groups import get_groups_filter, get_group_ids
+from guardian.models import Role, UserObjectRole, GroupObjectRole
+from guardian.routers import get_read_alias
+from guardian.sharding import is_sharded, group_by_shard, fan_out
+from guardian.utils import get_identity, get_content_type, get_perms_model
+from guardian.utils import get_user_obj_perms_model
+from guardian.utils import get_group_obj_perms_model
+
+_all_perms_cache = {}
+_perm_ids_cache = {}
+_perm_specs_cache = {}
+
+# key of the (shared) cache entry holding ids of content types having roles
+ROLE_CTYPES_CACHE_KEY = 'guardian.role_ctype_ids'
+
+# key of the (shared) cache entry holding stamp of the current state of
+# permissions, replaced whenever any of them changes
+PERMS_STATE_CACHE_KEY = 'guardian.perms_state'
+
+# version of the format of ``ObjectPermissionChecker.to_bytes`` payloads
+CHECKER_STATE_VERSION = 2
+
+def get_all_perms(ctype):
+    """
+    Returns sorted tuple of codenames of all permissions of model represented
+    by ``ctype``. Fetched once per process and cached (cache is cleared
+    whenever ``Permission`` is saved or deleted).
+    """
+    if ctype.id not in _all_perms_cache:
+        _all_perms_cache[ctype.id] = tuple(sorted(get_perm_ids(ctype)))
+    return _all_perms_cache[ctype.id]
+
+def get_perm_ids(ctype):
+    """
+    Returns dict mapping codenames of all permissions of model represented by
+    ``ctype`` to their ids. Cached the same way as :func:`get_all_perms`.
+    """
+    if ctype.id not in _perm_ids_cache:
+        _perm_ids_cache[ctype.id] = dict(Permission.objects
+            .filter(content_type=ctype)
+            .values_list('codename', 'id'))
+    return _perm_ids_cache[ctype.id]
+
+def resolve_perm(perm, obj):
+    """
+    Resolves permission ``perm`` (codename, optionally prefixed with
+    ``app_label``) of the model of ``obj`` (model instance or class) to
+    ``(ctype_id, perm_id, codename)`` tuple. Returns ``None`` if the model has
+    no such permission; raises ``WrongAppError`` if ``perm`` is prefixed with
+    other app label than the model's one (or the one of its
+    :func:`guardian.utils.get_perms_model`, i.e. concrete model of a proxy).
+
+    Results are cached the same way as :func:`get_all_perms`. Only existing
+    permissions are cached, so the cache never holds more than two entries
+    (with and without app label) per permission.
+    """
+    model = isinstance(obj, Model) and obj.__class__ or obj
+    key = (perm, model)
+    try:
+        return _perm_specs_cache[key]
+    except KeyError:
+        pass
+    app_label, _, codename = perm.rpartition('.')
+    perms_model = get_perms_model(model)
+    if app_label and app_label not in (model._meta.app_label,
+        perms_model._meta.app_label):
+        raise WrongAppError("Passed perm has app label of '%s' and "
+            "given obj has '%s'" % (app_label, model._meta.app_label))
+    ctype = get_content_type(perms_model)
+    perm_id = get_perm_ids(ctype).get(codename)
+    if perm_id is None:
+        return None
+    _perm_specs_cache[key] = (ctype.id, perm_id, codename)
+    return _perm_specs_cache[key]
+
+def has_roles(ctype):
+    """
+    Returns ``True`` if any :class:`guardian.models.Role` is defined for model
+    represented by ``ctype`` (role assignments are queried by checks for such
+    models only). Ids of content types having roles are fetched once and
+    kept by Django's cache (entry is deleted whenever role is saved or
+    deleted), so all processes sharing the cache backend see new roles at
+    once.
+    """
+    ctype_ids = cache.get(ROLE_CTYPES_CACHE_KEY)
+    if ctype_ids is None:
+        ctype_ids = set(Role.objects.values_list('content_type', flat=True))
+        cache.set(ROLE_CTYPES_CACHE_KEY, ctype_ids)
+    return ctype.id in ctype_ids
+
+def get_perms_state():
+    """
+    Returns stamp of the current state of permissions. It is kept by Django's
+    cache and replaced whenever object permissions, roles, group memberships
+    or model level permissions change (see
+    ``guardian.listeners.clear_perm_cache``), so snapshots of
+    checkers taken before (see :meth:`ObjectPermissionChecker.to_bytes`) are
+    recognized as stale. If the cache doesn't keep the stamp, new one is
+    returned every time.
+    """
+    state = cache.get(PERMS_STATE_CACHE_KEY)
+    if state is None:
+        state = '%x' % random.getrandbits(64)
+        # other process may have stored the stamp in the meantime
+        if not cache.add(PERMS_STATE_CACHE_KEY, state):
+            state = cache.get(PERMS_STATE_CACHE_KEY, state)
+    return state
+
+def get_object_roles(user, group, ctype, now=None):
+    """
+    Returns list of querysets of active role assignments, for objects of
+    model represented by ``ctype``, of given ``user`` (and user's groups) or
+    ``group``.
+    """
+    group_roles = GroupObjectRole.objects.active(now).filter(
+        content_type=ctype)
+    if user:
+        return [UserObjectRole.objects.active(now).filter(user=user,
+            content_type=ctype), group_roles.filter(get_groups_filter(user))]
+    return [group_roles.filter(group=group)]
+
+def get_roles_perms(role_ids):
+    """
+    Returns dict mapping given ids of roles to lists of ``(perm_id,
+    codename)`` pairs of their permissions. Uses single query.
+    """
+    perms = dict((role_id, []) for role_id in role_ids)
+    if perms:
+        for role_id, perm_id, codename in Role.permissions.through.objects\
+            .filter(role__in=perms.keys())\
+            .values_list('role', 'permission', 'permission__codename'):
+            perms[role_id].append((perm_id, codename))
+    return perms
+
+def clear_all_perms_cache():
+    """
+    Clears cache used by :func:`get_all_perms`, :func:`get_perm_ids`,
+    :func:`resolve_perm` and :func:`has_roles`.
+    """
+    _all_perms_cache.clear()
+    _perm_ids_cache.clear()
+    _perm_specs_cache.clear()
+    cache.delete(ROLE_CTYPES_CACHE_KEY)
+
+def get_obj_perms_parent_field(obj):
+    """
+    Returns foreign key field pointing to the object given ``obj`` (model
+    instance or class) inherits object permissions from, or ``None``.
+
+    Models declare it by ``obj_perms_parent`` attribute holding name of the
+    foreign key::
+
+        class Document(models.Model):
+            folder = models.ForeignKey(Folder)
+
+            obj_perms_parent = 'folder'
+
+    User/group having permission for the folder (either assigned directly or
+    inherited from folder's own parent) have it for all its documents too.
+    Permissions named ``<action>_<parent model>`` are translated to
+    ``<action>_<model>`` (i.e. ``change_folder`` grants ``change_document``);
+    other codenames are inherited as they are, if the model has permission
+    with such codename.
+    """
+    name = getattr(obj, 'obj_perms_parent', None)
+    if name is None:
+        return None
+    return obj._meta.get_field(name)
+
+def get_obj_perms_parents(objects, field):
+    """
+    Returns list of distinct parents (pointed by foreign key ``field``) of
+    given ``objects``. Parents not loaded yet are fetched by single query.
+    """
+    parents = {}
+    missing = set()
+    for obj in objects:
+        pk = getattr(obj, field.attname)
+        if pk is None or pk in parents:
+            continue
+        parent = getattr(obj, field.get_cache_name(), None)
+        if parent is None:
+            missing.add(pk)
+        else:
+            parents[pk] = parent
+    missing.difference_update(parents)
+    if missing:
+        parents.update(field.rel.to._default_manager.in_bulk(list(missing)))
+    return parents.values()
+
+def get_inherited_perms(parent_model, model, codenames):
+    """
+    Returns set of codenames of ``model`` permissions granted by
+    ``codenames`` of ``parent_model`` (see :func:`get_obj_perms_parent_field`
+    for the rules).
+    """
+    parent_suffix = '_' + get_perms_model(parent_model)._meta.object_name\
+        .lower()
+    suffix = '_' + get_perms_model(model)._meta.object_name.lower()
+    all_perms = get_all_perms(get_content_type(model))
+    perms = set()
+    for codename in codenames:
+        if codename.endswith(parent_suffix):
+            codename = codename[:-len(parent_suffix)] + suffix
+        if codename in all_perms:
+            perms.add(codename)
+    return perms
+
+def encode_perms(perms):
+    """
+    Encodes dict mapping ``(ctype_id, pk)`` keys to codenames (as cached by
+    ``ObjectPermissionChecker``) compactly: codenames of each content type are
+    replaced by bit masks over sorted codenames present and primary keys
+    sharing the same mask are grouped (integer ones sorted and stored as
+    differences, which compress well).
+    """
+    by_ctype = {}
+    for (ctype_id, pk), codenames in perms.iteritems():
+        by_ctype.setdefault(ctype_id, []).append((pk, codenames))
+    encoded = []
+    for ctype_id, entries in sorted(by_ctype.iteritems()):
+        names = sorted(set(chain(*[codenames for pk, codenames in entries])))
+        bits = dict((codename, 1 << i) for i, codename in enumerate(names))
+        masks = {}
+        for pk, codenames in entries:
+            mask = 0
+            for codename in codenames:
+                mask |= bits[codename]
+            masks.setdefault(mask, []).append(pk)
+        encoded.append((ctype_id, tuple(names), [(mask,) + encode_pks(pks)
+            for mask, pks in sorted(masks.iteritems())]))
+    return encoded
+
+def decode_perms(encoded):
+    """
+    Reverses :func:`encode_perms`.
+    """
+    perms = {}
+    for ctype_id, names, masks in encoded:
+        for mask, is_int, pks in masks:
+            codenames = [codename for i, codename in enumerate(names)
+                if mask & (1 << i)]
+            for pk in decode_pks(is_int, pks):
+                perms[(ctype_id, pk)] = list(codenames)
+    return perms
+
+def encode_pks(pks):
+    if all(isinstance(pk, (int, long)) and not isinstance(pk, bool)
+        for pk in pks):
+        pks = sorted(pks)
+        return True, [pks[0]] + [pk - prev for prev, pk in zip(pks, pks[1:])]
+    return False, [unicode(pk) for pk in pks]
+
+def decode_pks(is_int, pks):
+    if not is_int:
+        return pks
+    decoded = []
+    pk = 0
+    for delta in pks:
+        pk += delta
+        decoded.append(pk)
+    return decoded
 
 class ObjectPermissionChecker(object):
     """
     Generic object permissions checker class being the heart of
     ``django-guardian``.
 
+    Checks of inactive users and superusers are answered without touching the
+    database at all (superuser is granted all permissions of the model, which
+    are fetched once per process).
+
+    Deny entries (object permissions with ``deny`` set, of the user or any of
+    user's groups) win over grants, including permissions inherited from
+    object's parents and model level ones. Superusers are not affected by
+    them.
+
     .. note::
        Once checked for single object, permissions are stored and we don't hit
        database again if another check is called for this object. This is great
@@ -23,14 +304,48 @@ class ObjectPermissionChecker(object):
        perm1/object1 on same instance of ObjectPermissionChecker we won't see a
        difference as permissions are already fetched and stored as cache
        dictionary.
+
+    Checkers may be pickled (i.e. to keep warmed checker in the session or in
+    the cache between requests) - see :meth:`to_bytes`. Restored checker
+    doesn't use permissions cached by the snapshot if any permission changed
+    (or expired) since it was taken.
     """
-    def __init__(self, user_or_group=None):
+    def __init__(self, user_or_group=None, global_perms=None):
         """
         :param user_or_group: should be an ``User``, ``AnonymousUser`` or
           ``Group`` instance
+        :param global_perms: if ``True``, model level permissions (of the
+          group or of the user, given directly or through groups) are treated
+          as granted for every object of the model; defaults to
+          ``GUARDIAN_GLOBAL_PERMS_FALLBACK`` setting
         """
         self.user, self.group = get_identity(user_or_group)
+        if global_perms is None:
+            global_perms = guardian_settings.GLOBAL_PERMS_FALLBACK
+        self.global_perms = global_perms
         self._obj_perms_cache = {}
+        self._perms_state = None
+        self._valid_until = None
+        self._untracked = set()
+
+    def _get_user(self):
+        if self._user_id is not None:
+            # user of restored checker is fetched when it is needed first
+            try:
+                user = User.objects.get(pk=self._user_id)
+            except User.DoesNotExist:
+                raise ValueError("User of checker state doesn't exist")
+            if self._global_perms_cache is not None:
+                user._guardian_global_perms_cache = self._global_perms_cache
+            self.user = user
+        return self._user
+
+    def _set_user(self, user):
+        self._user = user
+        self._user_id = None
+        self._global_perms_cache = None
+
+    user = property(_get_user, _set_user)
 
     def has_perm(self, perm, obj):
         """
@@ -40,13 +355,15 @@ class ObjectPermissionChecker(object):
           prefix (if not prefixed, we grab app_label from ``obj``)
         :param obj: Django model instance for which permission should be checked
 
+        Raises ``WrongAppError`` if ``perm`` is prefixed with other app label
+        than ``obj``'s one (see :func:`resolve_perm`).
         """
-        perm = perm.split('.')[-1]
+        spec = resolve_perm(perm, obj)
         if self.user and not self.user.is_active:
             return False
         elif self.user and self.user.is_superuser:
             return True
-        return perm in self.get_perms(obj)
+        return spec is not None and spec[2] in self.get_perms(obj)
 
     def get_perms(self, obj):
         """
@@ -55,34 +372,446 @@ class ObjectPermissionChecker(object):
         :param obj: Django model instance for which permission should be checked
 
         """
-        ctype = ContentType.objects.get_for_model(obj)
-        key = (ctype.id, obj.id)
+        if self.user and not self.user.is_active:
+            return []
+        ctype = get_content_type(obj)
+        if self.user and self.user.is_superuser:
+            return list(get_all_perms(ctype))
+        if obj.pk is None:
+            return self.get_unsaved_perms(obj, ctype)
+        key = (ctype.id, obj.pk)
         if not key in self._obj_perms_cache:
-            if self.user and not self.user.is_active:
-                return []
-            elif self.user and self.user.is_superuser:
-                perms = list(chain(*Permission.objects
-                    .filter(content_type=ctype)
-                    .values_list("codename")))
-            elif self.user:
-                perms = list(set(chain(*Permission.objects
-                    .filter(content_type=ctype)
-                    .filter(
-                        Q(userobjectpermission__content_type=F('content_type'),
-                            userobjectpermission__user=self.user,
-                            userobjectpermission__object_id=obj.id) |
-                        Q(groupobjectpermission__content_type=F('content_type'),
-                            groupobjectpermission__group__user=self.user,
-                            groupobjectpermission__object_id=obj.id))
-                    .values_list("codename"))))
-            else:
-                perms = list(set(chain(*Permission.objects
-                    .filter(content_type=ctype)
-                    .filter(
-                        groupobjectpermission__content_type=F('content_type'),
-                        groupobjectpermission__group=self.group,
-                        groupobjectpermission__object_id=obj.id)
-                    .values_list("codename"))))
-            self._obj_perms_cache[key] = perms
+            self._record_perms_state()
+        if not key in self._obj_perms_cache and (is_sharded() or
+            get_obj_perms_parent_field(obj) is not None):
+            self.prefetch_perms([obj])
+        if not key in self._obj_perms_cache:
+            granted = self.get_perms_filter(obj, ctype)
+            global_perms = self.global_perms and self.get_global_perms(ctype)
+            if global_perms:
+                granted |= Q(codename__in=global_perms)
+            using = get_read_alias() or router.db_for_read(Permission)
+            select, params = self.get_expires_at_select(obj, ctype, using)
+            rows = Permission.objects.using(using)\
+                .filter(content_type=ctype)\
+                .filter(granted)\
+                .exclude(self.get_perms_filter(obj, ctype, deny=True))\
+                .extra(select=select, select_params=params)\
+                .values_list('codename', *select.keys())
+            perms = set()
+            for row in rows:
+                perms.add(row[0])
+                for value in row[1:]:
+                    self._track_expiry(value)
+            if not perms:
+                # expiration is selected along with granted permissions, so
+                # it is not known if there are none
+                self._untracked.add(key)
+            self._obj_perms_cache[key] = list(perms)
         return self._obj_perms_cache[key]
 
+    def prefetch_perms(self, objects):
+        """
+        Fetches permissions for all given ``objects`` (instances of the same
+        model) at once and stores them at the cache, so following
+        ``has_perm``/``get_perms`` calls for any of them don't hit the
+        database. Uses one query per object permissions table (for models
+        having roles, also one per role assignments table and one fetching
+        permissions of assigned roles; and, for models inheriting permissions
+        from parents, all of them per ancestors level - see
+        :func:`get_obj_perms_parent_field`).
+
+        :param objects: list of Django model instances (unsaved ones are
+          skipped)
+        """
+        objects = [obj for obj in objects if obj.pk is not None]
+        if not objects or (self.user and (not self.user.is_active or
+            self.user.is_superuser)):
+            return
+        self._record_perms_state()
+
+        # collect ancestors, level by level, until they are already cached
+        levels = []
+        level = objects
+        seen = set()
+        while level:
+            levels.append(level)
+            seen.update([self._get_key(obj) for obj in level])
+            field = get_obj_perms_parent_field(level[0])
+            if field is None:
+                break
+            level = [parent for parent in get_obj_perms_parents(level, field)
+                if self._get_key(parent) not in self._obj_perms_cache
+                and self._get_key(parent) not in seen]
+
+        # resolve permissions from the top-most ancestors down
+        for level in reversed(levels):
+            model = level[0].__class__
+            ctype = get_content_type(model)
+            field = get_obj_perms_parent_field(model)
+            perms, denied = self._fetch_perms(model,
+                [obj.pk for obj in level])
+            if self.global_perms:
+                global_perms = self.get_global_perms(ctype)
+            for obj in level:
+                codenames = perms[obj.pk]
+                parent_pk = field and getattr(obj, field.attname)
+                if parent_pk is not None:
+                    parent_model = field.rel.to
+                    parent_key = (get_content_type(
+                        parent_model).id, parent_pk)
+                    codenames |= get_inherited_perms(parent_model, model,
+                        self._obj_perms_cache.get(parent_key, ()))
+                if self.global_perms:
+                    codenames |= global_perms
+                codenames -= denied[obj.pk]
+                self._obj_perms_cache[(ctype.id, obj.pk)] = list(codenames)
+                self._untracked.discard((ctype.id, obj.pk))
+
+    def get_unsaved_perms(self, obj, ctype):
+        """
+        Returns list of codenames of permissions for unsaved ``obj``. Such
+        object has no object permissions of its own, so it is granted
+        permissions inherited from its parent (see
+        :func:`get_obj_perms_parent_field`), if it is set, and model level
+        ones, if ``global_perms`` are enabled. Nothing is cached.
+        """
+        perms = set()
+        field = get_obj_perms_parent_field(obj)
+        if field is not None and getattr(obj, field.attname) is not None:
+            parent = getattr(obj, field.name)
+            perms |= get_inherited_perms(parent.__class__, obj.__class__,
+                self.get_perms(parent))
+        if self.global_perms:
+            perms |= self.get_global_perms(ctype)
+        return list(perms)
+
+    def _record_perms_state(self):
+        # stamp is taken before anything is fetched, so snapshot of the
+        # checker is never considered newer than its contents
+        if self._perms_state is None:
+            self._perms_state = get_perms_state()
+
+    def _track_expiry(self, expires_at):
+        if isinstance(expires_at, basestring):
+            # values of extra columns are not converted by some backends
+            expires_at = typecast_timestamp(expires_at)
+        if expires_at is not None and (self._valid_until is None or
+            expires_at < self._valid_until):
+            self._valid_until = expires_at
+
+    def _get_key(self, obj):
+        return (get_content_type(obj).id, obj.pk)
+
+    def _fetch_perms(self, model, pks):
+        """
+        Returns pair of dicts mapping given primary keys of ``model``
+        instances to sets of codenames of permissions granted and denied
+        for them directly.
+        """
+        ctype = get_content_type(model)
+        perms = dict((pk, set()) for pk in pks)
+        denied = dict((pk, set()) for pk in pks)
+        if is_sharded():
+            # shards are queried in parallel and by ids only, as they don't
+            # hold users, groups or permissions
+            group_ids = self.user and self.get_group_ids()
+            codenames = dict((perm_id, codename)
+                for codename, perm_id in get_perm_ids(ctype).iteritems())
+
+            def fetch(batch):
+                alias, pks = batch
+                return [(object_id, codenames[perm_id], deny, expires_at)
+                    for object_id, perm_id, deny, expires_at
+                    in self._fetch_perms_rows(model, ctype, pks, alias,
+                        group_ids)]
+            rows = chain(*fan_out(fetch, group_by_shard(ctype, pks).items()))
+        else:
+            rows = self._fetch_perms_rows(model, ctype, pks)
+        if has_roles(ctype):
+            rows = chain(rows, self._fetch_roles_rows(ctype, pks))
+        for object_id, codename, deny, expires_at in rows:
+            self._track_expiry(expires_at)
+            pk = model._meta.pk.to_python(object_id)
+            if deny:
+                denied[pk].add(codename)
+            else:
+                perms[pk].add(codename)
+        return perms, denied
+
+    def _fetch_perms_rows(self, model, ctype, pks, using=None,
+        group_ids=None):
+        """
+        Returns list of ``(object_id, permission, deny, expires_at)`` tuples
+        of active object permissions for given primary keys of ``model``
+        instances. Permission is given by codename or, if ``using`` (shard
+        alias) is given, by id (groups of the user are matched by given
+        ``group_ids`` then).
+        """
+        group_model = get_group_obj_perms_model(model)
+        group_perms = group_model.objects.db_manager(using).active().filter(
+            **group_model.objects.model_lookups(ctype))
+        querysets = []
+        if self.user:
+            user_model = get_user_obj_perms_model(model)
+            querysets.append(user_model.objects.db_manager(using).active()
+                .filter(user=self.user,
+                    **user_model.objects.model_lookups(ctype)))
+            if using is None:
+                querysets.append(group_perms.filter(
+                    get_groups_filter(self.user)))
+            elif group_ids:
+                querysets.append(group_perms.filter(group__in=group_ids))
+        else:
+            querysets.append(group_perms.filter(group=self.group))
+        perm_field = using and 'permission' or 'permission__codename'
+        rows = []
+        for queryset in querysets:
+            field = queryset.model.objects.get_object_field()
+            rows.extend(queryset
+                .filter(**{field + '__in': pks})
+                .values_list(field, perm_field, 'deny', 'expires_at'))
+        return rows
+
+    def _fetch_roles_rows(self, ctype, pks):
+        """
+        Returns list of ``(object_id, codename, False, expires_at)`` tuples of
+        permissions granted by active roles for given primary keys of objects
+        of model represented by ``ctype``.
+        """
+        assignments = []
+        for queryset in get_object_roles(self.user, self.group, ctype):
+            assignments.extend(queryset.filter(object_id__in=pks)
+                .values_list('object_id', 'role', 'expires_at'))
+        perms = get_roles_perms(set(row[1] for row in assignments))
+        all_perms = get_perm_ids(ctype)
+        return [(object_id, codename, False, expires_at)
+            for object_id, role_id, expires_at in assignments
+            for perm_id, codename in perms[role_id]
+            if codename in all_perms]
+
+    def get_group_ids(self):
+        """
+        Returns list of ids of user's groups (including the ones they are
+        nested in, see :mod:`guardian.groups`). Fetched once per checker.
+        """
+        if not hasattr(self, '_group_ids'):
+            self._record_perms_state()
+            self._group_ids = get_group_ids(self.user)
+        return self._group_ids
+
+    def get_global_perms(self, ctype):
+        """
+        Returns set of codenames of model level permissions user/group has for
+        model represented by ``ctype``.
+
+        Global permissions for all models are fetched by single query, the
+        first time they are needed, and stored at the user/group instance
+        itself (just like Django's ``ModelBackend`` does), so they are shared
+        by all checkers created for it.
+        """
+        identity = self.user or self.group
+        try:
+            cache = identity._guardian_global_perms_cache
+        except AttributeError:
+            self._record_perms_state()
+            if self.user:
+                perms = Permission.objects.using(get_read_alias()).filter(
+                    Q(user=self.user) | get_groups_filter(self.user))
+            else:
+                perms = Permission.objects.using(get_read_alias())\
+                    .filter(group=self.group)
+            cache = {}
+            for ctype_id, codename in perms\
+                .values_list('content_type', 'codename').distinct():
+                cache.setdefault(ctype_id, set()).add(codename)
+            identity._guardian_global_perms_cache = cache
+        return cache.get(ctype.id, set())
+
+    def get_perms_filter(self, obj, ctype, deny=False):
+        """
+        Returns ``Q`` object matching ``Permission`` instances granted to
+        user/group for given ``obj`` (or denied, if ``deny`` is ``True``).
+        Object permission tables (generic or *direct* ones, declared for
+        ``obj``'s model) are queried as subqueries, so the whole check
+        (including deny entries, which win over grants) is still a single
+        query. Expired object permissions are skipped. Grants include
+        permissions of roles assigned for ``obj`` (see
+        :class:`guardian.models.Role`), expanded by subqueries too.
+        """
+        group_model = get_group_obj_perms_model(obj)
+        group_perms = group_model.objects.active().filter(deny=deny,
+            **group_model.objects.object_lookups(obj, ctype))
+        if self.user:
+            user_model = get_user_obj_perms_model(obj)
+            user_perms = user_model.objects.active().filter(user=self.user,
+                deny=deny, **user_model.objects.object_lookups(obj, ctype))
+            group_perms = group_perms.filter(get_groups_filter(self.user))
+            perms = (Q(pk__in=user_perms.values('permission')) |
+                Q(pk__in=group_perms.values('permission')))
+        else:
+            group_perms = group_perms.filter(group=self.group)
+            perms = Q(pk__in=group_perms.values('permission'))
+        if not deny and has_roles(ctype):
+            role_perms = Role.permissions.through.objects
+            for roles in get_object_roles(self.user, self.group, ctype):
+                perms |= Q(pk__in=role_perms.filter(role__in=roles
+                    .filter(object_id=obj.pk).values('role'))
+                    .values('permission'))
+        return perms
+
+    def get_expires_at_select(self, obj, ctype, using):
+        """
+        Returns pair of ``extra`` select (dict mapping column names to SQL)
+        and its parameters - scalar subqueries returning the time the first of
+        active object permissions (grants and deny entries) and role
+        assignments of the user/group for ``obj`` expires at, one for each
+        table. Subqueries are compiled for database ``using``.
+        """
+        now = datetime.datetime.now()
+        group_model = get_group_obj_perms_model(obj)
+        group_perms = group_model.objects.active(now).filter(
+            **group_model.objects.object_lookups(obj, ctype))
+        if self.user:
+            user_model = get_user_obj_perms_model(obj)
+            querysets = [user_model.objects.active(now).filter(user=self.user,
+                **user_model.objects.object_lookups(obj, ctype)),
+                group_perms.filter(get_groups_filter(self.user))]
+        else:
+            querysets = [group_perms.filter(group=self.group)]
+        if has_roles(ctype):
+            querysets.extend(roles.filter(object_id=obj.pk) for roles
+                in get_object_roles(self.user, self.group, ctype, now))
+        select = SortedDict()
+        params = []
+        for index, queryset in enumerate(querysets):
+            sql, sql_params = queryset.filter(expires_at__isnull=False)\
+                .order_by('expires_at').values('expires_at')[:1]\
+                .query.get_compiler(using).as_sql()
+            select['guardian_expires_at_%d' % index] = '(%s)' % sql
+            params.extend(sql_params)
+        return select, params
+
+    def get_valid_until(self):
+        """
+        Returns time the first of object permissions and role assignments
+        fetched by the checker (i.e. the earliest one which may change cached
+        permissions) expires at, or ``None`` if none of them expires. It is
+        tracked while permissions are fetched, so no query is made.
+        """
+        return self._valid_until
+
+    def to_bytes(self):
+        """
+        Returns compact (compressed) representation of the checker, holding
+        format version, id of the user/group, stamp of the state of
+        permissions the checker has seen (see :func:`get_perms_state`), time
+        the first of relevant permissions expires at (see
+        :meth:`get_valid_until`), ids of user's groups, fetched model level
+        permissions and cached object permissions encoded as bit masks (see
+        :func:`encode_perms`). Even thousands of cached objects (with
+        consecutive primary keys) take just a few hundred bytes. No query is
+        made; objects with no permissions fetched by :meth:`get_perms` (whose
+        expiration is not known) are left out.
+
+        Pickling a checker stores this representation too.
+        """
+        if self._user_id is not None:
+            identity_type, identity_id = 'user', self._user_id
+            global_perms = self._global_perms_cache
+        else:
+            identity = self._user or self.group
+            identity_type = self._user and 'user' or 'group'
+            identity_id = identity.pk
+            global_perms = getattr(identity, '_guardian_global_perms_cache',
+                None)
+        if global_perms is not None:
+            global_perms = [(ctype_id, tuple(sorted(codenames)))
+                for ctype_id, codenames in sorted(global_perms.iteritems())]
+        valid_until = self.get_valid_until()
+        if valid_until is not None:
+            valid_until = time.mktime(valid_until.timetuple())
+        perms = dict((key, codenames)
+            for key, codenames in self._obj_perms_cache.iteritems()
+            if key not in self._untracked)
+        state = (CHECKER_STATE_VERSION, identity_type, identity_id,
+            self._perms_state or get_perms_state(), valid_until,
+            self.global_perms, getattr(self, '_group_ids', None),
+            global_perms, encode_perms(perms))
+        return zlib.compress(marshal.dumps(state, 2), 9)
+
+    @classmethod
+    def from_bytes(cls, data, user_or_group=None):
+        """
+        Returns checker restored from ``data`` returned by :meth:`to_bytes`.
+        Unless ``user_or_group`` (which has to be the one the checker was
+        created for) is given, user is fetched again when it is needed first
+        (so its flags are current; ``ValueError`` is raised then if it doesn't
+        exist anymore), while group is an instance holding the id only.
+
+        Cached permissions are restored only if no permission changed since
+        the snapshot was taken (its stamp matches :func:`get_perms_state`) and
+        none of them expired; otherwise the checker starts empty and fetches
+        permissions again, as needed.
+
+        ``ValueError`` is raised if ``data`` is malformed or was written by
+        other version of the format (:data:`CHECKER_STATE_VERSION`).
+        """
+        checker = cls.__new__(cls)
+        checker._set_state(data, user_or_group)
+        return checker
+
+    def __getstate__(self):
+        return self.to_bytes()
+
+    def __setstate__(self, data):
+        self._set_state(data, None)
+
+    def _set_state(self, data, user_or_group):
+        try:
+            state = marshal.loads(zlib.decompress(data))
+        except (zlib.error, ValueError, EOFError, TypeError):
+            raise ValueError("Malformed checker state")
+        if not isinstance(state, tuple) or not state or \
+            state[0] != CHECKER_STATE_VERSION:
+            raise ValueError("Unsupported version of checker state")
+        (version, identity_type, identity_id, perms_state, valid_until,
+            global_perms, group_ids, global_perms_cache, perms) = state
+        if user_or_group is None:
+            self.user = None
+            if identity_type == 'user':
+                self._user_id = identity_id
+                self.group = None
+            else:
+                self.group = Group(id=identity_id)
+        else:
+            self.user, self.group = get_identity(user_or_group)
+            if (self.user and 'user' or 'group') != identity_type or \
+                (self.user or self.group).pk != identity_id:
+                raise ValueError("Checker state belongs to other %s" %
+                    identity_type)
+        self.global_perms = global_perms
+        self._obj_perms_cache = {}
+        self._perms_state = None
+        self._valid_until = None
+        self._untracked = set()
+        if perms_state != get_perms_state() or (valid_until is not None and
+            valid_until <= time.time()):
+            # permissions changed or expired since the snapshot was taken
+            return
+        self._perms_state = perms_state
+        if valid_until is not None:
+            self._valid_until = datetime.datetime.fromtimestamp(valid_until)
+        if global_perms_cache is not None:
+            global_perms_cache = dict((ctype_id, set(codenames))
+                for ctype_id, codenames in global_perms_cache)
+            if self._user_id is not None:
+                self._global_perms_cache = global_perms_cache
+            else:
+                identity = self.user or self.group
+                if not hasattr(identity, '_guardian_global_perms_cache'):
+                    identity._guardian_global_perms_cache = \
+                        global_perms_cache
+        if group_ids is not None:
+            self._group_ids = group_ids
+        self._obj_perms_cache = decode_perms(perms)
@@ -0,0 +1,223 @@
+"""
+Feed of object permission changes.
+
+If ``GUARDIAN_CHANGE_SINK`` setting is set, every change of object
+permissions (made by managers, shortcuts, bulk operations, deletes - also
+cascading ones - and ``clean_expired_obj_perms`` command) is described by
+:class:`ObjectPermissionEvent` and passed to the sink, i.e. to keep search
+indexes or caches of other services in sync. Two sinks are available:
+
+- :class:`SignalSink` sends :data:`guardian.signals.obj_perms_changed`
+  signal,
+- :class:`OutboxSink` writes events to
+  :class:`guardian.models.ObjectPermissionChange` table (*outbox*), which may
+  be consumed by other processes.
+
+Any class with ``send(events, using)`` method may be used as a sink.
+
+Changes made by bulk operations are collected and passed to the sink at once,
+with events differing by objects only merged into single event.
+"""
+import threading
+
+from django.contrib.auth.models import Permission
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.functional import wraps
+from django.utils.importlib import import_module
+
+from guardian.conf import settings as guardian_settings
+
+ASSIGNED = 'assigned'
+DENIED = 'denied'
+REMOVED = 'removed'
+
+_state = threading.local()
+_sinks = {}
+
+class ObjectPermissionEvent(object):
+    """
+    Change of permission ``codename`` of objects of type
+    ``content_type_id`` with primary keys ``object_ids``, made for the user or
+    group (``identity_type`` is ``user`` or ``group``) with id
+    ``identity_id``. ``action`` is one of ``assigned``, ``denied`` (deny entry
+    created) or ``removed``.
+
+    Events are recorded for actual changes only - i.e. :meth:`bulk_assign
+    <guardian.managers.BaseObjectPermissionManager.bulk_assign>` doesn't
+    report identities which already had the permission.
+    """
+    def __init__(self, action, identity_type, identity_id, codename,
+        content_type_id, object_ids):
+        self.action = action
+        self.identity_type = identity_type
+        self.identity_id = identity_id
+        self.codename = codename
+        self.content_type_id = content_type_id
+        self.object_ids = list(object_ids)
+
+    def key(self):
+        return (self.action, self.identity_type, self.identity_id,
+            self.codename, self.content_type_id)
+
+    def __eq__(self, other):
+        return isinstance(other, ObjectPermissionEvent) and \
+            self.key() == other.key() and self.object_ids == other.object_ids
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '<ObjectPermissionEvent: %s %s %s:%s %s %s>' % (self.action,
+            self.codename, self.identity_type, self.identity_id,
+            self.content_type_id, self.object_ids)
+
+def get_sink():
+    """
+    Returns sink configured by ``GUARDIAN_CHANGE_SINK`` setting or ``None``.
+    """
+    path = guardian_settings.CHANGE_SINK
+    if not path:
+        return None
+    if path not in _sinks:
+        module_name, _, class_name = path.rpartition('.')
+        try:
+            sink_class = getattr(import_module(module_name), class_name)
+        except (ImportError, AttributeError, ValueError), err:
+            raise ImproperlyConfigured("Cannot load GUARDIAN_CHANGE_SINK %r: "
+                "%s" % (path, err))
+        _sinks[path] = sink_class()
+    return _sinks[path]
+
+def merge_events(events):
+    """
+    Merges consecutive events differing by objects only. Order of the events
+    is kept.
+    """
+    merged = []
+    for event in events:
+        if merged and merged[-1].key() == event.key():
+            object_ids = merged[-1].object_ids
+            object_ids.extend(pk for pk in event.object_ids
+                if pk not in object_ids)
+        else:
+            merged.append(ObjectPermissionEvent(event.action,
+                event.identity_type, event.identity_id, event.codename,
+                event.content_type_id, event.object_ids))
+    return merged
+
+def record(events, using):
+    """
+    Passes ``events`` of changes made at database ``using`` to the sink (or,
+    within a batch, defers it until the batch ends). Does nothing if no sink
+    is configured.
+    """
+    if not events or get_sink() is None:
+        return
+    if getattr(_state, 'depth', 0):
+        pending = _state.pending
+        if pending and pending[-1][0] == using:
+            pending[-1][1].extend(events)
+        else:
+            pending.append((using, list(events)))
+    else:
+        get_sink().send(merge_events(events), using)
+
+def start_batch():
+    """
+    Starts collecting events recorded by current thread. Batches may be
+    nested; events are passed to the sink when the outermost one ends.
+    """
+    if not getattr(_state, 'depth', 0):
+        _state.pending = []
+    _state.depth = getattr(_state, 'depth', 0) + 1
+
+def end_batch(discard=False):
+    """
+    Ends batch started by :func:`start_batch`. Collected events are passed to
+    the sink (grouped by databases) unless ``discard`` is ``True``.
+    """
+    _state.depth -= 1
+    if _state.depth:
+        return
+    pending, _state.pending = _state.pending, []
+    if discard:
+        return
+    for using, events in pending:
+        record(events, using)
+
+def batched(func):
+    """
+    Decorator running ``func`` within a batch. Events are discarded if
+    ``func`` raises an exception.
+    """
+    def wrapper(*args, **kwargs):
+        start_batch()
+        try:
+            result = func(*args, **kwargs)
+        except:
+            end_batch(discard=True)
+            raise
+        end_batch()
+        return result
+    return wraps(func)(wrapper)
+
+def get_codename(ctype_id, perm_id):
+    from guardian.core import get_perm_ids
+    ctype = ContentType.objects.get_for_id(ctype_id)
+    for codename, pk in get_perm_ids(ctype).iteritems():
+        if pk == perm_id:
+            return codename
+    # permission has just been created or is being deleted
+    try:
+        return Permission.objects.get(pk=perm_id).codename
+    except Permission.DoesNotExist:
+        return None
+
+def get_obj_perm_event(obj_perm, action):
+    """
+    Returns :class:`ObjectPermissionEvent` describing ``action`` made with
+    given object permission instance.
+    """
+    manager = obj_perm.__class__.objects
+    opts = obj_perm._meta
+    if manager.is_generic():
+        ctype_id = obj_perm.content_type_id
+        object_id = obj_perm.object_id
+    else:
+        field = opts.get_field('content_object')
+        ctype_id = ContentType.objects.get_for_model(field.rel.to).id
+        object_id = getattr(obj_perm, field.attname)
+    identity_id = getattr(obj_perm,
+        opts.get_field(manager.identity_field).attname)
+    return ObjectPermissionEvent(action, manager.identity_field, identity_id,
+        get_codename(ctype_id, obj_perm.permission_id), ctype_id, [object_id])
+
+class SignalSink(object):
+    """
+    Sends :data:`guardian.signals.obj_perms_changed` signal with list of
+    events and alias of the database.
+    """
+    def send(self, events, using):
+        from guardian.signals import obj_perms_changed
+        obj_perms_changed.send(sender=self.__class__, events=events,
+            using=using)
+
+class OutboxSink(object):
+    """
+    Writes events to :class:`guardian.models.ObjectPermissionChange` table of
+    the database the change was made at (one row per object, all rows with
+    single ``INSERT``). If the change is made within managed transaction,
+    rows are written by the same transaction.
+    """
+    def send(self, events, using):
+        from guardian.managers import insert_objects
+        from guardian.models import ObjectPermissionChange
+        changes = [ObjectPermissionChange(action=event.action,
+            identity_type=event.identity_type,
+            identity_id=event.identity_id,
+            codename=event.codename,
+            content_type_id=event.content_type_id,
+            object_id=unicode(object_id))
+            for event in events for object_id in event.object_ids]
+        insert_objects(ObjectPermissionChange, changes, using)
@@ -0,0 +1,94 @@
+"""
+Nested groups.
+
+Groups may be members of other groups (see :class:`guardian.models.SubGroup`)::
+
+    >>> SubGroup.objects.create(group=staff, subgroup=editors)
+    >>> SubGroup.objects.create(group=editors, subgroup=proofreaders)
+
+If ``GUARDIAN_NESTED_GROUPS`` setting is enabled, object permissions (and
+model level ones, used by ``ObjectPermissionChecker`` as fallback) of a group
+are granted to members of all groups nested in it at any depth - i.e.
+members of ``proofreaders`` are granted permissions of ``staff`` too.
+
+Nesting is resolved by :class:`guardian.models.GroupClosure` table holding
+all ancestor/descendant pairs, which is updated incrementally whenever
+membership is created or deleted, so checks join through it with a
+subquery and depth of nesting doesn't add queries.
+"""
+from django.contrib.auth.models import Group
+from django.db import router
+from django.db.models import F, Q
+
+from guardian.conf import settings as guardian_settings
+from guardian.managers import insert_objects
+from guardian.models import GroupClosure
+
+def get_groups_filter(user, prefix='group__'):
+    """
+    Returns ``Q`` object matching (by relation to ``Group`` given by
+    ``prefix``) groups of ``user`` - the ones user is member of and, if nested
+    groups are enabled, all groups they are nested in.
+    """
+    direct = Q(**{prefix + 'user': user})
+    if not guardian_settings.NESTED_GROUPS:
+        return direct
+    return direct | Q(**{prefix + 'pk__in': GroupClosure.objects
+        .filter(descendant__user=user).values('ancestor')})
+
+def get_group_ids(user):
+    """
+    Returns list of ids of groups of ``user`` (see :func:`get_groups_filter`).
+    Uses single query.
+    """
+    return list(Group.objects.filter(get_groups_filter(user, ''))
+        .values_list('pk', flat=True).distinct())
+
+def with_subgroups(groups):
+    """
+    Returns ``groups`` (list of ids or queryset of ids) or, if nested groups
+    are enabled, ``values`` queryset of ids of them and of all groups nested
+    in them, to be used by ``__in`` lookups.
+    """
+    if not guardian_settings.NESTED_GROUPS:
+        return groups
+    return Group.objects.filter(Q(pk__in=groups) |
+        Q(ancestor_links__ancestor__in=groups)).values('pk')
+
+def update_closure(group_id, subgroup_id, delta, using=None):
+    """
+    Updates :class:`guardian.models.GroupClosure` after membership of group
+    ``subgroup_id`` in group ``group_id`` is created (``delta`` is ``1``) or
+    deleted (``delta`` is ``-1``). Every path leading from ancestors of the
+    group (and the group itself) to descendants of the subgroup (and the
+    subgroup itself) through the membership is added or removed; pairs
+    without any path left are deleted.
+    """
+    using = using or router.db_for_write(GroupClosure)
+    closure = GroupClosure.objects.using(using)
+    ancestors = dict(closure.filter(descendant=group_id)
+        .values_list('ancestor', 'paths'))
+    ancestors[group_id] = 1
+    descendants = dict(closure.filter(ancestor=subgroup_id)
+        .values_list('descendant', 'paths'))
+    descendants[subgroup_id] = 1
+    changes = {}
+    for ancestor, paths_to in ancestors.iteritems():
+        for descendant, paths_from in descendants.iteritems():
+            changes[(ancestor, descendant)] = delta * paths_to * paths_from
+
+    pairs = closure.filter(ancestor__in=ancestors.keys(),
+        descendant__in=descendants.keys())
+    pks_by_change = {}
+    for pk, ancestor, descendant in pairs.values_list('pk', 'ancestor',
+        'descendant'):
+        change = changes.pop((ancestor, descendant))
+        pks_by_change.setdefault(change, []).append(pk)
+    for change, pks in pks_by_change.iteritems():
+        closure.filter(pk__in=pks).update(paths=F('paths') + change)
+    if delta < 0:
+        pairs.filter(paths__lte=0).delete()
+    else:
+        insert_objects(GroupClosure, [GroupClosure(ancestor_id=ancestor,
+            descendant_id=descendant, paths=paths)
+            for (ancestor, descendant), paths in changes.iteritems()], using)
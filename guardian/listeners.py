@@ -1,17 +1,105 @@
 from django.contrib.auth.models import Permission, User, Group
 from django.core.cache import cache
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.db.models.signals import class_prepared, m2m_changed
 
+from guardian import feed
+from guardian.core import clear_all_perms_cache, PERMS_STATE_CACHE_KEY
+from guardian.groups import update_closure
 from guardian.models import UserObjectPermission, GroupObjectPermission
+from guardian.models import UserObjectPermissionBase, GroupObjectPermissionBase
+from guardian.models import SubGroup
+from guardian.models import Role, UserObjectRole, GroupObjectRole
 
-def clear_perm_cache(sender, instance, **kwargs):
+def clear_cached_results(sender, instance, **kwargs):
     key_list = cache.get('guardian.keys', [])
     cache.delete_many(key_list)
     cache.delete('guardian.keys')
 
+def clear_perm_cache(sender, instance, **kwargs):
+    clear_cached_results(sender, instance, **kwargs)
+    # snapshots of checkers taken before are stale now
+    cache.delete(PERMS_STATE_CACHE_KEY)
+
 post_save.connect(clear_perm_cache, sender=UserObjectPermission, dispatch_uid='guardian.listeners')
 post_save.connect(clear_perm_cache, sender=GroupObjectPermission, dispatch_uid='guardian.listeners')
-post_save.connect(clear_perm_cache, sender=Group, dispatch_uid='guardian.listeners')
-post_save.connect(clear_perm_cache, sender=User, dispatch_uid='guardian.listeners')
-post_save.connect(clear_perm_cache, sender=Group, dispatch_uid='guardian.listeners')
+post_delete.connect(clear_perm_cache, sender=UserObjectPermission, dispatch_uid='guardian.listeners')
+post_delete.connect(clear_perm_cache, sender=GroupObjectPermission, dispatch_uid='guardian.listeners')
+# saving users or groups doesn't change any permission
+post_save.connect(clear_cached_results, sender=User, dispatch_uid='guardian.listeners')
+post_save.connect(clear_cached_results, sender=Group, dispatch_uid='guardian.listeners')
+for through in (User.groups.through, User.user_permissions.through,
+    Group.permissions.through):
+    m2m_changed.connect(clear_perm_cache, sender=through,
+        dispatch_uid='guardian.listeners')
+
+def clear_all_perms(sender, instance, **kwargs):
+    clear_all_perms_cache()
+
+post_save.connect(clear_all_perms, sender=Permission, dispatch_uid='guardian.listeners')
+post_delete.connect(clear_all_perms, sender=Permission, dispatch_uid='guardian.listeners')
+
+post_save.connect(clear_all_perms, sender=Role,
+    dispatch_uid='guardian.listeners.clear_all_perms')
+post_delete.connect(clear_all_perms, sender=Role,
+    dispatch_uid='guardian.listeners.clear_all_perms')
+m2m_changed.connect(clear_perm_cache, sender=Role.permissions.through,
+    dispatch_uid='guardian.listeners')
+for model in (Role, UserObjectRole, GroupObjectRole):
+    post_save.connect(clear_perm_cache, sender=model,
+        dispatch_uid='guardian.listeners')
+    post_delete.connect(clear_perm_cache, sender=model,
+        dispatch_uid='guardian.listeners')
+
+def record_obj_perm_saved(sender, instance, **kwargs):
+    action = instance.deny and feed.DENIED or feed.ASSIGNED
+    feed.record([feed.get_obj_perm_event(instance, action)],
+        instance._state.db)
+
+def record_obj_perm_deleted(sender, instance, **kwargs):
+    feed.record([feed.get_obj_perm_event(instance, feed.REMOVED)],
+        instance._state.db)
+
+for model in (UserObjectPermission, GroupObjectPermission):
+    post_save.connect(record_obj_perm_saved, sender=model,
+        dispatch_uid='guardian.listeners.record_obj_perm_saved')
+    post_delete.connect(record_obj_perm_deleted, sender=model,
+        dispatch_uid='guardian.listeners.record_obj_perm_deleted')
+
+def subgroup_saved(sender, instance, created, **kwargs):
+    if created:
+        update_closure(instance.group_id, instance.subgroup_id, 1,
+            instance._state.db)
+
+def subgroup_deleted(sender, instance, **kwargs):
+    # closure is updated before the membership (or any group) is deleted, as
+    # it is used to find paths going through it
+    update_closure(instance.group_id, instance.subgroup_id, -1,
+        instance._state.db)
+
+post_save.connect(subgroup_saved, sender=SubGroup,
+    dispatch_uid='guardian.listeners.subgroup_saved')
+pre_delete.connect(subgroup_deleted, sender=SubGroup,
+    dispatch_uid='guardian.listeners.subgroup_deleted')
+post_save.connect(clear_perm_cache, sender=SubGroup,
+    dispatch_uid='guardian.listeners')
+post_delete.connect(clear_perm_cache, sender=SubGroup,
+    dispatch_uid='guardian.listeners')
+
+def connect_obj_perms_model(sender, **kwargs):
+    """
+    Connects cache clearing and change feed for *direct* object permission
+    models.
+    """
+    if issubclass(sender, (UserObjectPermissionBase, GroupObjectPermissionBase)):
+        post_save.connect(clear_perm_cache, sender=sender,
+            dispatch_uid='guardian.listeners')
+        post_delete.connect(clear_perm_cache, sender=sender,
+            dispatch_uid='guardian.listeners')
+        post_save.connect(record_obj_perm_saved, sender=sender,
+            dispatch_uid='guardian.listeners.record_obj_perm_saved')
+        post_delete.connect(record_obj_perm_deleted, sender=sender,
+            dispatch_uid='guardian.listeners.record_obj_perm_deleted')
 
+class_prepared.connect(connect_obj_perms_model,
+    dispatch_uid='guardian.listeners.connect_obj_perms_model')
@@ -0,0 +1,69 @@
+import datetime
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.db import router, transaction
+
+from guardian import feed
+from guardian.conf import settings as guardian_settings
+from guardian.listeners import clear_perm_cache
+from guardian.models import UserObjectRole, GroupObjectRole
+from guardian.sharding import fan_out
+from guardian.utils import get_obj_perms_models
+
+class Command(NoArgsCommand):
+    """
+    Deletes expired object permissions of all object permission models and
+    expired role assignments.
+
+    Expired rows are found using index on ``expires_at`` column and are
+    deleted in batches (each committed separately), so tables are never
+    locked for long and the command may be safely run frequently (i.e. from
+    cron) on big tables. If object permissions are sharded, shards are
+    cleaned in parallel.
+    """
+    help = "Deletes expired object permissions and role assignments."
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size',
+            default=1000, help="Number of object permissions deleted at "
+            "once [default: %default]"),
+    )
+
+    def handle_noargs(self, **options):
+        batch_size = int(options.get('batch_size') or 1000)
+        verbosity = int(options.get('verbosity', 1))
+        now = datetime.datetime.now()
+        shards = guardian_settings.SHARDS or [None]
+        # role assignments are never sharded
+        tables = [(model, shards) for model in get_obj_perms_models()]
+        tables += [(UserObjectRole, [None]), (GroupObjectRole, [None])]
+        for model, model_shards in tables:
+            deleted = sum(fan_out(lambda using: self.delete_expired(model,
+                using, now, batch_size), model_shards))
+            if deleted:
+                clear_perm_cache(sender=model, instance=None)
+            if verbosity > 0:
+                self.stdout.write("Deleted %d expired %s\n" % (deleted,
+                    model._meta.verbose_name_plural))
+
+    def delete_expired(self, model, using, now, batch_size):
+        """
+        Deletes object permissions (or role assignments) of ``model`` (stored
+        by database ``using``) expired at ``now``, ``batch_size`` rows at
+        once. Returns number of deleted rows.
+        """
+        manager = model.objects.db_manager(using)
+        deleted = 0
+        while True:
+            pks = list(manager.expired(now)
+                .order_by('expires_at')
+                .values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            feed.batched(manager.filter(pk__in=pks).delete)()
+            transaction.commit_unless_managed(
+                using=using or router.db_for_write(model))
+            deleted += len(pks)
+            if len(pks) < batch_size:
+                break
+        return deleted
@@ -1,76 +1,716 @@
-from django.db import models
+import datetime
+
+from django.db import connections, models, router, transaction
+from django.db import IntegrityError
+from django.db.models import Q
+from django.db.models.fields import AutoField, FieldDoesNotExist
+from django.db.models.signals import post_save
 from django.contrib.auth.models import Permission
-from django.contrib.contenttypes.models import ContentType
 
+from guardian import feed
 from guardian.exceptions import ObjectNotPersisted
+from guardian.sharding import is_sharded, get_shard, group_by_shard
+from guardian.sharding import fan_out
+from guardian.utils import get_expires_at, get_content_type
+
+def get_insert_template(connection, ignore_conflicts=False):
+    """
+    Returns template of ``INSERT`` statement (to be filled with ``INTO``
+    clause and rows or ``SELECT``) for given ``connection``. If
+    ``ignore_conflicts`` is ``True``, statement skips rows which would
+    violate unique constraint; ``None`` is returned if the backend doesn't
+    support it.
+    """
+    engine = connection.settings_dict['ENGINE']
+    if not ignore_conflicts:
+        return 'INSERT %s%s'
+    elif 'postgresql' in engine:
+        return 'INSERT %s%s ON CONFLICT DO NOTHING'
+    elif 'sqlite' in engine:
+        return 'INSERT OR IGNORE %s%s'
+    elif 'mysql' in engine:
+        return 'INSERT IGNORE %s%s'
+    return None
+
+def insert_objects(model, objs, using, ignore_conflicts=False):
+    """
+    Inserts given (unsaved) instances of ``model`` into database ``using``
+    with multi-row ``INSERT`` statements (as few as the backend's limit of
+    query parameters allows). If ``ignore_conflicts`` is ``True``,
+    rows which would violate unique constraint are skipped (backend's native
+    support is used if available, otherwise ``IntegrityError`` is caught
+    within a savepoint for each row - rows are inserted in a transaction of
+    their own then, unless transaction is already managed by the caller, as
+    savepoints don't exist outside of transactions). Returns number of
+    created rows. No validation is made and no signals are sent.
+    """
+    if not objs:
+        return 0
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    fields = [f for f in model._meta.local_fields
+        if not isinstance(f, AutoField)]
+    rows = [[f.get_db_prep_save(f.pre_save(obj, True),
+        connection=connection) for f in fields]
+        for obj in objs]
+    row_sql = '(%s)' % ', '.join(['%s'] * len(fields))
+    sql_into = 'INTO %s (%s) VALUES ' % (qn(model._meta.db_table),
+        ', '.join([qn(f.column) for f in fields]))
+
+    engine = connection.settings_dict['ENGINE']
+    template = get_insert_template(connection, ignore_conflicts)
+    cursor = connection.cursor()
+    if template:
+        if 'sqlite' in engine:
+            # SQLite allows at most 999 parameters per query
+            batch_size = max(1, 999 // len(fields))
+        else:
+            batch_size = 1000
+        created = 0
+        for start in xrange(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            cursor.execute(template % (sql_into,
+                ', '.join([row_sql] * len(batch))), sum(batch, []))
+            created += cursor.rowcount
+    else:
+        managed = transaction.is_managed(using=using)
+        if not managed:
+            transaction.enter_transaction_management(using=using)
+            transaction.managed(True, using=using)
+        try:
+            created = _insert_rows(cursor, 'INSERT %s%s' % (sql_into,
+                row_sql), rows, using)
+            if not managed:
+                transaction.commit(using=using)
+        except:
+            if not managed:
+                transaction.rollback(using=using)
+            raise
+        finally:
+            if not managed:
+                transaction.leave_transaction_management(using=using)
+    transaction.commit_unless_managed(using=using)
+    return created
+
+def _insert_rows(cursor, sql, rows, using):
+    """
+    Inserts ``rows`` one by one, each within a savepoint, skipping those
+    which raise ``IntegrityError``. Returns number of created rows.
+    """
+    created = 0
+    for row in rows:
+        sid = transaction.savepoint(using=using)
+        try:
+            cursor.execute(sql, row)
+        except IntegrityError:
+            transaction.savepoint_rollback(sid, using=using)
+        else:
+            transaction.savepoint_commit(sid, using=using)
+            created += 1
+    return created
+
+class BaseObjectPermissionManager(models.Manager):
+    """
+    Base manager for both generic and *direct* (with ``content_object``
+    foreign key) object permission models.
+    """
+
+    def is_generic(self):
+        """
+        Returns ``True`` if managed model points to objects by generic
+        relation (``content_type`` and ``object_id`` pair).
+        """
+        try:
+            self.model._meta.get_field('object_id')
+        except FieldDoesNotExist:
+            return False
+        return True
 
-class UserObjectPermissionManager(models.Manager):
+    def get_object_field(self):
+        """
+        Returns name of the field holding primary key of the object.
+        """
+        if self.is_generic():
+            return 'object_id'
+        return 'content_object'
+
+    def active(self, now=None):
+        """
+        Returns queryset of object permissions which are not expired at
+        ``now`` (current time by default).
+        """
+        now = now or datetime.datetime.now()
+        return self.filter(Q(expires_at__isnull=True) | Q(expires_at__gt=now))
+
+    def expired(self, now=None):
+        """
+        Returns queryset of object permissions expired at ``now`` (current
+        time by default).
+        """
+        return self.filter(expires_at__lte=now or datetime.datetime.now())
 
-    def assign(self, perm, user, obj):
+    def for_object(self, obj, ctype=None):
+        """
+        Returns manager using database which holds object permissions of
+        ``obj`` (its shard, if object permissions are sharded - see
+        :mod:`guardian.sharding`).
+        """
+        ctype = ctype or get_content_type(obj)
+        shard = get_shard(ctype, obj.pk)
+        if shard is None:
+            return self
+        return self.db_manager(shard)
+
+    def model_lookups(self, ctype):
+        """
+        Returns dict of lookups matching rows of all objects of the model
+        represented by given ``ctype``.
+        """
+        if self.is_generic():
+            return {'content_type': ctype}
+        return {}
+
+    def permission_lookups(self, obj, codenames):
+        """
+        Returns dict of lookups matching rows of permissions with given
+        ``codenames`` (of ``obj``'s model, optionally prefixed with
+        ``app_label``). Permissions are matched by ids, so no join with
+        ``Permission`` table (which shards don't have to hold) is needed.
+        Raises ``WrongAppError`` if any of ``codenames`` is prefixed with
+        other app label than the model's one (see
+        :func:`guardian.core.resolve_perm`).
+        """
+        from guardian.core import resolve_perm
+        specs = [resolve_perm(codename, obj) for codename in codenames]
+        return {'permission__in': [spec[1] for spec in specs
+            if spec is not None]}
+
+    def get_permission_id(self, perm, obj):
+        """
+        Returns id of permission ``perm`` (codename, optionally prefixed with
+        ``app_label``) of ``obj``'s model. Raises ``Permission.DoesNotExist``
+        if there is no such permission.
+        """
+        from guardian.core import resolve_perm
+        spec = resolve_perm(perm, obj)
+        if spec is None:
+            raise Permission.DoesNotExist("Permission %r does not exist for "
+                "%s" % (perm, obj._meta.object_name))
+        return spec[1]
+
+    def object_lookups(self, obj, ctype=None):
+        """
+        Returns dict of lookups matching rows of given ``obj``.
+        """
+        if self.is_generic():
+            ctype = ctype or get_content_type(obj)
+            return {'content_type': ctype, 'object_id': obj.pk}
+        return {'content_object': obj}
+
+    def assign_ignore_conflicts(self, perm, identity, obj):
         """
         Assigns permission with given ``perm`` for an instance ``obj`` and
-        ``user``.
+        ``identity`` (user or group, depending on the manager) using single
+        ``INSERT`` statement which silently does nothing if such object
+        permission already exists (only if it does, expired grant is looked
+        for and replaced, which takes more queries). It is safe to call
+        concurrently (no ``IntegrityError`` is raised when other process
+        assigns same permission in the meantime). Returns ``True`` if new row
+        was created. Contrary to :meth:`assign` the object permission is not
+        fetched, so this is the cheapest way to grant permission.
+
+        Backend's native support is used (``INSERT ... ON CONFLICT DO
+        NOTHING`` for PostgreSQL, ``INSERT OR IGNORE`` for SQLite, ``INSERT
+        IGNORE`` for MySQL); for other backends ``IntegrityError`` is caught
+        (within a savepoint) instead.
+        """
+        return bool(self.bulk_assign(perm, [identity], obj))
+
+    @feed.batched
+    def bulk_assign(self, perm, identities, obj, expires_at=None):
+        """
+        Assigns permission with given ``perm`` for an instance ``obj`` to all
+        given ``identities`` (users or groups, depending on the manager) with
+        a single ``INSERT`` statement, skipping already existing grants (see
+        :meth:`assign_ignore_conflicts`). Returns number of newly created
+        object permissions.
+
+        New grants expire at ``expires_at`` (``datetime`` or ``timedelta``),
+        if given. Expired grants are replaced, others (including deny
+        entries) are kept as they are. Expired grants are looked for only if
+        some of the identities already have a row for the permission, so
+        granting new permissions takes single query (plus two if changes are
+        recorded, see :mod:`guardian.feed` - only inserted grants are
+        reported).
+        """
+        if getattr(obj, 'pk', None) is None:
+            raise ObjectNotPersisted("Object %s needs to be persisted first"
+                % obj)
+        ctype = get_content_type(obj)
+        perm_id = self.get_permission_id(perm, obj)
+        lookups = self.object_lookups(obj, ctype)
+        expires_at = get_expires_at(expires_at)
+        manager = self.for_object(obj, ctype)
+        using = manager._db or router.db_for_write(self.model)
+        rows = self.db_manager(using).filter(permission=perm_id, **lookups)\
+            .filter(**{self.identity_field + '__in': identities})
+        if feed.get_sink() is not None:
+            existing = set(rows.values_list('pk', flat=True))
+
+        obj_perms = []
+        for identity in identities:
+            obj_perm = self.model(permission_id=perm_id,
+                expires_at=expires_at, **lookups)
+            setattr(obj_perm, self.identity_field, identity)
+            obj_perms.append(obj_perm)
+        created = self.insert_ignore_conflicts(obj_perms, using=using)
+        if created < len(obj_perms):
+            # some rows conflicted - replace the expired ones, if any
+            expired = list(self.db_manager(using).expired()
+                .filter(permission=perm_id, **lookups)
+                .filter(**{self.identity_field + '__in': identities})
+                .values_list('pk', flat=True))
+            if expired:
+                self.using(using).filter(pk__in=expired).delete()
+                created += self.insert_ignore_conflicts(obj_perms,
+                    using=using)
+        if created:
+            from guardian.listeners import clear_perm_cache
+            clear_perm_cache(sender=self.model, instance=None)
+        if feed.get_sink() is not None:
+            # rows missing before are the inserted ones
+            codename = feed.get_codename(ctype.id, perm_id)
+            feed.record([feed.ObjectPermissionEvent(feed.ASSIGNED,
+                self.identity_field, identity_id, codename, ctype.id,
+                [obj.pk])
+                for pk, identity_id in rows.filter(deny=False)
+                    .values_list('pk', self.identity_field)
+                if pk not in existing], using)
+        return created
+
+    def _assign(self, perm, identity, obj, expires_at=None, deny=False):
+        """
+        Implements ``assign`` of subclasses (and :meth:`deny`, if ``deny`` is
+        ``True``). Row is inserted first (ignoring conflict with existing one,
+        so concurrent calls don't raise ``IntegrityError``) and fetched
+        afterwards; ``post_save`` is sent for created object permission,
+        existing one is updated if needed.
         """
         if getattr(obj, 'pk', None) is None:
             raise ObjectNotPersisted("Object %s needs to be persisted first"
                 % obj)
-        ctype = ContentType.objects.get_for_model(obj)
-        permission = Permission.objects.get(
-            content_type=ctype, codename=perm)
-
-        obj_perm, created = self.get_or_create(
-            content_type = ctype,
-            permission = permission,
-            object_id = obj.pk,
-            user = user)
+        ctype = get_content_type(obj)
+        perm_id = self.get_permission_id(perm, obj)
+        lookups = self.object_lookups(obj, ctype)
+        lookups[self.identity_field] = identity
+        expires_at = get_expires_at(expires_at)
+        manager = self.for_object(obj, ctype)
+        using = manager._db or router.db_for_write(self.model)
+
+        created = self.insert_ignore_conflicts([self.model(
+            permission_id=perm_id, expires_at=expires_at, deny=deny,
+            **lookups)], using=using)
+        obj_perm = self.using(using).get(permission=perm_id, **lookups)
+        if created:
+            post_save.send(sender=self.model, instance=obj_perm, created=True,
+                raw=False, using=using)
+        elif obj_perm.deny != deny or obj_perm.expires_at != expires_at:
+            obj_perm.deny = deny
+            obj_perm.expires_at = expires_at
+            obj_perm.save()
         return obj_perm
 
-    def remove_perm(self, perm, user, obj):
+    def insert_ignore_conflicts(self, obj_perms, using=None):
         """
-        Removes permission ``perm`` for an instance ``obj`` and given ``user``.
+        Inserts given (unsaved) object permission instances skipping those
+        which would violate unique constraint. Returns number of created rows.
+        No validation is made and no signals are sent.
+        """
+        return insert_objects(self.model, obj_perms,
+            using or router.db_for_write(self.model), ignore_conflicts=True)
+
+    def deny(self, perm, identity, obj, expires_at=None):
+        """
+        Creates deny entry for permission ``perm``, an instance ``obj`` and
+        ``identity`` (user or group, depending on the manager), revoking the
+        permission even if it is granted otherwise. Existing grant of the
+        permission is turned into deny entry. If ``expires_at`` (``datetime``
+        or ``timedelta``) is given, entry is effective until that time only.
+        Safe to call concurrently, just like ``assign``.
+        """
+        return self._assign(perm, identity, obj, expires_at, deny=True)
+
+    @feed.batched
+    def copy_perms(self, source_obj, target_objs):
+        """
+        Copies object permissions (grants and deny entries, except expired
+        ones) of ``source_obj`` to all ``target_objs`` (instances of the same
+        model). Object permissions the targets already have are kept as they
+        are. Returns number of created object permissions.
+
+        Rows are copied by the database itself, using ``INSERT ... SELECT``
+        statement for each batch of targets. If object permissions are
+        sharded (or the backend can't skip conflicting rows natively) rows of
+        ``source_obj`` are read once and inserted with multi-row ``INSERT``
+        statements instead.
+        """
+        if getattr(source_obj, 'pk', None) is None:
+            raise ObjectNotPersisted("Object %s needs to be persisted first"
+                % source_obj)
+        ctype = get_content_type(source_obj)
+        target_pks = []
+        for obj in target_objs:
+            if getattr(obj, 'pk', None) is None:
+                raise ObjectNotPersisted("Object %s needs to be persisted "
+                    "first" % obj)
+            if get_content_type(obj) != ctype:
+                raise ValueError("Cannot copy permissions of %s to %s "
+                    "(different models)" % (source_obj, obj))
+            if obj.pk != source_obj.pk:
+                target_pks.append(obj.pk)
+        if not target_pks:
+            return 0
+
+        now = datetime.datetime.now()
+        source = self.for_object(source_obj, ctype).active(now)\
+            .filter(**self.object_lookups(source_obj, ctype))
+        if feed.get_sink() is not None:
+            keys = list(source.values_list(self.identity_field, 'permission'))
+            existing = self._get_target_rows(ctype, target_pks, keys)
+
+        using = source._db or router.db_for_write(self.model)
+        connection = connections[using]
+        template = get_insert_template(connection, ignore_conflicts=True)
+        if is_sharded() or template is None:
+            created = self._copy_rows(list(source), ctype, target_pks)
+        else:
+            created = self._copy_by_select(template, source_obj, ctype,
+                target_pks, now, using)
+        if created:
+            from guardian.listeners import clear_perm_cache
+            clear_perm_cache(sender=self.model, instance=None)
+        if feed.get_sink() is not None:
+            self._record_copied(ctype, existing,
+                self._get_target_rows(ctype, target_pks, keys))
+        return created
+
+    def _get_target_rows(self, ctype, target_pks, keys):
+        """
+        Returns dict mapping shard alias to set of ``(identity_id,
+        permission_id, object_pk, deny)`` rows of targets matching any of
+        ``(identity_id, permission_id)`` ``keys``.
+        """
+        if not keys:
+            return {}
+        object_field = self.get_object_field()
+        lookups = {
+            self.identity_field + '__in': set(key[0] for key in keys),
+            'permission__in': set(key[1] for key in keys),
+        }
+        if self.is_generic():
+            lookups['content_type'] = ctype
+        keys = set(keys)
+        rows = {}
+        for alias, pks in group_by_shard(ctype, target_pks).iteritems():
+            # generic relations may store primary keys as strings
+            pks = dict((unicode(pk), pk) for pk in pks)
+            lookups[object_field + '__in'] = pks.values()
+            rows[alias] = set((identity_id, perm_id, pks[unicode(pk)], deny)
+                for identity_id, perm_id, pk, deny in self
+                    .db_manager(alias or router.db_for_write(self.model))
+                    .filter(**lookups).values_list(self.identity_field,
+                        'permission', object_field, 'deny')
+                if (identity_id, perm_id) in keys)
+        return rows
+
+    def _record_copied(self, ctype, existing, rows):
+        """
+        Records events for copied object permissions - ``rows`` (see
+        :meth:`_get_target_rows`) of targets missing in ``existing`` ones.
+        """
+        for alias, shard_rows in rows.iteritems():
+            keys = set(row[:3] for row in existing.get(alias, ()))
+            feed.record([feed.ObjectPermissionEvent(
+                deny and feed.DENIED or feed.ASSIGNED, self.identity_field,
+                identity_id, feed.get_codename(ctype.id, perm_id), ctype.id,
+                [pk]) for identity_id, perm_id, pk, deny in sorted(shard_rows)
+                if (identity_id, perm_id, pk) not in keys],
+                alias or router.db_for_write(self.model))
+
+    def _copy_rows(self, obj_perms, ctype, target_pks):
+        fields = [f for f in self.model._meta.local_fields
+            if not isinstance(f, AutoField)]
+        object_field = self.model._meta.get_field(self.get_object_field())
+        created = 0
+        for alias, pks in group_by_shard(ctype, target_pks).iteritems():
+            copies = []
+            for pk in pks:
+                for obj_perm in obj_perms:
+                    copy = self.model()
+                    for field in fields:
+                        setattr(copy, field.attname,
+                            getattr(obj_perm, field.attname))
+                    setattr(copy, object_field.attname, pk)
+                    copies.append(copy)
+            created += insert_objects(self.model, copies,
+                alias or router.db_for_write(self.model),
+                ignore_conflicts=True)
+        return created
+
+    def _copy_by_select(self, template, source_obj, ctype, target_pks, now,
+        using):
+        connection = connections[using]
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        fields = [f for f in opts.local_fields
+            if not isinstance(f, AutoField)]
+        object_field = opts.get_field(self.get_object_field())
+        select = []
+        for field in fields:
+            if field is object_field:
+                select.append('t.target_id')
+            else:
+                select.append('s.%s' % qn(field.column))
+        expires_at = qn(opts.get_field('expires_at').column)
+        where = ['s.%s = %%s' % qn(object_field.column),
+            '(s.%s IS NULL OR s.%s > %%s)' % (expires_at, expires_at)]
+        where_params = [
+            object_field.get_db_prep_save(source_obj.pk,
+                connection=connection),
+            connection.ops.value_to_db_datetime(now)]
+        if self.is_generic():
+            where.append('s.%s = %%s' %
+                qn(opts.get_field('content_type').column))
+            where_params.append(ctype.id)
+        sql_into = 'INTO %s (%s) ' % (qn(opts.db_table),
+            ', '.join([qn(f.column) for f in fields]))
+
+        cursor = connection.cursor()
+        created = 0
+        # targets are given by UNION of SELECTs, SQLite allows at most 500
+        # of them in a single statement
+        for start in xrange(0, len(target_pks), 400):
+            batch = target_pks[start:start + 400]
+            targets = ['SELECT %s AS target_id'] + \
+                ['SELECT %s'] * (len(batch) - 1)
+            sql = 'SELECT %s FROM %s s, (%s) t WHERE %s' % (
+                ', '.join(select), qn(opts.db_table),
+                ' UNION ALL '.join(targets), ' AND '.join(where))
+            params = [object_field.get_db_prep_save(pk,
+                connection=connection) for pk in batch] + where_params
+            cursor.execute(template % (sql_into, sql), params)
+            created += cursor.rowcount
+        transaction.commit_unless_managed(using=using)
+        return created
+
+    def transfer(self, from_identity, to_identity, ctypes=None, using=None,
+        chunk_size=1000):
+        """
+        Moves object permissions (grants and deny entries) of
+        ``from_identity`` to ``to_identity`` (users or groups, depending on
+        the manager). Object permissions ``to_identity`` already has for the
+        same permission and object are kept, conflicting ones of
+        ``from_identity`` are deleted. If ``ctypes`` (list of
+        ``ContentType`` instances) is given, only object permissions for
+        objects of these types are moved. Returns number of moved object
+        permissions.
+
+        Rows are processed ``chunk_size`` at once (each chunk is committed
+        separately unless transaction is managed) with a few set based
+        statements per chunk, so identities with millions of object
+        permissions don't need to be loaded into memory nor lock tables for
+        long. ``using`` is alias of the database (shard) to process.
+
+        Nothing is moved (and ``0`` is returned) if both identities are the
+        same.
+        """
+        if getattr(from_identity, 'pk', from_identity) == \
+            getattr(to_identity, 'pk', to_identity):
+            return 0
+        if not self.is_generic() and ctypes is not None:
+            model = self.model._meta.get_field('content_object').rel.to
+            if get_content_type(model) not in ctypes:
+                return 0
+        manager = self.db_manager(using or router.db_for_write(self.model))
+        queryset = manager.filter(**{self.identity_field: from_identity})
+        if self.is_generic() and ctypes is not None:
+            queryset = queryset.filter(content_type__in=ctypes)
+        if self.is_generic():
+            key_fields = ['permission', 'content_type', 'object_id']
+        else:
+            key_fields = ['permission', 'content_object']
+        moved = 0
+        while True:
+            rows = list(queryset.order_by('pk')
+                .values_list('pk', 'deny', *key_fields)[:chunk_size])
+            if not rows:
+                break
+            moved += feed.batched(self._transfer_rows)(manager, rows,
+                key_fields, from_identity, to_identity)
+        if moved:
+            from guardian.listeners import clear_perm_cache
+            clear_perm_cache(sender=self.model, instance=None)
+        return moved
+
+    def _transfer_rows(self, manager, rows, key_fields, from_identity,
+        to_identity):
+        """
+        Moves given ``(pk, deny, key...)`` rows to ``to_identity``, deleting
+        those conflicting with its own object permissions. Returns number of
+        moved rows.
+        """
+        keys = dict((tuple(row[2:]), row[0]) for row in rows)
+        lookups = {self.identity_field: to_identity}
+        for index, field in enumerate(key_fields):
+            lookups[field + '__in'] = set(row[2 + index] for row in rows)
+        conflicting = set(keys[key] for key in manager.filter(**lookups)
+            .values_list(*key_fields) if key in keys)
+        if conflicting:
+            manager.filter(pk__in=conflicting).delete()
+        rows = [row for row in rows if row[0] not in conflicting]
+        manager.filter(pk__in=[row[0] for row in rows])\
+            .update(**{self.identity_field: to_identity})
+
+        if feed.get_sink() is not None:
+            if self.is_generic():
+                get_ctype_id = lambda row: row[3]
+            else:
+                model = self.model._meta.get_field('content_object').rel.to
+                ctype_id = get_content_type(model).id
+                get_ctype_id = lambda row: ctype_id
+            events = []
+            # sorted so that events differing by objects only get merged
+            for row in sorted(rows, key=lambda row: row[2:]):
+                events.append(feed.ObjectPermissionEvent(feed.REMOVED,
+                    self.identity_field, from_identity.pk,
+                    feed.get_codename(get_ctype_id(row), row[2]),
+                    get_ctype_id(row), [row[-1]]))
+            for row in sorted(rows, key=lambda row: (row[1], row[2:])):
+                events.append(feed.ObjectPermissionEvent(
+                    row[1] and feed.DENIED or feed.ASSIGNED,
+                    self.identity_field, to_identity.pk,
+                    feed.get_codename(get_ctype_id(row), row[2]),
+                    get_ctype_id(row), [row[-1]]))
+            feed.record(events, manager.db)
+        return len(rows)
+
+    def get_for_object(self, identity, obj):
+        """
+        Returns queryset of object permissions (including expired ones and
+        deny entries) of ``identity`` (user or group, depending on the
+        manager) for an instance ``obj``.
         """
         if getattr(obj, 'pk', None) is None:
             raise ObjectNotPersisted("Object %s needs to be persisted first"
                 % obj)
-        self.filter(
-            permission__codename=perm,
-            user=user,
-            object_id=obj.pk,
-            content_type=ContentType.objects.get_for_model(obj))\
-            .delete()
+        ctype = get_content_type(obj)
+        return self.for_object(obj, ctype)\
+            .filter(**{self.identity_field: identity})\
+            .filter(**self.object_lookups(obj, ctype))
+
+    def get_for_objects(self, identity, objs):
+        """
+        Returns dict mapping primary keys of given ``objs`` (instances of the
+        same model) to lists of object permissions (see
+        :meth:`get_for_object`) of ``identity`` for them. Object permissions
+        are fetched with one query (per shard, if object permissions are
+        sharded), together with their permissions.
+        """
+        objs = list(objs)
+        for obj in objs:
+            if getattr(obj, 'pk', None) is None:
+                raise ObjectNotPersisted("Object %s needs to be persisted "
+                    "first" % obj)
+        result = dict((obj.pk, []) for obj in objs)
+        if not objs:
+            return result
+        ctype = get_content_type(objs[0])
+        object_field = self.model._meta.get_field(self.get_object_field())
 
-    def get_for_object(self, user, obj):
+        def fetch(item):
+            alias, pks = item
+            queryset = self.db_manager(alias)\
+                .filter(**{self.identity_field: identity})\
+                .filter(**self.model_lookups(ctype))\
+                .filter(**{object_field.name + '__in': pks})
+            if alias is None:
+                queryset = queryset.select_related('permission')
+            return list(queryset)
+        obj_perms = sum(fan_out(fetch,
+            group_by_shard(ctype, result.keys()).items()), [])
+        if is_sharded():
+            # shards don't hold permissions, they can't be joined
+            perms = Permission.objects.in_bulk(set(obj_perm.permission_id
+                for obj_perm in obj_perms))
+            for obj_perm in obj_perms:
+                obj_perm.permission = perms[obj_perm.permission_id]
+
+        to_python = objs[0]._meta.pk.to_python
+        for obj_perm in obj_perms:
+            pk = to_python(getattr(obj_perm, object_field.attname))
+            result[pk].append(obj_perm)
+        return result
+
+    @feed.batched
+    def bulk_remove_perm(self, perm, identities, obj):
+        """
+        Removes permission ``perm`` for an instance ``obj`` from all given
+        ``identities`` (users or groups, depending on the manager) at once.
+        """
         if getattr(obj, 'pk', None) is None:
             raise ObjectNotPersisted("Object %s needs to be persisted first"
                 % obj)
-        ctype = ContentType.objects.get_for_model(obj)
-        perms = self.filter(
-            content_type = ctype,
-            user = user,
-        )
-        return perms
+        ctype = get_content_type(obj)
+        self.for_object(obj, ctype)\
+            .filter(**self.permission_lookups(obj, [perm]))\
+            .filter(**self.object_lookups(obj, ctype))\
+            .filter(**{self.identity_field + '__in': identities})\
+            .delete()
 
-class GroupObjectPermissionManager(models.Manager):
+class UserObjectPermissionManager(BaseObjectPermissionManager):
+    identity_field = 'user'
 
-    def assign(self, perm, group, obj):
+    def assign(self, perm, user, obj, expires_at=None):
         """
         Assigns permission with given ``perm`` for an instance ``obj`` and
-        ``group``.
+        ``user``. If ``expires_at`` (``datetime`` or ``timedelta``) is given,
+        permission is granted until that time only; otherwise it never
+        expires (also if it was assigned with expiration time before). Deny
+        entry for the permission is turned into a grant. Safe to call
+        concurrently - see :meth:`assign_ignore_conflicts`.
+        """
+        return self._assign(perm, user, obj, expires_at)
+
+    @feed.batched
+    def remove_perm(self, perm, user, obj):
+        """
+        Removes permission ``perm`` for an instance ``obj`` and given ``user``.
         """
         if getattr(obj, 'pk', None) is None:
             raise ObjectNotPersisted("Object %s needs to be persisted first"
                 % obj)
-        ctype = ContentType.objects.get_for_model(obj)
-        permission = Permission.objects.get(
-            content_type=ctype, codename=perm)
-
-        obj_perm, created = self.get_or_create(
-            content_type = ctype,
-            permission = permission,
-            object_id = obj.pk,
-            group = group)
-        return obj_perm
+        ctype = get_content_type(obj)
+        self.for_object(obj, ctype)\
+            .filter(**self.permission_lookups(obj, [perm]))\
+            .filter(user=user, **self.object_lookups(obj, ctype))\
+            .delete()
 
+
+class GroupObjectPermissionManager(BaseObjectPermissionManager):
+    identity_field = 'group'
+
+    def assign(self, perm, group, obj, expires_at=None):
+        """
+        Assigns permission with given ``perm`` for an instance ``obj`` and
+        ``group``. If ``expires_at`` (``datetime`` or ``timedelta``) is given,
+        permission is granted until that time only; otherwise it never
+        expires (also if it was assigned with expiration time before). Deny
+        entry for the permission is turned into a grant. Safe to call
+        concurrently - see :meth:`assign_ignore_conflicts`.
+        """
+        return self._assign(perm, group, obj, expires_at)
+
+    @feed.batched
     def remove_perm(self, perm, group, obj):
         """
         Removes permission ``perm`` for an instance ``obj`` and given ``group``.
@@ -78,21 +718,186 @@ class GroupObjectPermissionManager(models.Manager):
         if getattr(obj, 'pk', None) is None:
             raise ObjectNotPersisted("Object %s needs to be persisted first"
                 % obj)
-        self.filter(
-            permission__codename=perm,
-            group=group,
-            object_id=obj.pk,
-            content_type=ContentType.objects.get_for_model(obj))\
+        ctype = get_content_type(obj)
+        self.for_object(obj, ctype)\
+            .filter(**self.permission_lookups(obj, [perm]))\
+            .filter(group=group, **self.object_lookups(obj, ctype))\
             .delete()
 
-    def get_for_object(self, group, obj):
-        if getattr(obj, 'pk', None) is None:
-            raise ObjectNotPersisted("Object %s needs to be persisted first"
-                % obj)
-        ctype = ContentType.objects.get_for_model(obj)
-        perms = self.filter(
-            content_type = ctype,
-            group = group,
-        )
-        return perms
 
+class ObjectRoleManager(models.Manager):
+    """
+    Base manager for role assignment models (see
+    :class:`guardian.models.Role`).
+    """
+
+    def active(self, now=None):
+        """
+        Returns queryset of role assignments which are not expired at ``now``
+        (current time by default).
+        """
+        now = now or datetime.datetime.now()
+        return self.filter(Q(expires_at__isnull=True) | Q(expires_at__gt=now))
+
+    def expired(self, now=None):
+        """
+        Returns queryset of role assignments expired at ``now`` (current time
+        by default).
+        """
+        return self.filter(expires_at__lte=now or datetime.datetime.now())
+
+    def get_role(self, role, model):
+        """
+        Returns ``role`` given either as :class:`guardian.models.Role`
+        instance or by name of a role of ``model`` (model instance or class).
+        Raises ``Role.DoesNotExist`` if there is no such role.
+        """
+        role_model = self.model._meta.get_field('role').rel.to
+        ctype = get_content_type(model)
+        if isinstance(role, role_model):
+            if role.content_type_id != ctype.id:
+                raise role_model.DoesNotExist("Role %s is not designed for "
+                    "%s" % (role, ctype))
+            return role
+        return role_model.objects.get(name=role, content_type=ctype)
+
+    def assign(self, role, identities, objs, expires_at=None):
+        """
+        Assigns ``role`` for all ``objs`` (instances of the same model) to all
+        given ``identities`` (users or groups, depending on the manager) with
+        a single ``INSERT`` statement, skipping already existing assignments.
+        Returns number of newly created assignments.
+
+        New assignments expire at ``expires_at`` (``datetime`` or
+        ``timedelta``), if given. Expired assignments are replaced.
+        """
+        objs = list(objs)
+        for obj in objs:
+            if getattr(obj, 'pk', None) is None:
+                raise ObjectNotPersisted("Object %s needs to be persisted "
+                    "first" % obj)
+        if not objs or not identities:
+            return 0
+        role = self.get_role(role, objs[0])
+        expires_at = get_expires_at(expires_at)
+        using = self._db or router.db_for_write(self.model)
+        assignments = self.db_manager(using).filter(role=role,
+            object_id__in=[obj.pk for obj in objs],
+            **{self.identity_field + '__in': identities})
+        assignments.filter(expires_at__lte=datetime.datetime.now()).delete()
+
+        object_roles = []
+        for obj in objs:
+            for identity in identities:
+                object_role = self.model(role=role,
+                    content_type_id=role.content_type_id, object_id=obj.pk,
+                    expires_at=expires_at)
+                setattr(object_role, self.identity_field, identity)
+                object_roles.append(object_role)
+        created = insert_objects(self.model, object_roles, using,
+            ignore_conflicts=True)
+        if created:
+            from guardian.listeners import clear_perm_cache
+            clear_perm_cache(sender=self.model, instance=None)
+        return created
+
+    def remove(self, role, identities, objs):
+        """
+        Removes ``role`` for all ``objs`` (instances of the same model) from
+        all given ``identities``.
+        """
+        objs = list(objs)
+        if not objs or not identities:
+            return
+        role = self.get_role(role, objs[0])
+        self.db_manager(self._db or router.db_for_write(self.model))\
+            .filter(role=role, object_id__in=[obj.pk for obj in objs])\
+            .filter(**{self.identity_field + '__in': identities})\
+            .delete()
+
+    def copy(self, source_obj, target_objs):
+        """
+        Copies role assignments for ``source_obj`` to all ``target_objs``
+        (instances of the same model) with multi-row ``INSERT`` statements.
+        Expired assignments are not copied (expired ones of the targets are
+        replaced), assignments the targets already have are kept as they are.
+        Returns number of created assignments.
+        """
+        target_objs = list(target_objs)
+        for obj in [source_obj] + target_objs:
+            if getattr(obj, 'pk', None) is None:
+                raise ObjectNotPersisted("Object %s needs to be persisted "
+                    "first" % obj)
+        target_pks = [obj.pk for obj in target_objs
+            if obj.pk != source_obj.pk]
+        ctype = get_content_type(source_obj)
+        manager = self.db_manager(self._db or router.db_for_write(self.model))
+        rows = list(manager.active()
+            .filter(content_type=ctype, object_id=source_obj.pk)
+            .values_list(self.identity_field, 'role', 'expires_at'))
+        if not rows or not target_pks:
+            return 0
+        manager.expired().filter(content_type=ctype,
+            object_id__in=target_pks).delete()
+
+        object_roles = []
+        for pk in target_pks:
+            for identity_id, role_id, expires_at in rows:
+                object_role = self.model(role_id=role_id,
+                    content_type_id=ctype.id, object_id=pk,
+                    expires_at=expires_at)
+                setattr(object_role, self.identity_field + '_id', identity_id)
+                object_roles.append(object_role)
+        created = insert_objects(self.model, object_roles, manager.db,
+            ignore_conflicts=True)
+        if created:
+            from guardian.listeners import clear_perm_cache
+            clear_perm_cache(sender=self.model, instance=None)
+        return created
+
+    def transfer(self, from_identity, to_identity, ctypes=None,
+        chunk_size=1000):
+        """
+        Moves role assignments of ``from_identity`` to ``to_identity`` (users
+        or groups, depending on the manager), ``chunk_size`` rows at once.
+        Assignments ``to_identity`` already has for the same role and object
+        are kept, conflicting ones of ``from_identity`` are deleted. If
+        ``ctypes`` (list of ``ContentType`` instances) is given, only
+        assignments for objects of these types are moved. Returns number of
+        moved assignments.
+        """
+        if getattr(from_identity, 'pk', from_identity) == \
+            getattr(to_identity, 'pk', to_identity):
+            return 0
+        manager = self.db_manager(self._db or router.db_for_write(self.model))
+        queryset = manager.filter(**{self.identity_field: from_identity})
+        if ctypes is not None:
+            queryset = queryset.filter(content_type__in=ctypes)
+        moved = 0
+        while True:
+            rows = list(queryset.order_by('pk')
+                .values_list('pk', 'role', 'object_id')[:chunk_size])
+            if not rows:
+                break
+            keys = dict(((row[1], row[2]), row[0]) for row in rows)
+            conflicting = set(keys[key] for key in manager
+                .filter(role__in=set(row[1] for row in rows),
+                    object_id__in=set(row[2] for row in rows),
+                    **{self.identity_field: to_identity})
+                .values_list('role', 'object_id') if key in keys)
+            if conflicting:
+                manager.filter(pk__in=conflicting).delete()
+            pks = [row[0] for row in rows if row[0] not in conflicting]
+            manager.filter(pk__in=pks)\
+                .update(**{self.identity_field: to_identity})
+            moved += len(pks)
+        if moved:
+            from guardian.listeners import clear_perm_cache
+            clear_perm_cache(sender=self.model, instance=None)
+        return moved
+
+class UserObjectRoleManager(ObjectRoleManager):
+    identity_field = 'user'
+
+class GroupObjectRoleManager(ObjectRoleManager):
+    identity_field = 'group'
@@ -1,22 +1,62 @@
+import datetime
+
 from django.db import models
-from django.core.exceptions import ValidationError
+from django.core.exceptions import ImproperlyConfigured, ValidationError
 from django.contrib.auth.models import User, Group, Permission
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import generic
 
+from guardian.conf import settings as guardian_settings
 from guardian.managers import UserObjectPermissionManager
 from guardian.managers import GroupObjectPermissionManager
+from guardian.managers import UserObjectRoleManager
+from guardian.managers import GroupObjectRoleManager
 from guardian.utils import get_anonymous_user
+from guardian.utils import get_user_obj_perms_model
+from guardian.utils import get_group_obj_perms_model
+
+def get_object_id_field(kind):
+    """
+    Returns new field instance to be used as ``object_id`` column of generic
+    object permission models.
+
+    :param kind: one of ``integer`` (default, ``PositiveIntegerField``),
+      ``bigint``, ``uuid`` or ``char``; for ``uuid`` ``UUIDField`` is used if
+      available, otherwise ``CharField`` big enough for hex representation
+    """
+    if kind == 'integer':
+        return models.PositiveIntegerField(db_index=True)
+    elif kind == 'bigint':
+        return models.BigIntegerField(db_index=True)
+    elif kind == 'uuid':
+        if hasattr(models, 'UUIDField'):
+            return models.UUIDField(db_index=True)
+        return models.CharField(max_length=36, db_index=True)
+    elif kind == 'char':
+        return models.CharField(max_length=255, db_index=True)
+    raise ImproperlyConfigured("GUARDIAN_OBJECT_ID_FIELD should be one of "
+        "'integer', 'bigint', 'uuid' or 'char' (got %r)" % kind)
 
 class BaseObjectPermission(models.Model):
     """
-    Abstract ObjectPermission class.
+    Abstract ObjectPermission class. Concrete object permission models should
+    extend one of :class:`UserObjectPermissionBase` or
+    :class:`GroupObjectPermissionBase` and either mix in
+    :class:`BaseGenericObjectPermission` (generic relation to any model) or
+    define ``content_object`` foreign key to the model they hold permissions
+    for.
+
+    Object permission with ``expires_at`` set is granted until that time only
+    (expired rows are ignored by checks and may be deleted by
+    ``clean_expired_obj_perms`` management command).
+
+    Object permission with ``deny`` set is a *deny entry* - it revokes the
+    permission even if it is granted otherwise (i.e. through a group or by
+    object's parent).
     """
     permission = models.ForeignKey(Permission)
-
-    content_type = models.ForeignKey(ContentType)
-    object_id = models.PositiveIntegerField()
-    content_object = generic.GenericForeignKey()
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    deny = models.BooleanField(default=False)
 
     class Meta:
         abstract = True
@@ -27,39 +67,233 @@ class BaseObjectPermission(models.Model):
             unicode(getattr(self, 'user', False) or self.group),
             unicode(self.permission.codename))
 
+    def get_content_type(self):
+        """
+        Returns ``ContentType`` of the object this permission is assigned for.
+        """
+        model = self._meta.get_field('content_object').rel.to
+        return ContentType.objects.get_for_model(model)
+
     def save(self, *args, **kwargs):
-        if self.content_type != self.permission.content_type:
+        from guardian.core import get_perm_ids
+        content_type = self.get_content_type()
+        # checked against cached ids, so permission is not fetched
+        if self.permission_id not in get_perm_ids(content_type).values():
             raise ValidationError("Cannot persist permission not designed for "
                 "this class (permission's type is %s and object's type is %s)"
-                % (self.permission.content_type, self.content_type))
+                % (self.permission.content_type, content_type))
         return super(BaseObjectPermission, self).save(*args, **kwargs)
 
-class UserObjectPermission(BaseObjectPermission):
+class BaseGenericObjectPermission(models.Model):
+    """
+    Abstract mixin pointing object permission to the object by generic
+    relation. Type of ``object_id`` column may be configured with
+    ``GUARDIAN_OBJECT_ID_FIELD`` setting (see :ref:`configuration`).
+    """
+    content_type = models.ForeignKey(ContentType)
+    object_id = get_object_id_field(guardian_settings.OBJECT_ID_FIELD)
+    content_object = generic.GenericForeignKey()
+
+    class Meta:
+        abstract = True
+
+    def get_content_type(self):
+        return self.content_type
+
+class UserObjectPermissionBase(BaseObjectPermission):
+    """
+    Abstract base for user object permission models.
+
+    Besides generic :class:`UserObjectPermission` one may declare *direct*
+    permission table for a single model, with real foreign key to it::
+
+        class ProjectUserObjectPermission(UserObjectPermissionBase):
+            content_object = models.ForeignKey(Project)
+
+    Such table is detected automatically and is used (instead of generic one)
+    by managers, ``ObjectPermissionChecker``, shortcuts and the backend for
+    all ``Project`` instances.
+    """
     user = models.ForeignKey(User)
 
     objects = UserObjectPermissionManager()
 
     class Meta:
-        unique_together = ['user', 'permission', 'content_type', 'object_id']
+        abstract = True
+        unique_together = ['user', 'permission', 'content_object']
 
-class GroupObjectPermission(BaseObjectPermission):
+class GroupObjectPermissionBase(BaseObjectPermission):
+    """
+    Abstract base for group object permission models. See
+    :class:`UserObjectPermissionBase` for information on *direct* tables.
+    """
     group = models.ForeignKey(Group)
 
     objects = GroupObjectPermissionManager()
 
+    class Meta:
+        abstract = True
+        unique_together = ['group', 'permission', 'content_object']
+
+class UserObjectPermission(BaseGenericObjectPermission,
+    UserObjectPermissionBase):
+
+    class Meta:
+        unique_together = ['user', 'permission', 'content_type', 'object_id']
+
+class GroupObjectPermission(BaseGenericObjectPermission,
+    GroupObjectPermissionBase):
+
     class Meta:
         unique_together = ['group', 'permission', 'content_type', 'object_id']
 
+class Role(models.Model):
+    """
+    Named set of permissions of a model (i.e. *editor* of documents), which
+    may be assigned for objects of the model to users and groups at once
+    (see :class:`UserObjectRole` and :class:`GroupObjectRole`). Role grants
+    its current permissions - changes of ``permissions`` apply to all
+    existing assignments.
+    """
+    name = models.CharField(max_length=100)
+    content_type = models.ForeignKey(ContentType)
+    permissions = models.ManyToManyField(Permission, blank=True,
+        related_name='roles')
+
+    class Meta:
+        unique_together = ['name', 'content_type']
+
+    def __unicode__(self):
+        return u'%s | %s' % (self.content_type, self.name)
+
+class BaseObjectRole(models.Model):
+    """
+    Abstract assignment of :class:`Role` for an object. Assignment with
+    ``expires_at`` set grants the role until that time only. Deny entries
+    (see :class:`BaseObjectPermission`) win over permissions granted by
+    roles.
+    """
+    role = models.ForeignKey(Role)
+    content_type = models.ForeignKey(ContentType)
+    object_id = get_object_id_field(guardian_settings.OBJECT_ID_FIELD)
+    content_object = generic.GenericForeignKey()
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    class Meta:
+        abstract = True
+
+    def __unicode__(self):
+        return u'%s | %s | %s' % (unicode(self.content_object),
+            unicode(getattr(self, 'user', False) or self.group),
+            self.role.name)
+
+    def save(self, *args, **kwargs):
+        if self.content_type_id != self.role.content_type_id:
+            raise ValidationError("Cannot assign role not designed for this "
+                "class (role's type is %s and object's type is %s)"
+                % (self.role.content_type, self.content_type))
+        return super(BaseObjectRole, self).save(*args, **kwargs)
+
+class UserObjectRole(BaseObjectRole):
+    user = models.ForeignKey(User)
+
+    objects = UserObjectRoleManager()
+
+    class Meta:
+        unique_together = ['user', 'role', 'content_type', 'object_id']
+
+class GroupObjectRole(BaseObjectRole):
+    group = models.ForeignKey(Group)
+
+    objects = GroupObjectRoleManager()
+
+    class Meta:
+        unique_together = ['group', 'role', 'content_type', 'object_id']
+
+class ObjectPermissionChange(models.Model):
+    """
+    Change of object permission written by ``guardian.feed.OutboxSink``
+    (*outbox* table) - one row for each object of
+    ``guardian.feed.ObjectPermissionEvent``. Rows are never deleted by
+    ``django-guardian`` itself; consumers should remove rows they have
+    processed.
+    """
+    ACTION_CHOICES = (
+        ('assigned', 'assigned'),
+        ('denied', 'denied'),
+        ('removed', 'removed'),
+    )
+    action = models.CharField(max_length=16, choices=ACTION_CHOICES)
+    identity_type = models.CharField(max_length=16)
+    identity_id = models.PositiveIntegerField()
+    codename = models.CharField(max_length=100, null=True)
+    content_type = models.ForeignKey(ContentType)
+    object_id = models.CharField(max_length=255)
+    created_at = models.DateTimeField(default=datetime.datetime.now,
+        db_index=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __unicode__(self):
+        return u'%s | %s:%s | %s | %s' % (self.action, self.identity_type,
+            self.identity_id, self.codename, self.object_id)
+
+
+class SubGroup(models.Model):
+    """
+    Membership of group ``subgroup`` in group ``group`` - members of the
+    subgroup (and of its own subgroups, at any depth) are treated as members
+    of the group by checks, if ``GUARDIAN_NESTED_GROUPS`` setting is enabled
+    (see :mod:`guardian.groups`).
+
+    Memberships should be created and deleted, not changed.
+    """
+    group = models.ForeignKey(Group, related_name='subgroup_links')
+    subgroup = models.ForeignKey(Group, related_name='parent_links')
+
+    class Meta:
+        unique_together = ['group', 'subgroup']
+
+    def __unicode__(self):
+        return u'%s > %s' % (self.group_id, self.subgroup_id)
+
+    def save(self, *args, **kwargs):
+        if self.group_id == self.subgroup_id or GroupClosure.objects.filter(
+            ancestor=self.subgroup_id, descendant=self.group_id).exists():
+            raise ValidationError("Cannot nest group in itself or in any of "
+                "its subgroups")
+        return super(SubGroup, self).save(*args, **kwargs)
+
+class GroupClosure(models.Model):
+    """
+    Transitive closure of :class:`SubGroup` memberships: there is a row for
+    every group (``ancestor``) and every group nested in it at any depth
+    (``descendant``), holding number of distinct ``paths`` between them. Kept
+    up to date by ``django-guardian`` whenever memberships are created or
+    deleted.
+    """
+    ancestor = models.ForeignKey(Group, related_name='descendant_links')
+    descendant = models.ForeignKey(Group, related_name='ancestor_links')
+    paths = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        unique_together = ['ancestor', 'descendant']
+
+    def __unicode__(self):
+        return u'%s > %s (%s)' % (self.ancestor_id, self.descendant_id,
+            self.paths)
+
 
 # Prototype User and Group methods
 setattr(User, 'get_anonymous', staticmethod(lambda: get_anonymous_user()))
 setattr(User, 'add_obj_perm',
-    lambda self, perm, obj: UserObjectPermission.objects.assign(perm, self, obj))
+    lambda self, perm, obj: get_user_obj_perms_model(obj).objects.assign(perm, self, obj))
 setattr(User, 'del_obj_perm',
-    lambda self, perm, obj: UserObjectPermission.objects.remove_perm(perm, self, obj))
+    lambda self, perm, obj: get_user_obj_perms_model(obj).objects.remove_perm(perm, self, obj))
 
 setattr(Group, 'add_obj_perm',
-    lambda self, perm, obj: GroupObjectPermission.objects.assign(perm, self, obj))
+    lambda self, perm, obj: get_group_obj_perms_model(obj).objects.assign(perm, self, obj))
 setattr(Group, 'del_obj_perm',
-    lambda self, perm, obj: GroupObjectPermission.objects.remove_perm(perm, self, obj))
+    lambda self, perm, obj: get_group_obj_perms_model(obj).objects.remove_perm(perm, self, obj))
 
@@ -0,0 +1,168 @@
+"""
+Database router sending permission reads to replicas.
+
+To use it, list replicas at ``GUARDIAN_READ_DATABASES`` setting and add the
+router to ``DATABASE_ROUTERS``::
+
+    DATABASE_ROUTERS = ['guardian.routers.ObjectPermissionRouter']
+    GUARDIAN_READ_DATABASES = ['replica1', 'replica2']
+
+Models of ``django.contrib.auth`` are routed only if
+``GUARDIAN_ROUTE_AUTH_MODELS`` setting is enabled.
+"""
+import random
+import threading
+
+from django.core.signals import request_started
+from django.db import router
+
+from guardian.conf import settings as guardian_settings
+from guardian.sharding import is_sharded
+
+_state = threading.local()
+
+def pin_to_primary():
+    """
+    Makes following reads (made by current thread, until the end of the
+    request) go to ``GUARDIAN_WRITE_DATABASE``. Called automatically whenever
+    a write is routed.
+    """
+    _state.pinned = True
+
+def unpin():
+    """
+    Lets reads go to replicas again and forgets replica chosen for current
+    thread. Called automatically at the beginning of each request.
+    """
+    _state.pinned = False
+    _state.alias = None
+
+def is_pinned():
+    """
+    Returns ``True`` if reads of current thread go to the primary database.
+    """
+    return getattr(_state, 'pinned', False)
+
+def get_read_database():
+    """
+    Returns alias of database permission reads should go to. Replica is
+    chosen randomly, once per request, so all queries made during the request
+    see the same state of the data.
+    """
+    if is_pinned() or not guardian_settings.READ_DATABASES:
+        return guardian_settings.WRITE_DATABASE
+    alias = getattr(_state, 'alias', None)
+    if alias not in guardian_settings.READ_DATABASES:
+        alias = _state.alias = random.choice(guardian_settings.READ_DATABASES)
+    return alias
+
+def get_read_alias():
+    """
+    Returns alias of database guardian's own permission reads should be sent
+    to explicitly (see :func:`get_read_database`), or ``None`` if
+    :class:`ObjectPermissionRouter` is not installed or no replicas are
+    configured. Used for queries made on ``django.contrib.auth`` models or
+    on checked models themselves, with object permissions as subqueries,
+    which are compiled for database of the outer query - so they are
+    offloaded to replicas even if ``GUARDIAN_ROUTE_AUTH_MODELS`` is disabled.
+    """
+    if not guardian_settings.READ_DATABASES:
+        return None
+    for each in router.routers:
+        if isinstance(each, ObjectPermissionRouter):
+            return get_read_database()
+    return None
+
+def is_obj_perms_model(model):
+    from guardian.models import UserObjectPermissionBase
+    from guardian.models import GroupObjectPermissionBase
+    return issubclass(model,
+        (UserObjectPermissionBase, GroupObjectPermissionBase))
+
+def is_identity_model(model):
+    from guardian.models import SubGroup, GroupClosure
+    from guardian.models import Role, UserObjectRole, GroupObjectRole
+    return issubclass(model, (SubGroup, GroupClosure, Role, UserObjectRole,
+        GroupObjectRole))
+
+def is_auth_model(model):
+    return model._meta.app_label == 'auth'
+
+def is_routed(model):
+    """
+    Returns ``True`` if ``model`` is routed by
+    :class:`ObjectPermissionRouter` (object permission models and models of
+    nested groups and roles, which are used by the same queries, and, if
+    ``GUARDIAN_ROUTE_AUTH_MODELS`` is enabled, models of
+    ``django.contrib.auth``).
+    """
+    if is_auth_model(model):
+        return guardian_settings.ROUTE_AUTH_MODELS
+    return is_obj_perms_model(model) or is_identity_model(model)
+
+def get_instance_database(hints):
+    instance = hints.get('instance')
+    return instance is not None and instance._state.db or None
+
+class ObjectPermissionRouter(object):
+    """
+    Sends reads of object permissions (made by ``ObjectPermissionChecker``,
+    the backend, shortcuts and the admin) to one of
+    ``GUARDIAN_READ_DATABASES`` and writes (i.e. ``assign``/``remove_perm``
+    of managers and shortcuts) to ``GUARDIAN_WRITE_DATABASE``.
+
+    Once a write is routed, reads made by the same thread go to
+    ``GUARDIAN_WRITE_DATABASE`` too until the request ends, so the request
+    sees its own changes no matter of replication lag (*read-your-writes*).
+    Outside of requests (i.e. in management commands) :func:`unpin` may be
+    called to let reads go to replicas again.
+
+    Besides object permission tables, tables of nested groups and roles are
+    routed too, as permission queries use them as subqueries (which have to
+    be run by the same database). ``django.contrib.auth`` models are routed
+    only if ``GUARDIAN_ROUTE_AUTH_MODELS`` is enabled, as their reads are
+    made by authentication, sessions and the admin too; their writes pin
+    reads to the primary in any case, since permission queries join their
+    tables (i.e. group memberships).
+
+    Router is required if object permissions are sharded (see
+    :mod:`guardian.sharding`) - object permissions are kept at their shards
+    then, while related users, groups and permissions are read from their
+    own database.
+    """
+    def db_for_read(self, model, **hints):
+        if is_sharded() and is_obj_perms_model(model):
+            return get_instance_database(hints)
+        instance = hints.get('instance')
+        if is_sharded() and instance is not None and \
+            is_obj_perms_model(instance.__class__):
+            # objects related to object permissions are not held by shards
+            return router.db_for_read(model)
+        if is_routed(model):
+            return get_read_database()
+        return None
+
+    def db_for_write(self, model, **hints):
+        if is_sharded() and is_obj_perms_model(model):
+            return get_instance_database(hints)
+        if is_routed(model):
+            pin_to_primary()
+            return guardian_settings.WRITE_DATABASE
+        if is_auth_model(model):
+            pin_to_primary()
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if (is_routed(obj1.__class__) or is_auth_model(obj1.__class__)) and \
+            (is_routed(obj2.__class__) or is_auth_model(obj2.__class__)):
+            return True
+        if is_sharded() and (is_obj_perms_model(obj1.__class__) or
+            is_obj_perms_model(obj2.__class__)):
+            return True
+        return None
+
+def unpin_on_request(sender, **kwargs):
+    unpin()
+
+request_started.connect(unpin_on_request,
+    dispatch_uid='guardian.routers.unpin_on_request')
@@ -0,0 +1,93 @@
+"""
+Helpers for object permissions sharded across multiple databases.
+
+Sharding is enabled by listing database aliases at ``GUARDIAN_SHARDS``
+setting. Rows of object permission tables are then stored by one of them,
+chosen by content type of the object or by hash of object's primary key
+(see ``GUARDIAN_SHARD_BY``). Shards need to hold object permission tables
+only - users, groups and permissions are read from their own database and
+are referenced by ids.
+"""
+import threading
+import zlib
+
+from django.db import connections
+
+from guardian.conf import settings as guardian_settings
+
+def is_sharded():
+    """
+    Returns ``True`` if object permissions are sharded.
+    """
+    return bool(guardian_settings.SHARDS)
+
+def get_shard(ctype, object_pk):
+    """
+    Returns alias of the database holding object permissions for object of
+    type ``ctype`` with primary key ``object_pk``, or ``None`` if object
+    permissions are not sharded.
+    """
+    shards = guardian_settings.SHARDS
+    if not shards:
+        return None
+    if guardian_settings.SHARD_BY == 'content_type':
+        key = ctype.id
+    else:
+        # crc32 (unlike ``hash``) gives the same value in every process
+        key = zlib.crc32(str(object_pk)) & 0xffffffff
+    return shards[key % len(shards)]
+
+def get_model_shards(ctype):
+    """
+    Returns list of aliases of databases holding object permissions for
+    objects of type ``ctype`` (``[None]`` if object permissions are not
+    sharded).
+    """
+    if not is_sharded():
+        return [None]
+    if guardian_settings.SHARD_BY == 'content_type':
+        return [get_shard(ctype, None)]
+    return list(guardian_settings.SHARDS)
+
+def group_by_shard(ctype, pks):
+    """
+    Returns dict mapping shard aliases to lists of given primary keys of
+    objects of type ``ctype`` stored by them.
+    """
+    shards = {}
+    for pk in pks:
+        shards.setdefault(get_shard(ctype, pk), []).append(pk)
+    return shards
+
+def fan_out(func, items):
+    """
+    Calls ``func`` for each of ``items`` (i.e. shard aliases or ``(alias,
+    args)`` pairs), each in its own thread, and returns list of results in
+    the same order. Exception raised by any call is re-raised. Single item is
+    handled by current thread.
+    """
+    items = list(items)
+    if len(items) < 2:
+        return [func(item) for item in items]
+    results = [None] * len(items)
+    errors = []
+
+    def run(index, item):
+        try:
+            results[index] = func(item)
+        except Exception, err:
+            errors.append(err)
+        finally:
+            # thread has its own connections, they would leak otherwise
+            for alias in connections:
+                connections[alias].close()
+
+    threads = [threading.Thread(target=run, args=(index, item))
+        for index, item in enumerate(items)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
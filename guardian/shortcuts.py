@@ -1,17 +1,36 @@
 """
 Convenient shortcuts to manage or check object permissions.
 """
+import datetime
+import operator
+
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.auth.models import Permission, User, Group
 from django.core.cache import cache
 from django.db import models
-from django.db.models import Q
+from django.db.models import Min, Q
+from django.db.models.query import QuerySet
 
-from guardian.core import ObjectPermissionChecker
-from guardian.models import UserObjectPermission, GroupObjectPermission
-from guardian.utils import get_identity
+from guardian.conf import settings as guardian_settings
+from guardian.exceptions import TooManyObjects
+from guardian.core import ObjectPermissionChecker, resolve_perm
+from guardian.core import has_roles, get_object_roles, get_roles_perms
+from guardian.core import get_all_perms, get_inherited_perms
+from guardian.core import get_obj_perms_parent_field
+from guardian.groups import get_groups_filter, get_group_ids
+from guardian.groups import with_subgroups
+from guardian.models import UserObjectPermissionBase
+from guardian.models import GroupObjectPermissionBase
+from guardian.models import UserObjectRole, GroupObjectRole
+from guardian.routers import get_read_alias
+from guardian.sharding import is_sharded, get_model_shards, fan_out
+from guardian.sharding import group_by_shard
+from guardian.utils import get_identity, get_content_type
+from guardian.utils import get_user_obj_perms_model
+from guardian.utils import get_group_obj_perms_model
+from guardian.utils import get_obj_perms_models
 
-def assign(perm, user_or_group, obj):
+def assign(perm, user_or_group, obj, expires_at=None):
     """
     Assigns permission to user/group and object pair.
 
@@ -23,6 +42,9 @@ def assign(perm, user_or_group, obj):
 
     :param obj: persisted Django's ``Model`` instance
 
+    :param expires_at: ``datetime`` (or ``timedelta`` counted from now) after
+      which permission is no longer granted; by default it never expires
+
     We can assign permission for ``Model`` instance for specific user:
 
     >>> from django.contrib.sites.models import Site
@@ -46,23 +68,167 @@ def assign(perm, user_or_group, obj):
 
     """
 
-    perm = perm.split('.')[-1]
     user, group = get_identity(user_or_group)
     if user:
-        return UserObjectPermission.objects.assign(perm, user, obj)
+        model = get_user_obj_perms_model(obj)
+        return model.objects.assign(perm, user, obj, expires_at)
+    if group:
+        model = get_group_obj_perms_model(obj)
+        return model.objects.assign(perm, group, obj, expires_at)
+
+def deny(perm, user_or_group, obj, expires_at=None):
+    """
+    Denies permission to user/group and object pair. Deny entry wins over
+    grants, i.e. user would not have ``perm`` for ``obj`` even if it is
+    assigned for any of user's groups::
+
+        >>> assign("change_site", group, site)
+        >>> deny("change_site", joe, site)
+        >>> joe.has_perm("change_site", site)
+        False
+
+    Arguments are the same as for :func:`assign`. Use :func:`remove_perm` to
+    remove deny entry.
+    """
+    user, group = get_identity(user_or_group)
+    if user:
+        model = get_user_obj_perms_model(obj)
+        return model.objects.deny(perm, user, obj, expires_at)
     if group:
-        return GroupObjectPermission.objects.assign(perm, group, obj)
+        model = get_group_obj_perms_model(obj)
+        return model.objects.deny(perm, group, obj, expires_at)
 
 def remove_perm(perm, user_or_group=None, obj=None):
     """
-    Removes permission from user/group and object pair.
+    Removes permission (or deny entry) from user/group and object pair.
     """
-    perm = perm.split('.')[-1]
     user, group = get_identity(user_or_group)
     if user:
-        UserObjectPermission.objects.remove_perm(perm, user, obj)
+        model = get_user_obj_perms_model(obj)
+        model.objects.remove_perm(perm, user, obj)
     if group:
-        GroupObjectPermission.objects.remove_perm(perm, group, obj)
+        model = get_group_obj_perms_model(obj)
+        model.objects.remove_perm(perm, group, obj)
+
+def copy_perms(source_obj, target_objs, include_groups=True):
+    """
+    Copies object permissions of users (and groups, unless
+    ``include_groups`` is ``False``) for ``source_obj`` to all
+    ``target_objs`` (instances of the same model), i.e. to give new objects
+    the same access rules as a template::
+
+        >>> copy_perms(template_project, new_projects)
+
+    Grants, deny entries and role assignments are copied (with their
+    expiration times), expired ones are not. Object permissions and role
+    assignments the targets already have are kept as they are. Rows are
+    copied by the database with a few ``INSERT ... SELECT`` statements (see
+    :meth:`copy_perms
+    <guardian.managers.BaseObjectPermissionManager.copy_perms>`). Returns
+    number of created object permissions and role assignments.
+    """
+    target_objs = list(target_objs)
+    model = get_user_obj_perms_model(source_obj)
+    created = model.objects.copy_perms(source_obj, target_objs)
+    created += UserObjectRole.objects.copy(source_obj, target_objs)
+    if include_groups:
+        model = get_group_obj_perms_model(source_obj)
+        created += model.objects.copy_perms(source_obj, target_objs)
+        created += GroupObjectRole.objects.copy(source_obj, target_objs)
+    return created
+
+def transfer_perms(from_identity, to_identity, content_types=None):
+    """
+    Moves all object permissions (grants and deny entries) and role
+    assignments of
+    ``from_identity`` to ``to_identity`` (both users or both groups), i.e.
+    when an employee leaves and a replacement takes over their objects::
+
+        >>> transfer_perms(joe, jane)
+
+    Object permissions (role assignments) ``to_identity`` already has for the
+    same permission (role) and object are kept, conflicting ones of
+    ``from_identity`` are dropped. If ``content_types`` (list of models or
+    ``ContentType`` instances) is given, only those for objects of these
+    types are moved.
+    Group memberships and model level permissions are not touched. Nothing
+    is moved if both identities are the same.
+
+    Rows are moved by a few ``UPDATE``/``DELETE`` statements for each chunk of
+    them (see :meth:`transfer
+    <guardian.managers.BaseObjectPermissionManager.transfer>`); shards are
+    processed in parallel. Returns number of moved object permissions and
+    role assignments.
+    """
+    from_user, from_group = get_identity(from_identity)
+    to_user, to_group = get_identity(to_identity)
+    if bool(from_user) != bool(to_user):
+        raise ValueError("Object permissions may be moved from user to "
+            "user or from group to group only")
+    if (from_user or from_group).pk == (to_user or to_group).pk:
+        return 0
+    if content_types is not None:
+        content_types = [isinstance(each, ContentType) and each or
+            get_content_type(each) for each in content_types]
+    if from_user:
+        from_identity, to_identity = from_user, to_user
+        base, role_model = UserObjectPermissionBase, UserObjectRole
+    else:
+        from_identity, to_identity = from_group, to_group
+        base, role_model = GroupObjectPermissionBase, GroupObjectRole
+    shards = guardian_settings.SHARDS or [None]
+    moved = role_model.objects.transfer(from_identity, to_identity,
+        content_types)
+    for model in get_obj_perms_models():
+        if issubclass(model, base):
+            moved += sum(fan_out(lambda alias: model.objects.transfer(
+                from_identity, to_identity, content_types, alias), shards))
+    return moved
+
+def assign_role(role, users_or_groups, objs, expires_at=None):
+    """
+    Assigns ``role`` (:class:`guardian.models.Role` instance or name of a role
+    of the objects' model) for all ``objs`` (instances of the same model) to
+    all ``users_or_groups`` (any mix of users and groups). Assignments are
+    made with single ``INSERT`` per table, already existing ones are
+    skipped::
+
+        >>> editor = Role.objects.create(name='editor', content_type=ctype)
+        >>> editor.permissions = Permission.objects.filter(
+        ...     codename__in=['change_site', 'delete_site'])
+        >>> assign_role('editor', [joe, editors], sites)
+        >>> joe.has_perm('delete_site', sites[0])
+        True
+
+    A single row is stored for each assignment, no matter how many
+    permissions the role has; checks expand roles to permissions by
+    subqueries. Deny entries win over permissions granted by roles. Returns
+    number of created assignments.
+    """
+    users, groups = _split_identities(users_or_groups)
+    objs = list(objs)
+    return UserObjectRole.objects.assign(role, users, objs, expires_at) + \
+        GroupObjectRole.objects.assign(role, groups, objs, expires_at)
+
+def remove_role(role, users_or_groups, objs):
+    """
+    Removes ``role`` for all ``objs`` from all ``users_or_groups`` (see
+    :func:`assign_role`).
+    """
+    users, groups = _split_identities(users_or_groups)
+    objs = list(objs)
+    UserObjectRole.objects.remove(role, users, objs)
+    GroupObjectRole.objects.remove(role, groups, objs)
+
+def _split_identities(users_or_groups):
+    users, groups = [], []
+    for identity in users_or_groups:
+        user, group = get_identity(identity)
+        if user:
+            users.append(user)
+        else:
+            groups.append(group)
+    return users, groups
 
 def get_perms(user_or_group, obj):
     """
@@ -82,38 +248,372 @@ def get_perms_for_model(cls):
         model = models.get_model(app_label, model_name)
     else:
         model = cls
-    ctype = ContentType.objects.get_for_model(model)
+    ctype = get_content_type(model)
     return Permission.objects.filter(content_type=ctype)
 
 
 def get_objs(cls, perm, user_or_group):
     """
     Returns all objects from the given class which have the passed permission
-    and user assigned to it.
+    and user assigned to it (directly or, for users, through any of their
+    groups).
+
+    :param cls: Django's ``Model`` class or ``QuerySet`` which should be
+      filtered
+    :param perm: permission as string, may or may not contain app_label
+      prefix; list of such strings may be given too - objects with *any* of
+      them are returned then
+    :param user_or_group: instance of ``User``, ``AnonymousUser`` or ``Group``
+
+    If object permissions are sharded, ids of matching objects are collected
+    from shards first; ``guardian.exceptions.TooManyObjects`` is raised if
+    there are more of them than ``GUARDIAN_SHARDED_OBJS_LIMIT`` allows (use
+    :func:`iter_objs` to walk over any number of objects then).
+
+    Expired object permissions are not taken into account and deny entries
+    win over grants. Permissions inherited from parents (see
+    :func:`guardian.core.get_obj_perms_parent_field`) are taken into account
+    too, and so are model level ones if ``GUARDIAN_GLOBAL_PERMS_FALLBACK`` is
+    set (all objects not denied are returned then). Filtering is done by the database (object permission tables are used
+    as subqueries) and returned value is a lazy ``QuerySet``::
+
+        >>> from guardian.shortcuts import get_objs
+        >>> get_objs(Site, ['change_site', 'delete_site'], joe)
+        [<Site: example.com>]
+
+    """
+    if isinstance(cls, QuerySet):
+        queryset = cls
+    else:
+        queryset = cls._default_manager.all()
+    if queryset._db is None:
+        queryset = queryset.using(get_read_alias())
+    q = _get_objs_filter(queryset.model, perm, user_or_group)
+    if q is None:
+        return queryset.none()
+    return queryset.filter(q)
+
+def _get_objs_filter(cls, perm, user_or_group, pks=None):
     """
-    pass
+    Returns ``Q`` object matching objects of ``cls`` for which
+    ``user_or_group`` has any of ``perm`` (see :func:`get_objs`), or ``None``
+    if there are no such permissions. If object permissions are sharded,
+    ids of matching objects are collected from shards - only of objects with
+    given ``pks``, if given (``GUARDIAN_SHARDED_OBJS_LIMIT`` is not applied
+    then).
+    """
+    if isinstance(perm, basestring):
+        perm = [perm]
+    specs = [resolve_perm(each, cls) for each in perm]
+    perm_ids = [spec[1] for spec in specs if spec is not None]
+    if not perm_ids:
+        return None
+    ctype = get_content_type(cls)
+    roles = []
+    if has_roles(ctype):
+        user, group = get_identity(user_or_group)
+        roles = get_object_roles(user, group, ctype)
+    global_perms = set()
+    if guardian_settings.GLOBAL_PERMS_FALLBACK:
+        global_perms = ObjectPermissionChecker(user_or_group)\
+            .get_global_perms(ctype)
+
+    if is_sharded():
+        # shards can't be used by subqueries, ids are collected from all of
+        # them (in parallel) instead - up to the limit
+        limit = pks is None and guardian_settings.SHARDED_OBJS_LIMIT or None
+        group_ids = _get_group_ids(user_or_group)
+        to_python = cls._meta.pk.to_python
+        if pks is None:
+            batches = [(alias, None) for alias in get_model_shards(ctype)]
+        else:
+            batches = group_by_shard(ctype, pks).items()
+
+        def fetch(batch):
+            alias, shard_pks = batch
+            granted, denied = set(), set()
+            for qs, field in _get_obj_perms_querysets(cls, user_or_group,
+                alias, group_ids):
+                qs = qs.filter(permission__in=perm_ids)
+                if shard_pks is not None:
+                    qs = qs.filter(**{field + '__in': shard_pks})
+                rows = _check_objs_limit(qs.values_list(field, 'permission',
+                    'deny'), limit)
+                for object_id, perm_id, deny in rows:
+                    if deny:
+                        denied.add((to_python(object_id), perm_id))
+                    else:
+                        granted.add((to_python(object_id), perm_id))
+            return granted, denied
+        granted, denied = set(), set()
+        for shard_granted, shard_denied in fan_out(fetch, batches):
+            granted |= shard_granted
+            denied |= shard_denied
+        # roles are not held by shards
+        assignments = []
+        for qs in roles:
+            if pks is not None:
+                qs = qs.filter(object_id__in=pks)
+            assignments.extend(_check_objs_limit(qs
+                .filter(role__permissions__in=perm_ids)
+                .values_list('object_id', 'role').distinct(), limit))
+        roles_perms = get_roles_perms(set(role_id
+            for object_id, role_id in assignments))
+        granted.update((to_python(object_id), perm_id)
+            for object_id, role_id in assignments
+            for perm_id, codename in roles_perms[role_id]
+            if perm_id in perm_ids)
+        granted -= denied
+        q = Q(pk__in=_check_objs_limit(set(object_id
+            for object_id, perm_id in granted), limit))
+        for ctype_id, perm_id, codename in filter(None, specs):
+            not_denied = ~Q(pk__in=[object_id
+                for object_id, denied_perm_id in denied
+                if denied_perm_id == perm_id])
+            if codename in global_perms:
+                q |= Q(pk__isnull=False) & not_denied
+                continue
+            inherited = _get_inherited_filter(cls, codename, user_or_group)
+            if inherited is not None:
+                q |= inherited & not_denied
+        return q
+
+    obj_perms = _get_obj_perms_querysets(cls, user_or_group)
+
+    def matching(perm_id, deny):
+        q = reduce(operator.or_, [Q(pk__in=qs
+            .filter(deny=deny, permission=perm_id)
+            .values(field)) for qs, field in obj_perms])
+        if not deny:
+            for qs in roles:
+                q |= Q(pk__in=qs.filter(role__permissions=perm_id)
+                    .values('object_id'))
+        return q
+    def granted(perm_id, codename):
+        if codename in global_perms:
+            # model level permission is granted for every object
+            return Q(pk__isnull=False)
+        q = matching(perm_id, False)
+        inherited = _get_inherited_filter(cls, codename, user_or_group)
+        if inherited is not None:
+            q |= inherited
+        return q
+    # permission is granted if there is no deny entry for it
+    return reduce(operator.or_, [granted(perm_id, codename) &
+        ~matching(perm_id, True)
+        for ctype_id, perm_id, codename in filter(None, specs)])
+
+def _check_objs_limit(rows, limit):
+    """
+    Returns list of (at most ``limit``) ``rows`` (sliced, if ``rows`` is a
+    ``QuerySet``). Raises ``TooManyObjects`` if there are more of them.
+    Nothing is limited if ``limit`` is ``None``.
+    """
+    if limit is None:
+        return list(rows)
+    if isinstance(rows, QuerySet):
+        rows = rows[:limit + 1]
+    rows = list(rows)
+    if len(rows) > limit:
+        raise TooManyObjects("More than %d object permissions match, use "
+            "iter_objs or raise GUARDIAN_SHARDED_OBJS_LIMIT" % limit)
+    return rows
+
+def _get_inherited_filter(cls, codename, user_or_group):
+    """
+    Returns ``Q`` object matching objects of ``cls`` whose parents (see
+    :func:`guardian.core.get_obj_perms_parent_field`) grant permission
+    ``codename`` to ``user_or_group``, or ``None`` if objects of ``cls`` don't
+    inherit it from anywhere. Parents are matched by :func:`get_objs`
+    subquery, so whole chain of ancestors is resolved.
+    """
+    field = get_obj_perms_parent_field(cls)
+    if field is None:
+        return None
+    parent_model = field.rel.to
+    parent_perms = [parent_perm for parent_perm in
+        get_all_perms(get_content_type(parent_model))
+        if codename in get_inherited_perms(parent_model, cls, [parent_perm])]
+    if not parent_perms:
+        return None
+    parents = get_objs(parent_model, parent_perms, user_or_group)
+    return Q(**{field.name + '__in': parents.values('pk')})
+
+def _get_obj_perms_querysets(cls, user_or_group, using=None, group_ids=None):
+    """
+    Returns list of ``(queryset, field)`` pairs, where ``queryset`` contains
+    active object permissions (for objects of ``cls``) of the given user (and
+    user's groups) or group, and ``field`` is the name of its field holding
+    primary key of the object.
+
+    If ``using`` (shard alias) is given, querysets use that database and
+    user's groups are matched by given ``group_ids`` (not by join).
+    """
+    user, group = get_identity(user_or_group)
+    ctype = get_content_type(cls)
+    group_model = get_group_obj_perms_model(cls)
+    group_perms = group_model.objects.db_manager(using).active().filter(
+        **group_model.objects.model_lookups(ctype))
+    field = group_model.objects.get_object_field()
+    if user:
+        user_model = get_user_obj_perms_model(cls)
+        user_perms = user_model.objects.db_manager(using).active().filter(
+            user=user, **user_model.objects.model_lookups(ctype))
+        querysets = [(user_perms, user_model.objects.get_object_field())]
+        if using is None:
+            querysets.append((group_perms.filter(get_groups_filter(user)),
+                field))
+        elif group_ids:
+            querysets.append((group_perms.filter(group__in=group_ids), field))
+        return querysets
+    return [(group_perms.filter(group=group), field)]
+
+def _get_group_ids(user_or_group):
+    """
+    Returns list of ids of groups of given user (or ``None`` for group).
+    """
+    user, group = get_identity(user_or_group)
+    if user:
+        return get_group_ids(user)
+    return None
+
+
+def iter_objs(cls, perm, user_or_group, chunk_size=1000, ids_only=False):
+    """
+    Generator yielding all objects of the given class for which ``perm`` is
+    granted to ``user_or_group`` - the same objects :func:`get_objs` returns
+    (direct grants, grants through groups and roles and permissions inherited
+    from parents, skipping expired and denied ones). Objects are yielded in
+    ascending primary key order.
+
+    :param cls: Django's ``Model`` class
+    :param perm: permission as string, may or may not contain app_label
+      prefix
+    :param user_or_group: instance of ``User``, ``AnonymousUser`` or ``Group``
+    :param chunk_size: number of objects fetched by each query
+    :param ids_only: if ``True``, only primary keys are yielded (no objects
+      are fetched at all)
+
+    Objects are walked using keyset pagination on primary key (``WHERE pk >
+    last_seen ORDER BY pk LIMIT chunk_size``) rather than ``OFFSET``, so every
+    chunk costs the same no matter how many objects were already consumed and
+    at most ``chunk_size`` objects are held in memory at once. This makes it
+    suitable for background jobs walking over millions of rows::
+
+        >>> from guardian.shortcuts import iter_objs
+        >>> for site in iter_objs(Site, 'change_site', joe, chunk_size=500):
+        ...     sync(site)
+
+    If object permissions are sharded, all objects of ``cls`` are walked and
+    each chunk is matched against rows of its objects read from shards, so
+    the number of matching objects is not limited by
+    ``GUARDIAN_SHARDED_OBJS_LIMIT``.
+
+    """
+    queryset = cls._default_manager.using(get_read_alias()).order_by('pk')
+    if not is_sharded():
+        q = _get_objs_filter(cls, perm, user_or_group)
+        if q is None:
+            return
+        queryset = queryset.filter(q)
+    last_pk = None
+    while True:
+        qs = queryset
+        if last_pk is not None:
+            qs = qs.filter(pk__gt=last_pk)
+        if is_sharded():
+            pks = list(qs.values_list('pk', flat=True)[:chunk_size])
+            if not pks:
+                return
+            last_pk = pks[-1]
+            q = _get_objs_filter(cls, perm, user_or_group, pks)
+            if q is None:
+                return
+            chunk = queryset.filter(pk__in=pks).filter(q)
+            if ids_only:
+                chunk = chunk.values_list('pk', flat=True)
+            for obj in chunk:
+                yield obj
+            if len(pks) < chunk_size:
+                return
+        else:
+            if ids_only:
+                qs = qs.values_list('pk', flat=True)
+            chunk = list(qs[:chunk_size])
+            for obj in chunk:
+                yield obj
+            if len(chunk) < chunk_size:
+                return
+            last_pk = ids_only and chunk[-1] or chunk[-1].pk
 
 
 def get_users_with_perm(obj, codename):
-    ctype = ContentType.objects.get_for_model(obj)
+    """
+    Returns users having permission ``codename`` for ``obj`` (directly or
+    through groups) and no deny entry for it. Result is cached until any
+    object permission, user or group is saved or until the first of matching
+    grants expires, whichever comes first.
+
+    .. note::
+       Permissions inherited from parents of ``obj`` (see
+       :func:`guardian.core.get_obj_perms_parent_field`) are not taken into
+       account - only users having permission assigned for ``obj`` itself
+       (or granted by roles) are returned.
+    """
+    ctype = get_content_type(obj)
 
     key = 'guardian.shortcuts.get_users_with_perm.{0}.{1}.{2}'.format(ctype.pk, obj.pk, codename)
     user_list = cache.get(key)
     if user_list is None:
-        perm = Permission.objects.get(codename=codename, content_type=ctype)
+        spec = resolve_perm(codename, obj)
+        if spec is None:
+            raise Permission.DoesNotExist("Permission %r does not exist for "
+                "%s" % (codename, obj._meta.object_name))
+        perm = spec[1]
+        now = datetime.datetime.now()
 
         # List with of users with the perm
-        users = UserObjectPermission.objects.filter(permission=perm,
-                                                    content_type=ctype,
-                                                    object_id=obj.pk).values('user')
+        user_model = get_user_obj_perms_model(obj)
+        user_perms = user_model.objects.for_object(obj, ctype).active(now)\
+            .filter(permission=perm,
+                **user_model.objects.object_lookups(obj, ctype))
+        users = user_perms.filter(deny=False).values('user')
+        denied_users = user_perms.filter(deny=True).values('user')
 
         # List of groups with the perm
-        groups = GroupObjectPermission.objects.filter(permission=perm,
-                                                      content_type=ctype,
-                                                      object_id=obj.pk).values('group')
+        group_model = get_group_obj_perms_model(obj)
+        group_perms = group_model.objects.for_object(obj, ctype).active(now)\
+            .filter(permission=perm,
+                **group_model.objects.object_lookups(obj, ctype))
+        groups = group_perms.filter(deny=False).values('group')
+        denied_groups = group_perms.filter(deny=True).values('group')
+
+        # users and groups the permission is granted to by roles
+        role_querysets = []
+        if has_roles(ctype):
+            role_querysets = [model.objects.active(now).filter(
+                content_type=ctype, object_id=obj.pk,
+                role__permissions=perm) for model in (UserObjectRole,
+                GroupObjectRole)]
 
-        user_list = User.objects.filter(Q(pk__in=users) | Q(groups__in=groups)).distinct()
-        cache.set(key, user_list)
+        if is_sharded():
+            # shard can't be used by subqueries
+            users, denied_users = [list(user_perms.filter(deny=deny)
+                .values_list('user', flat=True)) for deny in (False, True)]
+            groups, denied_groups = [list(group_perms.filter(deny=deny)
+                .values_list('group', flat=True)) for deny in (False, True)]
+
+        granted = Q(pk__in=users) | Q(groups__in=with_subgroups(groups))
+        if role_querysets:
+            user_roles, group_roles = role_querysets
+            granted |= Q(pk__in=user_roles.values('user')) | \
+                Q(groups__in=with_subgroups(group_roles.values('group')))
+        user_list = User.objects.using(get_read_alias()).filter(granted)\
+            .exclude(pk__in=denied_users)\
+            .exclude(groups__in=with_subgroups(denied_groups))\
+            .distinct()
+        cache.set(key, user_list, _get_expiry_timeout(now, user_perms,
+            group_perms, *role_querysets))
         key_list = cache.get('guardian.keys', [])
         if key not in key_list:
             key_list.append(key)
@@ -121,3 +621,18 @@ def get_users_with_perm(obj, codename):
 
     return user_list
 
+def _get_expiry_timeout(now, *querysets):
+    """
+    Returns number of seconds (counted from ``now``) after which first of
+    object permissions from given ``querysets`` expires, capped at default
+    cache timeout.
+    """
+    timeout = cache.default_timeout
+    for queryset in querysets:
+        expires_at = queryset.exclude(expires_at=None)\
+            .aggregate(Min('expires_at'))['expires_at__min']
+        if expires_at is not None:
+            delta = expires_at - now
+            timeout = min(timeout, delta.days * 86400 + delta.seconds + 1)
+    return timeout
+
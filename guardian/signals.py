@@ -0,0 +1,9 @@
+"""
+Signals sent by ``django-guardian``.
+"""
+from django.dispatch import Signal
+
+# Sent by ``guardian.feed.SignalSink`` with list of
+# ``guardian.feed.ObjectPermissionEvent`` instances and alias of the database
+# the change was made at.
+obj_perms_changed = Signal(providing_args=['events', 'using'])
@@ -0,0 +1,184 @@
+"""
+Helpers for test suites of projects using ``django-guardian``.
+"""
+from django.conf import settings
+from django.contrib.auth.models import User, Group, Permission
+from django.db import connections, router, transaction
+
+from guardian.core import resolve_perm
+from guardian.exceptions import ObjectNotPersisted
+from guardian.managers import insert_objects
+from guardian.utils import get_content_type
+from guardian.utils import get_user_obj_perms_model
+from guardian.utils import get_group_obj_perms_model
+
+def count_queries(func, *args, **kwargs):
+    """
+    Calls ``func`` with given arguments and returns number of database queries
+    it has made (at all databases).
+    """
+    return _run_counted(func, args, kwargs)[1]
+
+def assert_num_queries(num, func, *args, **kwargs):
+    """
+    Calls ``func`` with given arguments and raises ``AssertionError`` (listing
+    the queries) unless it has made exactly ``num`` database queries. Returns
+    value returned by ``func``::
+
+        >>> check = ObjectPermissionChecker(joe)
+        >>> check.prefetch_perms(keycards)
+        >>> assert_num_queries(0, check.has_perm, 'change_keycard', keycard)
+        True
+    """
+    result, count, queries = _run_counted(func, args, kwargs)
+    if count != num:
+        raise AssertionError("%d queries expected, %d made:\n%s" % (num,
+            count, '\n'.join(query['sql'] for query in queries)))
+    return result
+
+def _run_counted(func, args, kwargs):
+    debug = settings.DEBUG
+    settings.DEBUG = True
+    for alias in connections:
+        connections[alias].queries = []
+    try:
+        result = func(*args, **kwargs)
+        queries = []
+        for alias in connections:
+            queries.extend(connections[alias].queries)
+        return result, len(queries), queries
+    finally:
+        settings.DEBUG = debug
+
+class PermissionGraphBuilder(object):
+    """
+    Builds users, groups, group memberships and object permissions with a
+    few multi-row ``INSERT`` statements (made within one transaction, except
+    for object permissions stored by shards), so even big permission
+    scenarios are set up quickly::
+
+        >>> graph = PermissionGraphBuilder()
+        >>> graph.add_users(['joe', 'jane'])
+        >>> graph.add_groups(['editors'])
+        >>> graph.add_members('editors', ['joe', 'jane'])
+        >>> graph.assign('change_keycard', keycards, groups=['editors'])
+        >>> graph.assign('delete_keycard', keycards[:10], users=['joe'])
+        >>> graph.build()
+        >>> graph.users['joe'].has_perm('delete_keycard', keycards[0])
+        True
+
+    Users and groups are referred to by names; names of already existing
+    users and groups may be used too. Objects need to be saved first.
+    Already existing memberships and object permissions are skipped. No
+    signals are sent, so caches of ``django-guardian`` are cleared by
+    :meth:`build`.
+    """
+    def __init__(self):
+        self.users = {}
+        self.groups = {}
+        self._new_users = []
+        self._new_groups = []
+        self._members = []
+        self._grants = []
+
+    def add_users(self, usernames):
+        """
+        Adds users with given ``usernames`` to be created.
+        """
+        self._new_users.extend(usernames)
+
+    def add_groups(self, names):
+        """
+        Adds groups with given ``names`` to be created.
+        """
+        self._new_groups.extend(names)
+
+    def add_members(self, group, usernames):
+        """
+        Adds users with given ``usernames`` to ``group`` (name).
+        """
+        self._members.extend((group, username) for username in usernames)
+
+    def assign(self, perm, objs, users=(), groups=()):
+        """
+        Assigns permission ``perm`` for all ``objs`` to users and groups with
+        given names.
+        """
+        for obj in objs:
+            if getattr(obj, 'pk', None) is None:
+                raise ObjectNotPersisted("Object %s needs to be persisted "
+                    "first" % obj)
+        self._grants.append((perm, list(objs), list(users), list(groups)))
+
+    def build(self):
+        """
+        Creates everything added so far. Created (and referred) users and
+        groups are available as ``users`` and ``groups`` dicts keyed by
+        names.
+        """
+        using = router.db_for_write(User)
+        transaction.enter_transaction_management(using=using)
+        transaction.managed(True, using=using)
+        try:
+            self._build(using)
+            transaction.commit(using=using)
+        except:
+            transaction.rollback(using=using)
+            raise
+        finally:
+            transaction.leave_transaction_management(using=using)
+        from guardian.listeners import clear_perm_cache
+        clear_perm_cache(sender=None, instance=None)
+
+    def _build(self, using):
+        insert_objects(User, [User(username=username, password='!')
+            for username in self._new_users], using)
+        insert_objects(Group, [Group(name=name)
+            for name in self._new_groups], using)
+
+        usernames = set(self._new_users)
+        names = set(self._new_groups)
+        usernames.update(username for group, username in self._members)
+        names.update(group for group, username in self._members)
+        for perm, objs, users, groups in self._grants:
+            usernames.update(users)
+            names.update(groups)
+        self.users.update((user.username, user) for user in
+            User.objects.using(using).filter(username__in=usernames))
+        self.groups.update((group.name, group) for group in
+            Group.objects.using(using).filter(name__in=names))
+
+        through = User.groups.through
+        insert_objects(through, [through(user_id=self.users[username].pk,
+            group_id=self.groups[group].pk)
+            for group, username in self._members], using,
+            ignore_conflicts=True)
+
+        # object permissions are grouped by table and database
+        obj_perms = {}
+        for perm, objs, users, groups in self._grants:
+            for obj in objs:
+                spec = resolve_perm(perm, obj)
+                if spec is None:
+                    raise Permission.DoesNotExist("Permission %r does not "
+                        "exist for %s" % (perm, obj._meta.object_name))
+                perm_id = spec[1]
+                ctype = get_content_type(obj)
+                for identities, identity_names, get_model in (
+                    (self.users, users, get_user_obj_perms_model),
+                    (self.groups, groups, get_group_obj_perms_model)):
+                    if not identity_names:
+                        continue
+                    manager = get_model(obj).objects
+                    alias = manager.for_object(obj, ctype)._db or \
+                        router.db_for_write(manager.model)
+                    lookups = manager.object_lookups(obj, ctype)
+                    for name in identity_names:
+                        obj_perm = manager.model(permission_id=perm_id,
+                            **lookups)
+                        setattr(obj_perm, manager.identity_field,
+                            identities[name])
+                        obj_perms.setdefault((manager.model, alias), [])\
+                            .append(obj_perm)
+        for (model, alias), instances in obj_perms.iteritems():
+            insert_objects(model, instances, alias, ignore_conflicts=True)
@@ -3,4 +3,16 @@ from other_test import *
 from tags_test import *
 from utils_test import *
 from core_test import *
+from direct_rel_test import *
+from admin_test import *
+from inheritance_test import *
 
+from expiry_test import *
+from deny_test import *
+from routers_test import *
+from sharding_test import *
+from feed_test import *
+from testing_test import *
+from groups_test import *
+from roles_test import *
+from proxy_test import *
@@ -0,0 +1,201 @@
+from django.test import TestCase
+from django.contrib.auth.models import User, Group, Permission
+
+from guardian.models import UserObjectPermission
+from guardian.shortcuts import assign, deny, get_perms
+from guardian.testing import count_queries
+from guardian.tests.models import Keycard, Project, Folder
+
+class ObjectPermissionsAdminTest(TestCase):
+    fixtures = ['tests.json']
+    urls = 'guardian.tests.urls'
+
+    def setUp(self):
+        self.admin = User.objects.create(username='admin', is_staff=True,
+            is_superuser=True)
+        self.admin.set_password('admin')
+        self.admin.save()
+        self.client.login(username='admin', password='admin')
+        self.user = User.objects.get(username='jack')
+        self.group = Group.objects.get(name='jackGroup')
+        self.keycard = Keycard.objects.create(key='admin-key')
+        self.url = '/admin/guardian/keycard/%s/permissions/' % self.keycard.pk
+
+    def test_change_form_link(self):
+        response = self.client.get('/admin/guardian/keycard/%s/'
+            % self.keycard.pk)
+        self.assertContains(response, 'href="permissions/"')
+
+    def test_grid(self):
+        assign('change_keycard', self.user, self.keycard)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row[0] for row in response.context['rows']],
+            [self.user])
+        cells = dict((name, checked) for name, checked, denied
+            in response.context['rows'][0][1])
+        self.assertTrue(cells['perm_%s_change_keycard' % self.user.pk])
+        self.assertFalse(cells['perm_%s_delete_keycard' % self.user.pk])
+
+    def test_pagination(self):
+        for i in xrange(3):
+            user = User.objects.create(username='user%d' % i)
+            assign('change_keycard', user, self.keycard)
+        response = self.client.get(self.url)
+        self.assertEqual(len(response.context['rows']), 2)
+        self.assertEqual(response.context['paginator'].num_pages, 2)
+        response = self.client.get(self.url + '?p=2')
+        self.assertEqual(len(response.context['rows']), 1)
+
+    def test_search(self):
+        response = self.client.get(self.url + '?q=jac')
+        self.assertEqual([row[0] for row in response.context['rows']],
+            [self.user])
+        response = self.client.get(self.url + '?kind=group&q=jackG')
+        self.assertEqual([row[0] for row in response.context['rows']],
+            [self.group])
+
+    def test_save(self):
+        assign('change_keycard', self.user, self.keycard)
+        response = self.client.post(self.url, {
+            'identities': [self.user.pk],
+            'perm_%s_delete_keycard' % self.user.pk: 'on',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(get_perms(self.user, self.keycard),
+            ['delete_keycard'])
+
+        self.client.post(self.url + '?kind=group', {
+            'identities': [self.group.pk],
+            'perm_%s_can_use_keycard' % self.group.pk: 'on',
+        })
+        self.assertEqual(get_perms(self.group, self.keycard),
+            ['can_use_keycard'])
+
+    def test_deny(self):
+        assign('change_keycard', self.user, self.keycard)
+        deny('delete_keycard', self.user, self.keycard)
+        response = self.client.get(self.url)
+        cells = dict((name, (checked, denied)) for name, checked, denied
+            in response.context['rows'][0][1])
+        self.assertEqual(cells['perm_%s_change_keycard' % self.user.pk],
+            (True, False))
+        self.assertEqual(cells['perm_%s_delete_keycard' % self.user.pk],
+            (False, True))
+        self.assertContains(response, 'class="denied"')
+
+        # unchecked deny entry is kept
+        self.client.post(self.url, {
+            'identities': [self.user.pk],
+            'perm_%s_change_keycard' % self.user.pk: 'on',
+        })
+        self.assertTrue(UserObjectPermission.objects.filter(user=self.user,
+            permission__codename='delete_keycard', deny=True).exists())
+
+        # checked deny entry is replaced by grant
+        response = self.client.post(self.url, {
+            'identities': [self.user.pk],
+            'perm_%s_change_keycard' % self.user.pk: 'on',
+            'perm_%s_delete_keycard' % self.user.pk: 'on',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(sorted(get_perms(self.user, self.keycard)),
+            ['change_keycard', 'delete_keycard'])
+        self.assertFalse(UserObjectPermission.objects.filter(user=self.user,
+            deny=True).exists())
+
+    def test_permission_denied(self):
+        staff = User.objects.create(username='staff', is_staff=True)
+        staff.set_password('staff')
+        staff.save()
+        self.client.login(username='staff', password='staff')
+        # object is not even visible for the user
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 404)
+
+        assign('view_keycard', staff, self.keycard)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 403)
+
+        # object level editor may not manage permissions of the object
+        assign('change_keycard', staff, self.keycard)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post(self.url, {
+            'identities': [staff.pk],
+            'perm_%s_delete_keycard' % staff.pk: 'on',
+        })
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(sorted(get_perms(staff, self.keycard)),
+            ['change_keycard', 'view_keycard'])
+
+        staff.user_permissions.add(Permission.objects.get(
+            codename='change_userobjectpermission'))
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(self.url + '?kind=group')
+        self.assertEqual(response.status_code, 403)
+
+    def test_inlines(self):
+        url = '/admin/guardian/keycard/%s/' % self.keycard.pk
+        assign('change_keycard', self.user, self.keycard)
+        assign('change_keycard', self.group, self.keycard)
+        # warm up caches
+        self.client.get(url)
+        queries = count_queries(self.client.get, url)
+
+        for i in xrange(5):
+            user = User.objects.create(username='user%d' % i)
+            assign('delete_keycard', user, self.keycard)
+        response = self.client.get(url)
+        self.assertContains(response, '<strong>user4</strong>')
+        self.assertEqual(count_queries(self.client.get, url), queries)
+
+class ObjectPermissionsChangelistTest(TestCase):
+    fixtures = ['tests.json']
+    urls = 'guardian.tests.urls'
+
+    def setUp(self):
+        self.staff = User.objects.create(username='staff', is_staff=True)
+        self.staff.set_password('staff')
+        self.staff.save()
+        self.client.login(username='staff', password='staff')
+        self.keys = [Keycard.objects.create(key='key%d' % i)
+            for i in xrange(3)]
+
+    def test_no_perms(self):
+        response = self.client.get('/admin/guardian/keycard/')
+        self.assertEqual(response.status_code, 403)
+
+    def test_filtered(self):
+        assign('change_keycard', self.staff, self.keys[0])
+        assign('change_keycard', self.staff, self.keys[2])
+        response = self.client.get('/admin/guardian/keycard/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['cl'].result_list),
+            [self.keys[2], self.keys[0]])
+
+        response = self.client.get('/admin/guardian/keycard/%s/'
+            % self.keys[1].pk)
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get('/admin/guardian/keycard/%s/'
+            % self.keys[0].pk)
+        self.assertEqual(response.status_code, 200)
+
+    def test_inherited(self):
+        project = Project.objects.create(name='admin')
+        folders = [Folder.objects.create(project=project) for i in xrange(2)]
+        assign('change_project', self.staff, project)
+        response = self.client.get('/admin/guardian/folder/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['cl'].result_list), 2)
+        response = self.client.get('/admin/guardian/folder/%s/'
+            % folders[0].pk)
+        self.assertEqual(response.status_code, 200)
+
+    def test_global_perm(self):
+        self.staff.user_permissions.add(
+            Permission.objects.get(codename='change_keycard'))
+        response = self.client.get('/admin/guardian/keycard/')
+        self.assertEqual(len(response.context['cl'].result_list), 3)
+
@@ -1,13 +1,19 @@
+import datetime
+import marshal
+import pickle
+import zlib
 from itertools import chain
 
 from django.test import TestCase
 from django.contrib.auth.models import User, Group, Permission, AnonymousUser
 from django.contrib.contenttypes.models import ContentType
 
-from guardian.core import ObjectPermissionChecker
+from guardian.core import ObjectPermissionChecker, resolve_perm
 from guardian.models import UserObjectPermission, GroupObjectPermission
-from guardian.exceptions import NotUserNorGroup
-from guardian.shortcuts import assign
+from guardian.exceptions import NotUserNorGroup, WrongAppError
+from guardian.shortcuts import assign, remove_perm, deny
+from guardian.managers import insert_objects
+from guardian.testing import count_queries, PermissionGraphBuilder
 from guardian.tests.models import Keycard
 
 class ObjectPermissionTestCase(TestCase):
@@ -66,6 +72,26 @@ class ObjectPermissionCheckerTest(ObjectPermissionTestCase):
         for perm in perms:
             self.assertTrue(check.has_perm(perm, self.keycard))
 
+    def test_superuser_no_queries(self):
+        user = User.objects.create(username='superuser', is_superuser=True)
+        ObjectPermissionChecker(user).get_perms(self.keycard)
+        check = ObjectPermissionChecker(user)
+        key = Keycard.objects.create(key='other')
+        self.assertEqual(count_queries(check.get_perms, key), 0)
+        self.assertEqual(count_queries(check.has_perm, 'change_keycard', key),
+            0)
+
+        Permission.objects.create(codename='new_keycard_perm',
+            name='New', content_type=ContentType.objects.get_for_model(key))
+        self.assertTrue('new_keycard_perm' in check.get_perms(key))
+
+    def test_not_active_no_queries(self):
+        user = User.objects.create(username='notactive', is_active=False)
+        check = ObjectPermissionChecker(user)
+        ContentType.objects.clear_cache()
+        self.assertEqual(count_queries(check.get_perms, self.keycard), 0)
+        self.assertEqual(check.get_perms(self.keycard), [])
+
     def test_not_active_superuser(self):
         user = User.objects.create(username='not_active_superuser',
             is_superuser=True, is_active=False)
@@ -122,3 +148,246 @@ class ObjectPermissionCheckerTest(ObjectPermissionTestCase):
                 GroupObjectPermission.objects.assign(perm, self.group, obj)
             self.assertEqual(sorted(perms), sorted(check.get_perms(obj)))
 
+    def test_prefetch_perms(self):
+        keys = [Keycard.objects.create(key='key%d' % i) for i in xrange(3)]
+        assign('change_keycard', self.user, keys[0])
+        assign('delete_keycard', self.group, keys[0])
+        assign('can_use_keycard', self.group, keys[1])
+
+        check = ObjectPermissionChecker(self.user)
+        self.assertEqual(count_queries(check.prefetch_perms, keys), 2)
+        self.assertEqual(count_queries(check.has_perm, 'change_keycard',
+            keys[0]), 0)
+        self.assertEqual(sorted(check.get_perms(keys[0])),
+            ['change_keycard', 'delete_keycard'])
+        self.assertEqual(check.get_perms(keys[1]), ['can_use_keycard'])
+        self.assertEqual(check.get_perms(keys[2]), [])
+
+        check = ObjectPermissionChecker(self.group)
+        check.prefetch_perms(keys)
+        self.assertEqual(count_queries(check.get_perms, keys[1]), 0)
+        self.assertEqual(check.get_perms(keys[0]), ['delete_keycard'])
+
+    def test_global_perms(self):
+        key1 = Keycard.objects.create(key='key1')
+        key2 = Keycard.objects.create(key='key2')
+        change = Permission.objects.get(codename='change_keycard')
+        delete = Permission.objects.get(codename='delete_keycard')
+        self.user.user_permissions.add(change)
+        self.group.permissions.add(delete)
+        assign('can_use_keycard', self.user, key1)
+
+        check = ObjectPermissionChecker(self.user)
+        self.assertEqual(check.get_perms(key1), ['can_use_keycard'])
+        self.assertFalse(check.has_perm('change_keycard', key2))
+
+        user = User.objects.get(pk=self.user.pk)
+        check = ObjectPermissionChecker(user, global_perms=True)
+        self.assertEqual(sorted(check.get_perms(key1)),
+            ['can_use_keycard', 'change_keycard', 'delete_keycard'])
+        # global permissions are fetched once per user instance
+        check = ObjectPermissionChecker(user, global_perms=True)
+        self.assertEqual(count_queries(check.get_perms, key2), 1)
+        self.assertEqual(sorted(check.get_perms(key2)),
+            ['change_keycard', 'delete_keycard'])
+
+        check = ObjectPermissionChecker(self.group, global_perms=True)
+        check.prefetch_perms([key1, key2])
+        self.assertEqual(check.get_perms(key1), ['delete_keycard'])
+        self.assertEqual(check.get_perms(key2), ['delete_keycard'])
+
+class CheckerSerializationTest(ObjectPermissionTestCase):
+
+    def test_round_trip(self):
+        keycards = [Keycard.objects.create(key='key%d' % i) for i in xrange(3)]
+        assign('change_keycard', self.user, keycards[0])
+        assign('delete_keycard', self.group, keycards[1])
+        self.user.groups.add(self.group)
+        check = ObjectPermissionChecker(self.user, global_perms=True)
+        check.prefetch_perms(keycards)
+
+        restored = pickle.loads(pickle.dumps(check, 2))
+        self.assertEqual(restored.user.pk, self.user.pk)
+        self.assertEqual(restored.get_group_ids(), [self.group.pk])
+        for keycard in keycards:
+            self.assertEqual(count_queries(restored.get_perms, keycard), 0)
+            self.assertEqual(sorted(restored.get_perms(keycard)),
+                sorted(check.get_perms(keycard)))
+        # uncached objects are fetched as usual
+        self.assertFalse(restored.has_perm('change_keycard', self.keycard))
+
+        restored = ObjectPermissionChecker.from_bytes(check.to_bytes(),
+            self.user)
+        self.assertTrue(restored.user is self.user)
+        self.assertTrue(restored.has_perm('delete_keycard', keycards[1]))
+        self.assertRaises(ValueError, ObjectPermissionChecker.from_bytes,
+            check.to_bytes(), self.group)
+
+    def test_group_and_superuser(self):
+        assign('change_keycard', self.group, self.keycard)
+        check = ObjectPermissionChecker(self.group)
+        check.get_perms(self.keycard)
+        restored = ObjectPermissionChecker.from_bytes(check.to_bytes())
+        self.assertEqual((restored.user, restored.group.pk),
+            (None, self.group.pk))
+        self.assertEqual(count_queries(restored.get_perms, self.keycard), 0)
+        self.assertEqual(restored.get_perms(self.keycard), ['change_keycard'])
+
+        admin = User.objects.create(username='admin', is_superuser=True)
+        restored = ObjectPermissionChecker.from_bytes(
+            ObjectPermissionChecker(admin).to_bytes())
+        # only the user itself is fetched
+        self.assertEqual(count_queries(restored.has_perm, 'change_keycard',
+            self.keycard), 1)
+        self.assertTrue(restored.has_perm('change_keycard', self.keycard))
+
+    def test_compact(self):
+        insert_objects(Keycard, [Keycard(key='key%d' % i)
+            for i in xrange(2000)], 'default')
+        keycards = list(Keycard.objects.order_by('pk'))
+        graph = PermissionGraphBuilder()
+        graph.assign('change_keycard', keycards, users=[self.user.username])
+        graph.assign('delete_keycard', keycards[::2],
+            users=[self.user.username])
+        graph.build()
+        check = ObjectPermissionChecker(self.user)
+        check.prefetch_perms(keycards)
+        self.assertTrue(len(check.to_bytes()) < 500)
+
+        restored = ObjectPermissionChecker.from_bytes(check.to_bytes())
+        for keycard in keycards[:2]:
+            self.assertEqual(sorted(restored.get_perms(keycard)),
+                sorted(check.get_perms(keycard)))
+        self.assertEqual(len(restored._obj_perms_cache), len(keycards))
+
+    def test_stale(self):
+        assign('change_keycard', self.user, self.keycard)
+        check = ObjectPermissionChecker(self.user)
+        check.get_perms(self.keycard)
+        data = check.to_bytes()
+        remove_perm('change_keycard', self.user, self.keycard)
+        restored = ObjectPermissionChecker.from_bytes(data)
+        self.assertEqual(restored._obj_perms_cache, {})
+        self.assertFalse(restored.has_perm('change_keycard', self.keycard))
+
+        # user's flags are fetched again
+        assign('change_keycard', self.user, self.keycard)
+        data = ObjectPermissionChecker.from_bytes(data).to_bytes()
+        self.assertTrue(ObjectPermissionChecker.from_bytes(data)
+            .has_perm('change_keycard', self.keycard))
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertFalse(ObjectPermissionChecker.from_bytes(data)
+            .has_perm('change_keycard', self.keycard))
+
+    def test_expired(self):
+        expires_at = datetime.datetime.now() + datetime.timedelta(hours=1)
+        assign('change_keycard', self.user, self.keycard, expires_at)
+        assign('delete_keycard', self.group, self.keycard,
+            datetime.timedelta(hours=2))
+        self.user.groups.add(self.group)
+        check = ObjectPermissionChecker(self.user)
+        check.get_perms(self.keycard)
+        self.assertEqual(check.get_valid_until(), expires_at)
+        check = ObjectPermissionChecker(self.user)
+        check.prefetch_perms([self.keycard])
+        self.assertEqual(check.get_valid_until(), expires_at)
+        # expiration is tracked while permissions are fetched
+        self.assertEqual(count_queries(check.to_bytes), 0)
+
+        data = check.to_bytes()
+        self.assertEqual(ObjectPermissionChecker.from_bytes(data)
+            ._obj_perms_cache, check._obj_perms_cache)
+        # snapshot with permission expired in the meantime
+        state = list(marshal.loads(zlib.decompress(data)))
+        state[4] -= 7200
+        restored = ObjectPermissionChecker.from_bytes(
+            zlib.compress(marshal.dumps(tuple(state))))
+        self.assertEqual(restored._obj_perms_cache, {})
+
+    def test_expired_deny(self):
+        assign('change_keycard', self.user, self.keycard)
+        deny('change_keycard', self.user, self.keycard,
+            datetime.timedelta(hours=1))
+        check = ObjectPermissionChecker(self.user)
+        self.assertEqual(check.get_perms(self.keycard), [])
+        # expiration of the deny entry is not known, so the object is left
+        # out of the snapshot
+        restored = ObjectPermissionChecker.from_bytes(check.to_bytes())
+        self.assertEqual(restored._obj_perms_cache, {})
+        check.prefetch_perms([self.keycard])
+        self.assertEqual(check.get_valid_until(), UserObjectPermission
+            .objects.get(deny=True).expires_at)
+        restored = ObjectPermissionChecker.from_bytes(check.to_bytes())
+        self.assertEqual(restored._obj_perms_cache, check._obj_perms_cache)
+
+    def test_lazy_user(self):
+        check = ObjectPermissionChecker(self.user)
+        check.get_global_perms(ContentType.objects.get_for_model(Keycard))
+        data = check.to_bytes()
+        self.assertEqual(count_queries(ObjectPermissionChecker.from_bytes,
+            data), 0)
+        restored = ObjectPermissionChecker.from_bytes(data)
+        self.assertEqual(count_queries(pickle.loads,
+            pickle.dumps(check, 2)), 0)
+        self.assertEqual(count_queries(restored.to_bytes), 0)
+        self.assertEqual(restored.to_bytes(), data)
+        self.assertEqual(restored.user.pk, self.user.pk)
+        self.assertEqual(count_queries(restored.get_global_perms,
+            ContentType.objects.get_for_model(Keycard)), 0)
+
+        User.objects.filter(pk=self.user.pk).delete()
+        restored = ObjectPermissionChecker.from_bytes(data)
+        self.assertRaises(ValueError, getattr, restored, 'user')
+
+    def test_stamp(self):
+        assign('change_keycard', self.user, self.keycard)
+        check = ObjectPermissionChecker(self.user)
+        check.get_perms(self.keycard)
+        data = check.to_bytes()
+        self.user.last_login = datetime.datetime.now()
+        self.user.save()
+        self.group.save()
+        self.assertTrue(ObjectPermissionChecker.from_bytes(data)
+            ._obj_perms_cache)
+        self.user.groups.add(self.group)
+        self.assertFalse(ObjectPermissionChecker.from_bytes(data)
+            ._obj_perms_cache)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, ObjectPermissionChecker.from_bytes,
+            'garbage')
+        data = ObjectPermissionChecker(self.user).to_bytes()
+        state = (0,) + marshal.loads(zlib.decompress(data))[1:]
+        self.assertRaises(ValueError, ObjectPermissionChecker.from_bytes,
+            zlib.compress(marshal.dumps(state)))
+
+class ResolvePermTest(ObjectPermissionTestCase):
+
+    def test_resolve_perm(self):
+        perm = Permission.objects.get(codename='change_keycard')
+        ctype = ContentType.objects.get_for_model(Keycard)
+        expected = (ctype.id, perm.id, 'change_keycard')
+        self.assertEqual(resolve_perm('change_keycard', self.keycard),
+            expected)
+        self.assertEqual(count_queries(resolve_perm, 'guardian.change_keycard',
+            Keycard), 0)
+        self.assertEqual(resolve_perm('guardian.change_keycard', Keycard),
+            expected)
+        self.assertEqual(resolve_perm('change_user', self.keycard), None)
+        self.assertRaises(WrongAppError, resolve_perm, 'auth.change_keycard',
+            self.keycard)
+
+    def test_cache_cleared(self):
+        self.assertEqual(resolve_perm('rename_keycard', Keycard), None)
+        perm = Permission.objects.create(codename='rename_keycard',
+            content_type=ContentType.objects.get_for_model(Keycard))
+        self.assertEqual(resolve_perm('rename_keycard', Keycard)[1], perm.id)
+        perm.delete()
+        self.assertEqual(resolve_perm('rename_keycard', Keycard), None)
+
+    def test_assign_queries(self):
+        assign('change_keycard', self.user, self.keycard)
+        key = Keycard.objects.create(key='other')
+        # permission is neither fetched by assign nor by validation in save
+        self.assertEqual(count_queries(assign, 'guardian.change_keycard',
+            self.user, key), 2)
@@ -0,0 +1,112 @@
+import datetime
+
+from django.contrib.auth.models import User, Group, Permission
+
+from guardian.core import ObjectPermissionChecker
+from guardian.models import UserObjectPermission
+from guardian.shortcuts import assign, deny, remove_perm, get_objs
+from guardian.shortcuts import iter_objs, get_users_with_perm
+from guardian.testing import count_queries
+from guardian.tests.core_test import ObjectPermissionTestCase
+from guardian.tests.models import Keycard, Project, Folder, Document
+
+class DenyObjectPermissionTest(ObjectPermissionTestCase):
+
+    def setUp(self):
+        super(DenyObjectPermissionTest, self).setUp()
+        self.user.groups.add(self.group)
+
+    def test_deny_wins(self):
+        assign('change_keycard', self.group, self.keycard)
+        assign('delete_keycard', self.group, self.keycard)
+        deny('change_keycard', self.user, self.keycard)
+        check = ObjectPermissionChecker(self.user)
+        self.assertEqual(count_queries(check.get_perms, self.keycard), 1)
+        self.assertEqual(check.get_perms(self.keycard), ['delete_keycard'])
+        self.assertFalse(self.user.has_perm('change_keycard', self.keycard))
+
+        check = ObjectPermissionChecker(self.user)
+        check.prefetch_perms([self.keycard])
+        self.assertEqual(check.get_perms(self.keycard), ['delete_keycard'])
+
+    def test_group_deny(self):
+        assign('change_keycard', self.user, self.keycard)
+        deny('change_keycard', self.group, self.keycard)
+        self.assertFalse(self.user.has_perm('change_keycard', self.keycard))
+        check = ObjectPermissionChecker(self.group)
+        self.assertEqual(check.get_perms(self.keycard), [])
+
+    def test_assign_and_remove(self):
+        deny('change_keycard', self.user, self.keycard)
+        assign('change_keycard', self.user, self.keycard)
+        self.assertEqual(UserObjectPermission.objects.get().deny, False)
+        self.assertTrue(self.user.has_perm('change_keycard', self.keycard))
+
+        deny('change_keycard', self.user, self.keycard)
+        self.assertEqual(UserObjectPermission.objects.get().deny, True)
+        remove_perm('change_keycard', self.user, self.keycard)
+        self.assertEqual(UserObjectPermission.objects.count(), 0)
+
+    def test_deny_existing(self):
+        manager = UserObjectPermission.objects
+        # row inserted by other process in the meantime
+        manager.assign_ignore_conflicts('change_keycard', self.user,
+            self.keycard)
+        obj_perm = manager.deny('change_keycard', self.user, self.keycard)
+        self.assertEqual(obj_perm, manager.get(deny=True))
+        obj_perm = manager.deny('change_keycard', self.user, self.keycard,
+            datetime.timedelta(hours=1))
+        self.assertEqual(manager.get().expires_at, obj_perm.expires_at)
+        self.assertFalse(self.user.has_perm('change_keycard', self.keycard))
+
+    def test_global_perms(self):
+        self.user.user_permissions.add(Permission.objects.get(
+            codename='change_keycard'))
+        deny('change_keycard', self.user, self.keycard)
+        check = ObjectPermissionChecker(self.user, global_perms=True)
+        self.assertEqual(check.get_perms(self.keycard), [])
+        check = ObjectPermissionChecker(self.user, global_perms=True)
+        check.prefetch_perms([self.keycard])
+        self.assertEqual(check.get_perms(self.keycard), [])
+
+    def test_inherited(self):
+        project = Project.objects.create(name='project')
+        folders = [Folder.objects.create(project=project) for i in xrange(2)]
+        docs = [Document.objects.create(folder=folder) for folder in folders]
+        assign('change_project', self.group, project)
+        deny('change_project', self.user, project)
+        check = ObjectPermissionChecker(self.user)
+        self.assertEqual(check.get_perms(docs[0]), [])
+
+        remove_perm('change_project', self.user, project)
+        deny('change_folder', self.user, folders[0])
+        check = ObjectPermissionChecker(self.user)
+        check.prefetch_perms(docs)
+        self.assertEqual(check.get_perms(docs[0]), [])
+        self.assertEqual(check.get_perms(docs[1]), ['change_document'])
+
+    def test_get_objs(self):
+        other = Keycard.objects.create(key='other')
+        assign('change_keycard', self.group, self.keycard)
+        assign('change_keycard', self.group, other)
+        assign('delete_keycard', self.user, other)
+        deny('change_keycard', self.user, self.keycard)
+        deny('change_keycard', self.user, other)
+        self.assertEqual(list(get_objs(Keycard, 'change_keycard', self.user)),
+            [])
+        self.assertEqual(list(get_objs(Keycard,
+            ['change_keycard', 'delete_keycard'], self.user)), [other])
+        self.assertEqual(list(get_objs(Keycard, 'change_keycard',
+            self.group)), [self.keycard, other])
+        self.assertEqual(list(iter_objs(Keycard, 'change_keycard', self.user,
+            ids_only=True)), [])
+        self.assertEqual(list(iter_objs(Keycard, 'change_keycard',
+            self.group, ids_only=True)), [self.keycard.pk, other.pk])
+
+    def test_get_users_with_perm(self):
+        joe = User.objects.create(username='joe')
+        joe.groups.add(self.group)
+        assign('change_keycard', self.group, self.keycard)
+        deny('change_keycard', self.user, self.keycard)
+        self.assertEqual(list(get_users_with_perm(self.keycard,
+            'change_keycard')), [joe])
@@ -0,0 +1,108 @@
+from django.test import TestCase
+from django.contrib.auth.models import User, Group
+from django.core.exceptions import ValidationError
+from django.contrib.auth.models import Permission
+
+from guardian.core import ObjectPermissionChecker
+from guardian.models import UserObjectPermission, GroupObjectPermission
+from guardian.shortcuts import assign, remove_perm, get_perms
+from guardian.shortcuts import get_users_with_perm, iter_objs
+from guardian.utils import get_user_obj_perms_model
+from guardian.utils import get_group_obj_perms_model
+from guardian.tests.models import Keycard, Project
+from guardian.tests.models import ProjectUserObjectPermission
+from guardian.tests.models import ProjectGroupObjectPermission
+
+class DirectObjectPermissionTestCase(TestCase):
+    fixtures = ['tests.json']
+
+    def setUp(self):
+        self.user = User.objects.get(username='jack')
+        self.group = Group.objects.get(name='jackGroup')
+        self.project = Project.objects.create(name='Foobar')
+
+class GetObjPermsModelTest(DirectObjectPermissionTestCase):
+
+    def test_direct(self):
+        self.assertEqual(get_user_obj_perms_model(self.project),
+            ProjectUserObjectPermission)
+        self.assertEqual(get_user_obj_perms_model(Project),
+            ProjectUserObjectPermission)
+        self.assertEqual(get_group_obj_perms_model(self.project),
+            ProjectGroupObjectPermission)
+
+    def test_generic(self):
+        self.assertEqual(get_user_obj_perms_model(Keycard),
+            UserObjectPermission)
+        self.assertEqual(get_group_obj_perms_model(Keycard),
+            GroupObjectPermission)
+
+class DirectUserPermissionTest(DirectObjectPermissionTestCase):
+
+    def test_assign(self):
+        assign('change_project', self.user, self.project)
+        self.assertTrue(self.user.has_perm('change_project', self.project))
+        self.assertTrue(self.user.has_perm('guardian.change_project',
+            self.project))
+        self.assertEqual(ProjectUserObjectPermission.objects
+            .filter(content_object=self.project).count(), 1)
+        self.assertEqual(UserObjectPermission.objects.count(), 0)
+
+    def test_remove_perm(self):
+        assign('change_project', self.user, self.project)
+        remove_perm('change_project', self.user, self.project)
+        self.assertFalse(self.user.has_perm('change_project', self.project))
+        self.assertEqual(ProjectUserObjectPermission.objects.count(), 0)
+
+    def test_other_project(self):
+        other = Project.objects.create(name='Other')
+        assign('change_project', self.user, self.project)
+        self.assertEqual(get_perms(self.user, other), [])
+
+    def test_user_methods(self):
+        self.user.add_obj_perm('delete_project', self.project)
+        self.assertEqual(get_perms(self.user, self.project), ['delete_project'])
+        self.user.del_obj_perm('delete_project', self.project)
+        self.assertEqual(get_perms(self.user, self.project), [])
+
+    def test_validation(self):
+        perm = Permission.objects.get(codename='change_keycard')
+        self.assertRaises(ValidationError,
+            ProjectUserObjectPermission.objects.create, permission=perm,
+            user=self.user, content_object=self.project)
+
+class DirectGroupPermissionTest(DirectObjectPermissionTestCase):
+
+    def test_assign(self):
+        assign('change_project', self.group, self.project)
+        self.assertTrue(self.user.has_perm('change_project', self.project))
+        check = ObjectPermissionChecker(self.group)
+        self.assertEqual(check.get_perms(self.project), ['change_project'])
+        self.assertEqual(GroupObjectPermission.objects.count(), 0)
+
+    def test_remove_perm(self):
+        assign('change_project', self.group, self.project)
+        remove_perm('change_project', self.group, self.project)
+        self.assertFalse(self.user.has_perm('change_project', self.project))
+
+class DirectShortcutsTest(DirectObjectPermissionTestCase):
+
+    def test_get_users_with_perm(self):
+        john = User.objects.create(username='john')
+        assign('change_project', self.group, self.project)
+        assign('change_project', john, self.project)
+        users = get_users_with_perm(self.project, 'change_project')
+        self.assertEqual(set(users), set([self.user, john]))
+
+        remove_perm('change_project', john, self.project)
+        users = get_users_with_perm(self.project, 'change_project')
+        self.assertEqual(list(users), [self.user])
+
+    def test_iter_objs(self):
+        projects = [Project.objects.create(name='p%d' % i) for i in xrange(5)]
+        for project in projects[:3]:
+            assign('change_project', self.user, project)
+        for project in projects[2:]:
+            assign('change_project', self.group, project)
+        self.assertEqual(list(iter_objs(Project, 'change_project', self.user,
+            chunk_size=2)), projects)
@@ -0,0 +1,102 @@
+import datetime
+from StringIO import StringIO
+
+from django.contrib.auth.models import User, Group
+from django.core.management import call_command
+from django.test import TestCase
+
+from guardian import shortcuts
+from guardian.core import ObjectPermissionChecker
+from guardian.models import UserObjectPermission, GroupObjectPermission
+from guardian.shortcuts import assign, get_objs, iter_objs
+from guardian.shortcuts import get_users_with_perm
+from guardian.tests.models import Keycard, Project
+from guardian.tests.models import ProjectUserObjectPermission
+
+class RecordingCache(object):
+    """
+    Cache wrapper recording timeouts given to ``set``.
+    """
+    def __init__(self, cache):
+        self.cache = cache
+        self.timeouts = []
+
+    def set(self, key, value, timeout=None):
+        self.timeouts.append(timeout)
+        return self.cache.set(key, value, timeout)
+
+    def __getattr__(self, name):
+        return getattr(self.cache, name)
+
+class ExpiringObjectPermissionTest(TestCase):
+    fixtures = ['tests.json']
+
+    def setUp(self):
+        self.user = User.objects.get(username='jack')
+        self.group = Group.objects.get(name='jackGroup')
+        self.keycard = Keycard.objects.create(key='expiring')
+        self.past = datetime.datetime.now() - datetime.timedelta(hours=1)
+
+    def test_checker(self):
+        assign('change_keycard', self.user, self.keycard, self.past)
+        assign('delete_keycard', self.group, self.keycard,
+            datetime.timedelta(hours=1))
+        check = ObjectPermissionChecker(self.user)
+        self.assertEqual(check.get_perms(self.keycard), ['delete_keycard'])
+
+        check = ObjectPermissionChecker(self.user)
+        check.prefetch_perms([self.keycard])
+        self.assertEqual(check.get_perms(self.keycard), ['delete_keycard'])
+
+    def test_reassign(self):
+        assign('change_keycard', self.user, self.keycard, self.past)
+        obj_perm = assign('change_keycard', self.user, self.keycard)
+        self.assertEqual(obj_perm.expires_at, None)
+        self.assertTrue(self.user.has_perm('change_keycard', self.keycard))
+
+    def test_bulk_assign_replaces_expired(self):
+        manager = GroupObjectPermission.objects
+        manager.assign('change_keycard', self.group, self.keycard, self.past)
+        self.assertEqual(manager.bulk_assign('change_keycard', [self.group],
+            self.keycard), 1)
+        self.assertEqual(manager.get(group=self.group).expires_at, None)
+
+    def test_get_objs(self):
+        other = Keycard.objects.create(key='other')
+        assign('change_keycard', self.user, self.keycard, self.past)
+        assign('change_keycard', self.user, other)
+        self.assertEqual(list(get_objs(Keycard, 'change_keycard', self.user)),
+            [other])
+        self.assertEqual(list(iter_objs(Keycard, 'change_keycard', self.user,
+            ids_only=True)), [other.pk])
+
+    def test_get_users_with_perm(self):
+        joe = User.objects.create(username='joe')
+        assign('change_keycard', joe, self.keycard, self.past)
+        assign('change_keycard', self.user, self.keycard,
+            datetime.timedelta(minutes=2))
+        cache = shortcuts.cache = RecordingCache(shortcuts.cache)
+        try:
+            self.assertEqual(list(get_users_with_perm(self.keycard,
+                'change_keycard')), [self.user])
+        finally:
+            shortcuts.cache = cache.cache
+        # cached result expires together with the first grant
+        self.assertTrue(110 <= cache.timeouts[0] <= 121)
+
+    def test_clean_expired_obj_perms(self):
+        project = Project.objects.create(name='expiring')
+        assign('change_keycard', self.user, self.keycard, self.past)
+        assign('delete_keycard', self.user, self.keycard)
+        assign('change_keycard', self.group, self.keycard, self.past)
+        assign('change_project', self.user, project, self.past)
+        assign('delete_project', self.user, project,
+            datetime.timedelta(hours=1))
+
+        call_command('clean_expired_obj_perms', batch_size=1,
+            stdout=StringIO())
+        self.assertEqual([p.permission.codename for p in
+            UserObjectPermission.objects.all()], ['delete_keycard'])
+        self.assertEqual(GroupObjectPermission.objects.count(), 0)
+        self.assertEqual([p.permission.codename for p in
+            ProjectUserObjectPermission.objects.all()], ['delete_project'])
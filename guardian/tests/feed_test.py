@@ -0,0 +1,212 @@
+import datetime
+from StringIO import StringIO
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+
+from guardian import feed
+from guardian.conf import settings as guardian_settings
+from guardian.models import UserObjectPermission, GroupObjectPermission
+from guardian.models import ObjectPermissionChange
+from guardian.shortcuts import assign, deny, remove_perm, transfer_perms
+from guardian.shortcuts import copy_perms
+from guardian.signals import obj_perms_changed
+from guardian.tests.core_test import ObjectPermissionTestCase
+from guardian.tests.models import Keycard, Project
+
+class RecordingSink(object):
+    sent = []
+
+    def send(self, events, using):
+        self.sent.append((using, events))
+
+class ChangeFeedTestCase(ObjectPermissionTestCase):
+    sink = 'guardian.tests.feed_test.RecordingSink'
+
+    def setUp(self):
+        super(ChangeFeedTestCase, self).setUp()
+        self.ctype = ContentType.objects.get_for_model(Keycard)
+        self.change_sink = guardian_settings.CHANGE_SINK
+        guardian_settings.CHANGE_SINK = self.sink
+        RecordingSink.sent = []
+
+    def tearDown(self):
+        guardian_settings.CHANGE_SINK = self.change_sink
+
+    def event(self, action, identity, codename, object_ids, ctype=None):
+        return feed.ObjectPermissionEvent(action,
+            identity.__class__.__name__.lower(), identity.pk, codename,
+            (ctype or self.ctype).id, object_ids)
+
+class ChangeFeedTest(ChangeFeedTestCase):
+
+    def test_assign_deny_remove(self):
+        assign('change_keycard', self.user, self.keycard)
+        deny('delete_keycard', self.group, self.keycard)
+        remove_perm('change_keycard', self.user, self.keycard)
+        self.assertEqual(RecordingSink.sent, [
+            ('default', [self.event('assigned', self.user, 'change_keycard',
+                [self.keycard.pk])]),
+            ('default', [self.event('denied', self.group, 'delete_keycard',
+                [self.keycard.pk])]),
+            ('default', [self.event('removed', self.user, 'change_keycard',
+                [self.keycard.pk])]),
+        ])
+
+    def test_direct(self):
+        project = Project.objects.create(name='feed')
+        assign('change_project', self.user, project)
+        self.assertEqual(RecordingSink.sent, [('default', [self.event(
+            'assigned', self.user, 'change_project', [project.pk],
+            ContentType.objects.get_for_model(Project))])])
+
+    def test_bulk(self):
+        joe = User.objects.create(username='joe')
+        deny('change_keycard', joe, self.keycard)
+        RecordingSink.sent = []
+        manager = GroupObjectPermission.objects
+        manager.bulk_assign('change_keycard', [self.group], self.keycard)
+        self.assertEqual(RecordingSink.sent, [('default', [self.event(
+            'assigned', self.group, 'change_keycard', [self.keycard.pk])])])
+
+        # deny entries are not reported as grants
+        RecordingSink.sent = []
+        UserObjectPermission.objects.bulk_assign('change_keycard',
+            [self.user, joe], self.keycard)
+        self.assertEqual(RecordingSink.sent, [('default', [self.event(
+            'assigned', self.user, 'change_keycard', [self.keycard.pk])])])
+
+        # existing grants are not reported again
+        RecordingSink.sent = []
+        UserObjectPermission.objects.bulk_assign('change_keycard',
+            [self.user, joe], self.keycard)
+        self.assertEqual(RecordingSink.sent, [])
+
+        RecordingSink.sent = []
+        UserObjectPermission.objects.bulk_remove_perm('change_keycard',
+            [self.user, joe], self.keycard)
+        self.assertEqual(len(RecordingSink.sent), 1)
+        self.assertEqual(sorted(event.identity_id
+            for event in RecordingSink.sent[0][1]), [self.user.pk, joe.pk])
+
+    def test_copy_perms(self):
+        keycards = [Keycard.objects.create(key='key%d' % i) for i in xrange(3)]
+        assign('change_keycard', self.user, self.keycard)
+        deny('delete_keycard', self.user, self.keycard)
+        assign('change_keycard', self.user, keycards[0])
+        RecordingSink.sent = []
+        copy_perms(self.keycard, keycards, include_groups=False)
+        self.assertEqual(RecordingSink.sent, [('default', [
+            self.event('assigned', self.user, 'change_keycard',
+                [keycard.pk for keycard in keycards[1:]]),
+            self.event('denied', self.user, 'delete_keycard',
+                [keycard.pk for keycard in keycards])])])
+
+        # nothing is inserted by copying again
+        RecordingSink.sent = []
+        copy_perms(self.keycard, keycards, include_groups=False)
+        self.assertEqual(RecordingSink.sent, [])
+
+    def test_batch_merges_events(self):
+        keycards = [Keycard.objects.create(key='key%d' % i) for i in xrange(3)]
+        for keycard in keycards:
+            assign('change_keycard', self.user, keycard)
+        RecordingSink.sent = []
+        feed.start_batch()
+        UserObjectPermission.objects.all().delete()
+        self.assertEqual(RecordingSink.sent, [])
+        feed.end_batch()
+        self.assertEqual(len(RecordingSink.sent), 1)
+        using, events = RecordingSink.sent[0]
+        self.assertEqual(len(events), 1)
+        self.assertEqual(sorted(events[0].object_ids),
+            [keycard.pk for keycard in keycards])
+
+    def test_batch_discarded_on_error(self):
+        def fail():
+            assign('change_keycard', self.user, self.keycard)
+            raise ValueError
+        self.assertRaises(ValueError, feed.batched(fail))
+        self.assertEqual(RecordingSink.sent, [])
+
+    def test_merge_keeps_order(self):
+        events = [self.event('removed', self.user, 'change_keycard', [1]),
+            self.event('assigned', self.user, 'change_keycard', [1]),
+            self.event('removed', self.user, 'change_keycard', [2]),
+            self.event('removed', self.user, 'change_keycard', [3, 2])]
+        self.assertEqual(feed.merge_events(events), [events[0], events[1],
+            self.event('removed', self.user, 'change_keycard', [2, 3])])
+
+    def test_cascade(self):
+        assign('change_keycard', self.user, self.keycard)
+        joe = User.objects.create(username='joe')
+        assign('change_keycard', joe, self.keycard)
+        RecordingSink.sent = []
+        event = self.event('removed', joe, 'change_keycard', [self.keycard.pk])
+        joe.delete()
+        self.assertEqual(RecordingSink.sent, [('default', [event])])
+
+    def test_clean_expired(self):
+        past = datetime.datetime.now() - datetime.timedelta(hours=1)
+        for i in xrange(3):
+            assign('change_keycard', self.user,
+                Keycard.objects.create(key='key%d' % i), past)
+        RecordingSink.sent = []
+        call_command('clean_expired_obj_perms', stdout=StringIO())
+        self.assertEqual(len(RecordingSink.sent), 1)
+        self.assertEqual(len(RecordingSink.sent[0][1][0].object_ids), 3)
+
+    def test_transfer(self):
+        keycards = [Keycard.objects.create(key='key%d' % i) for i in xrange(2)]
+        for keycard in keycards:
+            assign('change_keycard', self.user, keycard)
+        joe = User.objects.create(username='joe')
+        RecordingSink.sent = []
+        transfer_perms(self.user, joe)
+        object_ids = [keycard.pk for keycard in keycards]
+        self.assertEqual(RecordingSink.sent, [('default', [
+            self.event('removed', self.user, 'change_keycard', object_ids),
+            self.event('assigned', joe, 'change_keycard', object_ids)])])
+
+    def test_no_sink(self):
+        guardian_settings.CHANGE_SINK = None
+        assign('change_keycard', self.user, self.keycard)
+        self.assertEqual(RecordingSink.sent, [])
+
+    def test_invalid_sink(self):
+        guardian_settings.CHANGE_SINK = 'guardian.tests.feed_test.Missing'
+        self.assertRaises(ImproperlyConfigured, feed.get_sink)
+
+class SignalSinkTest(ChangeFeedTestCase):
+    sink = 'guardian.feed.SignalSink'
+
+    def test_signal(self):
+        received = []
+        def receiver(sender, events, using, **kwargs):
+            received.append((using, events))
+        obj_perms_changed.connect(receiver)
+        try:
+            assign('change_keycard', self.user, self.keycard)
+        finally:
+            obj_perms_changed.disconnect(receiver)
+        self.assertEqual(received, [('default', [self.event('assigned',
+            self.user, 'change_keycard', [self.keycard.pk])])])
+
+class OutboxSinkTest(ChangeFeedTestCase):
+    sink = 'guardian.feed.OutboxSink'
+
+    def test_outbox(self):
+        keycards = [Keycard.objects.create(key='key%d' % i) for i in xrange(2)]
+        GroupObjectPermission.objects.bulk_assign('change_keycard',
+            [self.group], keycards[0])
+        deny('delete_keycard', self.user, keycards[1])
+        self.assertEqual([(change.action, change.identity_type,
+            change.identity_id, change.codename, change.content_type_id,
+            change.object_id)
+            for change in ObjectPermissionChange.objects.all()],
+            [('assigned', 'group', self.group.pk, 'change_keycard',
+                self.ctype.id, unicode(keycards[0].pk)),
+            ('denied', 'user', self.user.pk, 'delete_keycard',
+                self.ctype.id, unicode(keycards[1].pk))])
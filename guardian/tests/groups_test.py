@@ -0,0 +1,120 @@
+from django.contrib.auth.models import User, Group, Permission
+from django.core.exceptions import ValidationError
+from django.test import TestCase
+
+from guardian.conf import settings as guardian_settings
+from guardian.core import ObjectPermissionChecker
+from guardian.models import SubGroup, GroupClosure
+from guardian.shortcuts import assign, deny, get_objs, get_users_with_perm
+from guardian.testing import count_queries
+from guardian.tests.models import Keycard
+
+class GroupClosureTest(TestCase):
+
+    def setUp(self):
+        self.a, self.b, self.c, self.d = [Group.objects.create(name=name)
+            for name in 'abcd']
+
+    def closure(self):
+        return dict(((row.ancestor.name, row.descendant.name), row.paths)
+            for row in GroupClosure.objects.select_related())
+
+    def test_chain(self):
+        SubGroup.objects.create(group=self.b, subgroup=self.c)
+        SubGroup.objects.create(group=self.a, subgroup=self.b)
+        SubGroup.objects.create(group=self.c, subgroup=self.d)
+        self.assertEqual(self.closure(), {('a', 'b'): 1, ('a', 'c'): 1,
+            ('a', 'd'): 1, ('b', 'c'): 1, ('b', 'd'): 1, ('c', 'd'): 1})
+
+        SubGroup.objects.get(group=self.b, subgroup=self.c).delete()
+        self.assertEqual(self.closure(), {('a', 'b'): 1, ('c', 'd'): 1})
+
+    def test_diamond(self):
+        SubGroup.objects.create(group=self.a, subgroup=self.b)
+        SubGroup.objects.create(group=self.a, subgroup=self.c)
+        SubGroup.objects.create(group=self.b, subgroup=self.d)
+        SubGroup.objects.create(group=self.c, subgroup=self.d)
+        self.assertEqual(self.closure()[('a', 'd')], 2)
+
+        # d is still nested in a through c
+        SubGroup.objects.get(group=self.b, subgroup=self.d).delete()
+        self.assertEqual(self.closure(), {('a', 'b'): 1, ('a', 'c'): 1,
+            ('a', 'd'): 1, ('c', 'd'): 1})
+
+    def test_group_deleted(self):
+        SubGroup.objects.create(group=self.a, subgroup=self.b)
+        SubGroup.objects.create(group=self.b, subgroup=self.c)
+        SubGroup.objects.create(group=self.a, subgroup=self.d)
+        SubGroup.objects.create(group=self.d, subgroup=self.c)
+        self.b.delete()
+        self.assertEqual(self.closure(), {('a', 'c'): 1, ('a', 'd'): 1,
+            ('d', 'c'): 1})
+
+    def test_cycles(self):
+        SubGroup.objects.create(group=self.a, subgroup=self.b)
+        SubGroup.objects.create(group=self.b, subgroup=self.c)
+        self.assertRaises(ValidationError, SubGroup.objects.create,
+            group=self.c, subgroup=self.a)
+        self.assertRaises(ValidationError, SubGroup.objects.create,
+            group=self.a, subgroup=self.a)
+
+class NestedGroupsTest(TestCase):
+
+    def setUp(self):
+        self.nested_groups = guardian_settings.NESTED_GROUPS
+        guardian_settings.NESTED_GROUPS = True
+        self.user = User.objects.create(username='joe')
+        self.groups = [Group.objects.create(name='level%d' % i)
+            for i in xrange(4)]
+        for group, subgroup in zip(self.groups, self.groups[1:]):
+            SubGroup.objects.create(group=group, subgroup=subgroup)
+        self.user.groups.add(self.groups[-1])
+        self.keycard = Keycard.objects.create(key='key')
+        assign('change_keycard', self.groups[0], self.keycard)
+
+    def tearDown(self):
+        guardian_settings.NESTED_GROUPS = self.nested_groups
+
+    def test_checker(self):
+        check = ObjectPermissionChecker(self.user)
+        self.assertEqual(count_queries(check.get_perms, self.keycard), 1)
+        self.assertEqual(check.get_perms(self.keycard), ['change_keycard'])
+
+        check = ObjectPermissionChecker(self.user)
+        check.prefetch_perms([self.keycard])
+        self.assertEqual(check.get_perms(self.keycard), ['change_keycard'])
+        self.assertEqual(sorted(check.get_group_ids()),
+            sorted(group.pk for group in self.groups))
+
+        deny('change_keycard', self.groups[1], self.keycard)
+        check = ObjectPermissionChecker(self.user)
+        self.assertEqual(check.get_perms(self.keycard), [])
+
+    def test_disabled(self):
+        guardian_settings.NESTED_GROUPS = False
+        check = ObjectPermissionChecker(self.user)
+        self.assertEqual(check.get_perms(self.keycard), [])
+        self.assertEqual(check.get_group_ids(), [self.groups[-1].pk])
+
+    def test_global_perms(self):
+        perm = Permission.objects.get(codename='delete_keycard')
+        self.groups[0].permissions.add(perm)
+        check = ObjectPermissionChecker(self.user, global_perms=True)
+        self.assertEqual(sorted(check.get_perms(self.keycard)),
+            ['change_keycard', 'delete_keycard'])
+
+    def test_shortcuts(self):
+        other = Keycard.objects.create(key='other')
+        self.assertEqual(list(get_objs(Keycard, 'change_keycard', self.user)),
+            [self.keycard])
+        self.assertEqual(list(get_users_with_perm(self.keycard,
+            'change_keycard')), [self.user])
+        self.assertTrue(self.user.has_perm('change_keycard', self.keycard))
+        self.assertFalse(self.user.has_perm('change_keycard', other))
+
+        SubGroup.objects.get(group=self.groups[0],
+            subgroup=self.groups[1]).delete()
+        self.assertEqual(list(get_users_with_perm(self.keycard,
+            'change_keycard')), [])
+        self.assertFalse(ObjectPermissionChecker(self.user)
+            .has_perm('change_keycard', self.keycard))
@@ -0,0 +1,95 @@
+from django.contrib.auth.models import User, Group
+
+from guardian.core import ObjectPermissionChecker
+from guardian.shortcuts import assign, deny, get_objs, iter_objs
+from guardian.testing import count_queries
+from guardian.tests.core_test import ObjectPermissionTestCase
+from guardian.tests.models import Project, Folder, Document
+
+class ObjectPermissionInheritanceTest(ObjectPermissionTestCase):
+
+    def setUp(self):
+        super(ObjectPermissionInheritanceTest, self).setUp()
+        self.project = Project.objects.create(name='project')
+        self.folder = Folder.objects.create(project=self.project)
+        self.doc = Document.objects.create(folder=self.folder)
+
+    def test_no_perms(self):
+        check = ObjectPermissionChecker(self.user)
+        self.assertEqual(check.get_perms(self.doc), [])
+
+    def test_chain(self):
+        assign('change_project', self.user, self.project)
+        assign('can_publish', self.group, self.project)
+        assign('delete_folder', self.user, self.folder)
+        assign('add_document', self.user, self.doc)
+
+        check = ObjectPermissionChecker(self.user)
+        self.assertEqual(sorted(check.get_perms(self.doc)),
+            ['add_document', 'can_publish', 'change_document',
+             'delete_document'])
+        # ancestors are resolved and cached along the way
+        self.assertEqual(count_queries(check.get_perms, self.folder), 0)
+        self.assertEqual(sorted(check.get_perms(self.folder)),
+            ['can_publish', 'change_folder', 'delete_folder'])
+        self.assertEqual(sorted(check.get_perms(self.project)),
+            ['can_publish', 'change_project'])
+
+        self.assertTrue(self.user.has_perm('change_document', self.doc))
+        self.assertFalse(self.user.has_perm('delete_project', self.project))
+
+    def test_get_objs(self):
+        other = Folder.objects.create(project=self.project)
+        other_doc = Document.objects.create(folder=other)
+        Document.objects.create(folder=Folder.objects.create(
+            project=Project.objects.create(name='other')))
+        assign('change_project', self.group, self.project)
+        assign('delete_folder', self.user, self.folder)
+        deny('change_document', self.user, other_doc)
+
+        self.assertEqual(list(get_objs(Folder, 'change_folder', self.user)
+            .order_by('pk')), [self.folder, other])
+        self.assertEqual(list(get_objs(Document, 'change_document',
+            self.user)), [self.doc])
+        self.assertEqual(list(get_objs(Document, ['delete_document',
+            'change_document'], self.user)), [self.doc])
+        self.assertEqual(list(get_objs(Document, 'change_document',
+            self.group).order_by('pk')), [self.doc, other_doc])
+        self.assertEqual(list(iter_objs(Document, 'change_document',
+            self.group, chunk_size=1)), [self.doc, other_doc])
+        self.assertEqual(list(iter_objs(Folder, 'change_folder', self.user,
+            ids_only=True)), [self.folder.pk, other.pk])
+        check = ObjectPermissionChecker(self.user)
+        self.assertTrue(check.has_perm('change_document', self.doc))
+        self.assertFalse(check.has_perm('change_document', other_doc))
+
+    def test_group(self):
+        assign('change_folder', self.group, self.folder)
+        check = ObjectPermissionChecker(self.group)
+        self.assertEqual(check.get_perms(self.doc), ['change_document'])
+
+    def test_batched(self):
+        folders = [Folder.objects.create(project=self.project)
+            for i in xrange(3)]
+        docs = [Document.objects.create(folder=folder)
+            for folder in folders for i in xrange(3)]
+        assign('change_project', self.user, self.project)
+        assign('delete_folder', self.user, folders[1])
+        docs = list(Document.objects.filter(pk__in=[doc.pk for doc in docs]))
+
+        # warm up content types and permissions caches
+        ObjectPermissionChecker(self.user).get_perms(docs[0])
+        check = ObjectPermissionChecker(self.user)
+        # per level: parents query (folders, projects) and two permission
+        # tables queries (documents, folders, projects)
+        self.assertEqual(count_queries(check.prefetch_perms, docs), 8)
+        for doc in docs:
+            expected = ['change_document']
+            if doc.folder_id == folders[1].pk:
+                expected.append('delete_document')
+            self.assertEqual(count_queries(check.get_perms, doc), 0)
+            self.assertEqual(sorted(check.get_perms(doc)), expected)
+
+        # cached ancestors are not fetched again
+        doc = Document.objects.create(folder=folders[0])
+        self.assertEqual(count_queries(check.get_perms, doc), 2)
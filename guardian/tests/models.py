@@ -1,5 +1,7 @@
 from django.db import models
 
+from guardian.models import UserObjectPermissionBase, GroupObjectPermissionBase
+
 class Keycard(models.Model):
     key = models.CharField(max_length=32, blank=True, null=True)
 
@@ -8,6 +10,76 @@ class Keycard(models.Model):
         permissions = (
             ('can_use_keycard', 'Can use Keycard'),
             ('can_suspend_keycard', 'Can suspend Keycard'),
+            ('view_keycard', 'Can view Keycard'),
+        )
+
+
+
+class Project(models.Model):
+    name = models.CharField(max_length=128, unique=True)
+
+    class Meta:
+        app_label = 'guardian'
+        permissions = (
+            ('can_publish', 'Can publish'),
         )
 
+class ProjectUserObjectPermission(UserObjectPermissionBase):
+    content_object = models.ForeignKey(Project)
+
+    class Meta:
+        app_label = 'guardian'
+        unique_together = ['user', 'permission', 'content_object']
+
+class ProjectGroupObjectPermission(GroupObjectPermissionBase):
+    content_object = models.ForeignKey(Project)
+
+    class Meta:
+        app_label = 'guardian'
+        unique_together = ['group', 'permission', 'content_object']
+
+class Folder(models.Model):
+    project = models.ForeignKey(Project)
+
+    obj_perms_parent = 'project'
+
+    class Meta:
+        app_label = 'guardian'
+        permissions = (
+            ('can_publish', 'Can publish'),
+        )
 
+class Document(models.Model):
+    folder = models.ForeignKey(Folder)
+
+    obj_perms_parent = 'folder'
+
+    class Meta:
+        app_label = 'guardian'
+        permissions = (
+            ('can_publish', 'Can publish'),
+        )
+
+class ProxyKeycard(Keycard):
+
+    class Meta:
+        app_label = 'guardian'
+        proxy = True
+
+class ProxyProject(Project):
+
+    class Meta:
+        app_label = 'guardian'
+        proxy = True
+
+class Ticket(models.Model):
+    number = models.PositiveIntegerField(primary_key=True)
+
+    class Meta:
+        app_label = 'guardian'
+
+class Badge(Keycard):
+    holder = models.CharField(max_length=32, blank=True)
+
+    class Meta:
+        app_label = 'guardian'
@@ -1,18 +1,23 @@
+import datetime
 import guardian
 
 from itertools import chain
 
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
 from django.contrib.auth.models import User, Group, Permission, AnonymousUser
 from django.contrib.contenttypes.models import ContentType
-from django.core.exceptions import ValidationError
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.db import connection, models, transaction
 
 from guardian.models import UserObjectPermission
 from guardian.models import GroupObjectPermission
+from guardian.models import get_object_id_field
 from guardian.backends import ObjectPermissionBackend
 from guardian.exceptions import GuardianError, NotUserNorGroup,\
     ObjectNotPersisted, WrongAppError
 
+from guardian.managers import insert_objects
+from guardian.testing import count_queries
 from guardian.tests.models import Keycard
 
 class UserPermissionTests(TestCase):
@@ -80,6 +85,97 @@ class UserPermissionTests(TestCase):
 
         self.assertEqual(to_assign, codenames)
 
+        # permissions for other objects of the model are not returned
+        UserObjectPermission.objects.assign('change_keycard', self.user,
+            self.key)
+        perms = UserObjectPermission.objects.get_for_object(self.user, key)
+        self.assertEqual(perms.count(), 4)
+
+    def test_get_for_objects(self):
+        keys = [Keycard.objects.create(key='key%d' % i) for i in xrange(3)]
+        manager = UserObjectPermission.objects
+        manager.assign('change_keycard', self.user, keys[0])
+        manager.assign('delete_keycard', self.user, keys[0])
+        manager.assign('change_keycard', self.user, keys[1])
+        manager.assign('change_keycard', User.objects.create(username='joe'),
+            keys[2])
+
+        perms = manager.get_for_objects(self.user, keys)
+        self.assertEqual(sorted(perms), sorted(key.pk for key in keys))
+        self.assertEqual(perms[keys[2].pk], [])
+        self.assertEqual(count_queries(lambda: sorted(obj_perm.permission
+            .codename for obj_perm in perms[keys[0].pk])), 0)
+        self.assertEqual(sorted(obj_perm.permission.codename
+            for obj_perm in perms[keys[0].pk]),
+            ['change_keycard', 'delete_keycard'])
+        self.assertEqual(count_queries(manager.get_for_objects, self.user,
+            keys), 1)
+        self.assertEqual(manager.get_for_objects(self.user, []), {})
+
+    def test_assign_ignore_conflicts(self):
+        manager = UserObjectPermission.objects
+        self.assertTrue(manager.assign_ignore_conflicts('change_keycard',
+            self.user, self.key))
+        self.assertTrue(self.user.has_perm('change_keycard', self.key))
+        self.assertFalse(manager.assign_ignore_conflicts('change_keycard',
+            self.user, self.key))
+        self.assertEqual(manager.filter(user=self.user).count(), 1)
+        self.assertRaises(Permission.DoesNotExist,
+            manager.assign_ignore_conflicts, 'change_group', self.user,
+            self.key)
+
+    def test_assign_ignore_conflicts_queries(self):
+        manager = UserObjectPermission.objects
+        manager.get_permission_id('change_keycard', self.key)
+        self.assertEqual(count_queries(manager.assign_ignore_conflicts,
+            'change_keycard', self.user, self.key), 1)
+
+        # expired grant is replaced
+        past = datetime.datetime.now() - datetime.timedelta(hours=1)
+        manager.assign('delete_keycard', self.user, self.key, past)
+        self.assertTrue(manager.assign_ignore_conflicts('delete_keycard',
+            self.user, self.key))
+        self.assertEqual(manager.get(permission__codename='delete_keycard')
+            .expires_at, None)
+
+    def test_assign_existing(self):
+        manager = UserObjectPermission.objects
+        # row inserted by other process in the meantime
+        manager.assign_ignore_conflicts('change_keycard', self.user, self.key)
+        obj_perm = manager.assign('change_keycard', self.user, self.key)
+        self.assertEqual(obj_perm, manager.get(user=self.user))
+        self.assertEqual(obj_perm.permission.codename, 'change_keycard')
+
+    def test_assign_ignore_conflicts_fallback(self):
+        settings_dict = connection.settings_dict
+        engine = settings_dict['ENGINE']
+        settings_dict['ENGINE'] = 'unsupported'
+        try:
+            manager = UserObjectPermission.objects
+            self.assertTrue(manager.assign_ignore_conflicts('change_keycard',
+                self.user, self.key))
+            self.assertFalse(manager.assign_ignore_conflicts('change_keycard',
+                self.user, self.key))
+        finally:
+            settings_dict['ENGINE'] = engine
+        self.assertTrue(self.user.has_perm('change_keycard', self.key))
+
+    def test_bulk_assign_and_remove(self):
+        users = [User.objects.create(username='bulk%d' % i) for i in xrange(3)]
+        UserObjectPermission.objects.assign('change_keycard', users[0],
+            self.key)
+        created = UserObjectPermission.objects.bulk_assign('change_keycard',
+            users, self.key)
+        self.assertEqual(created, 2)
+        for user in users:
+            self.assertTrue(user.has_perm('change_keycard', self.key))
+
+        UserObjectPermission.objects.bulk_remove_perm('change_keycard',
+            users[:2], self.key)
+        self.assertFalse(users[0].has_perm('change_keycard', self.key))
+        self.assertFalse(users[1].has_perm('change_keycard', self.key))
+        self.assertTrue(users[2].has_perm('change_keycard', self.key))
+
     def test_assign_validation(self):
         self.assertRaises(Permission.DoesNotExist,
             UserObjectPermission.objects.assign, 'change_group', self.user,
@@ -115,6 +211,51 @@ class UserPermissionTests(TestCase):
             UserObjectPermission.objects.get_for_object,
             "change_user", not_saved_user)
 
+class InsertObjectsFallbackTest(TransactionTestCase):
+    fixtures = ['tests.json']
+
+    def setUp(self):
+        self.user = User.objects.get(username='jack')
+        self.key = Keycard.objects.create(key='fallback')
+        self.perm = Permission.objects.get(codename='change_keycard')
+        self.engine = connection.settings_dict['ENGINE']
+        connection.settings_dict['ENGINE'] = 'unsupported'
+
+    def tearDown(self):
+        connection.settings_dict['ENGINE'] = self.engine
+
+    def get_objs(self, count):
+        return [UserObjectPermission(user=self.user, permission=self.perm,
+            content_object=self.key) for i in xrange(count)]
+
+    def test_not_managed(self):
+        self.assertFalse(transaction.is_managed())
+        self.assertEqual(insert_objects(UserObjectPermission,
+            self.get_objs(3), 'default', ignore_conflicts=True), 1)
+        self.assertFalse(transaction.is_managed())
+        self.assertFalse(transaction.is_dirty())
+        # connection is still usable after conflicts
+        self.assertEqual(UserObjectPermission.objects.filter(
+            user=self.user).count(), 1)
+        self.assertEqual(insert_objects(UserObjectPermission,
+            self.get_objs(1), 'default', ignore_conflicts=True), 0)
+        self.assertTrue(self.user.has_perm('change_keycard', self.key))
+
+    def test_managed(self):
+        transaction.enter_transaction_management()
+        transaction.managed(True)
+        try:
+            self.assertEqual(insert_objects(UserObjectPermission,
+                self.get_objs(2), 'default', ignore_conflicts=True), 1)
+            # transaction of the caller is left open
+            self.assertEqual(UserObjectPermission.objects.filter(
+                user=self.user).count(), 1)
+            transaction.rollback()
+        finally:
+            transaction.leave_transaction_management()
+        self.assertEqual(UserObjectPermission.objects.filter(
+            user=self.user).count(), 0)
+
 class GroupPermissionTests(TestCase):
     fixtures = ['tests.json']
 
@@ -231,6 +372,23 @@ class GroupPermissionTests(TestCase):
             GroupObjectPermission.objects.get_for_object,
             "change_group", not_saved_group)
 
+class ObjectIdFieldTests(TestCase):
+
+    def test_kinds(self):
+        field = get_object_id_field('integer')
+        self.assertTrue(isinstance(field, models.PositiveIntegerField))
+        field = get_object_id_field('bigint')
+        self.assertTrue(isinstance(field, models.BigIntegerField))
+        field = get_object_id_field('uuid')
+        self.assertTrue(isinstance(field, getattr(models, 'UUIDField',
+            models.CharField)))
+        field = get_object_id_field('char')
+        self.assertTrue(isinstance(field, models.CharField))
+        self.assertTrue(field.db_index)
+
+    def test_wrong_kind(self):
+        self.assertRaises(ImproperlyConfigured, get_object_id_field, 'float')
+
 class ObjectPermissionBackendTests(TestCase):
     fixtures = ['tests.json']
 
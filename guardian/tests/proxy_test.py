@@ -0,0 +1,126 @@
+from django.contrib.auth.models import User, Permission
+from django.test import TestCase
+
+from guardian.conf import settings as guardian_settings
+from guardian.core import ObjectPermissionChecker, resolve_perm
+from guardian.core import clear_all_perms_cache
+from guardian.models import UserObjectPermission
+from guardian.shortcuts import assign, remove_perm, get_objs
+from guardian.testing import count_queries
+from guardian.tests.models import Keycard, ProxyKeycard, Project, ProxyProject
+from guardian.tests.models import ProjectUserObjectPermission
+from guardian.tests.models import Ticket, Badge, Folder, Document
+from guardian.utils import get_content_type, get_perms_model
+from guardian.utils import get_user_obj_perms_model
+from guardian import utils
+
+class ProxyModelsTest(TestCase):
+    fixtures = ['tests.json']
+
+    def setUp(self):
+        self.user = User.objects.get(username='jack')
+
+    def test_perms_model(self):
+        self.assertEqual(get_perms_model(ProxyKeycard), Keycard)
+        self.assertEqual(get_perms_model(ProxyKeycard()), Keycard)
+        self.assertEqual(get_perms_model(Keycard), Keycard)
+        self.assertEqual(get_content_type(ProxyKeycard),
+            get_content_type(Keycard))
+        self.assertEqual(resolve_perm('guardian.change_keycard',
+            ProxyKeycard), resolve_perm('change_keycard', Keycard))
+
+    def test_generic(self):
+        keycard = Keycard.objects.create(key='proxy')
+        proxy = ProxyKeycard.objects.get(pk=keycard.pk)
+        assign('change_keycard', self.user, proxy)
+        self.assertEqual(UserObjectPermission.objects.count(), 1)
+        check = ObjectPermissionChecker(self.user)
+        self.assertEqual(check.get_perms(keycard), ['change_keycard'])
+        # both share the cache
+        self.assertEqual(count_queries(check.get_perms, proxy), 0)
+        self.assertEqual(list(get_objs(ProxyKeycard, 'change_keycard',
+            self.user)), [proxy])
+        remove_perm('change_keycard', self.user, keycard)
+        self.assertFalse(ObjectPermissionChecker(self.user)
+            .has_perm('change_keycard', proxy))
+
+    def test_direct(self):
+        self.assertEqual(get_user_obj_perms_model(ProxyProject),
+            ProjectUserObjectPermission)
+        project = ProxyProject.objects.create(name='proxy')
+        assign('change_project', self.user, project)
+        self.assertEqual(ProjectUserObjectPermission.objects.count(), 1)
+        self.assertTrue(ObjectPermissionChecker(self.user).has_perm(
+            'change_project', Project.objects.get(pk=project.pk)))
+
+class PermsModelsSettingTest(TestCase):
+    fixtures = ['tests.json']
+
+    def setUp(self):
+        self.user = User.objects.get(username='jack')
+        self.perms_models = guardian_settings.PERMS_MODELS
+        guardian_settings.PERMS_MODELS = {'guardian.Badge': 'guardian.Keycard'}
+        self.clear_caches()
+
+    def tearDown(self):
+        guardian_settings.PERMS_MODELS = self.perms_models
+        self.clear_caches()
+
+    def clear_caches(self):
+        utils._perms_models_cache.clear()
+        utils._obj_perms_models_cache.clear()
+        clear_all_perms_cache()
+
+    def test_mapping(self):
+        self.assertEqual(get_perms_model(Badge), Keycard)
+        badge = Badge.objects.create(key='badge', holder='jack')
+        assign('change_keycard', self.user, Keycard.objects.get(pk=badge.pk))
+        self.assertEqual(ObjectPermissionChecker(self.user).get_perms(badge),
+            ['change_keycard'])
+        self.assertEqual(list(get_objs(Badge, 'change_keycard', self.user)),
+            [badge])
+
+class CustomPrimaryKeyTest(TestCase):
+    fixtures = ['tests.json']
+
+    def test_custom_pk(self):
+        user = User.objects.get(username='jack')
+        tickets = [Ticket.objects.create(number=number)
+            for number in (7, 11)]
+        assign('change_ticket', user, tickets[0])
+        check = ObjectPermissionChecker(user)
+        self.assertEqual(check.get_perms(tickets[0]), ['change_ticket'])
+        check = ObjectPermissionChecker(user)
+        check.prefetch_perms(tickets)
+        self.assertEqual(check.get_perms(tickets[1]), [])
+        self.assertEqual(list(get_objs(Ticket, 'change_ticket', user)),
+            tickets[:1])
+
+class UnsavedObjectsTest(TestCase):
+    fixtures = ['tests.json']
+
+    def setUp(self):
+        self.user = User.objects.get(username='jack')
+
+    def test_unsaved(self):
+        keycard = Keycard(key='unsaved')
+        check = ObjectPermissionChecker(self.user)
+        self.assertEqual(count_queries(check.get_perms, keycard), 0)
+        self.assertEqual(check.get_perms(keycard), [])
+        check.prefetch_perms([keycard])
+        self.assertEqual(check._obj_perms_cache, {})
+
+        self.user.user_permissions.add(
+            Permission.objects.get(codename='add_keycard'))
+        user = User.objects.get(pk=self.user.pk)
+        check = ObjectPermissionChecker(user, global_perms=True)
+        self.assertEqual(check.get_perms(keycard), ['add_keycard'])
+
+    def test_inherited(self):
+        project = Project.objects.create(name='unsaved')
+        folder = Folder.objects.create(project=project)
+        assign('change_project', self.user, project)
+        check = ObjectPermissionChecker(self.user)
+        self.assertEqual(check.get_perms(Document(folder=folder)),
+            ['change_document'])
+        self.assertEqual(check.get_perms(Document()), [])
@@ -0,0 +1,182 @@
+import datetime
+from StringIO import StringIO
+
+from django.contrib.auth.models import User, Group, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.test import TestCase
+
+from guardian.core import ObjectPermissionChecker, has_roles
+from guardian.core import ROLE_CTYPES_CACHE_KEY
+from guardian.models import Role, UserObjectRole, GroupObjectRole
+from guardian.shortcuts import assign_role, remove_role, deny
+from guardian.shortcuts import get_objs, iter_objs, get_users_with_perm
+from guardian.shortcuts import copy_perms, transfer_perms
+from guardian.testing import count_queries
+from guardian.tests.models import Keycard, Project
+
+class RolesTest(TestCase):
+    fixtures = ['tests.json']
+
+    def setUp(self):
+        self.user = User.objects.get(username='jack')
+        self.group = Group.objects.get(name='jackGroup')
+        self.ctype = ContentType.objects.get_for_model(Keycard)
+        self.role = Role.objects.create(name='editor',
+            content_type=self.ctype)
+        self.role.permissions = Permission.objects.filter(
+            codename__in=['change_keycard', 'delete_keycard'])
+        self.keycards = [Keycard.objects.create(key='key%d' % i)
+            for i in xrange(3)]
+
+    def test_assign_role(self):
+        self.assertEqual(assign_role('editor', [self.user],
+            self.keycards[:2]), 2)
+        self.assertEqual(assign_role(self.role, [self.user, self.group],
+            self.keycards[:2]), 2)
+        self.assertEqual(UserObjectRole.objects.count(), 2)
+        self.assertEqual(GroupObjectRole.objects.count(), 2)
+
+        # roles of the model are fetched once
+        self.assertTrue(has_roles(self.ctype))
+        check = ObjectPermissionChecker(self.user)
+        self.assertEqual(count_queries(check.get_perms, self.keycards[0]), 1)
+        self.assertEqual(sorted(check.get_perms(self.keycards[0])),
+            ['change_keycard', 'delete_keycard'])
+        self.assertFalse(self.user.has_perm('change_keycard',
+            self.keycards[2]))
+
+        check = ObjectPermissionChecker(self.user)
+        check.prefetch_perms(self.keycards)
+        self.assertEqual(sorted(check.get_perms(self.keycards[1])),
+            ['change_keycard', 'delete_keycard'])
+        self.assertEqual(check.get_perms(self.keycards[2]), [])
+
+    def test_groups_and_deny(self):
+        self.user.groups.add(self.group)
+        assign_role('editor', [self.group], self.keycards)
+        deny('delete_keycard', self.user, self.keycards[0])
+        check = ObjectPermissionChecker(self.user)
+        self.assertEqual(check.get_perms(self.keycards[0]),
+            ['change_keycard'])
+        check = ObjectPermissionChecker(self.user)
+        check.prefetch_perms(self.keycards)
+        self.assertEqual(check.get_perms(self.keycards[0]),
+            ['change_keycard'])
+        self.assertEqual(sorted(check.get_perms(self.keycards[1])),
+            ['change_keycard', 'delete_keycard'])
+
+    def test_role_changed(self):
+        assign_role('editor', [self.user], self.keycards[:1])
+        self.role.permissions.remove(
+            Permission.objects.get(codename='delete_keycard'))
+        self.assertEqual(ObjectPermissionChecker(self.user)
+            .get_perms(self.keycards[0]), ['change_keycard'])
+
+    def test_expired(self):
+        past = datetime.datetime.now() - datetime.timedelta(hours=1)
+        assign_role('editor', [self.user], self.keycards[:1], past)
+        self.assertFalse(self.user.has_perm('change_keycard',
+            self.keycards[0]))
+        # expired assignment is replaced
+        self.assertEqual(assign_role('editor', [self.user],
+            self.keycards[:1]), 1)
+        self.assertTrue(ObjectPermissionChecker(self.user)
+            .has_perm('change_keycard', self.keycards[0]))
+
+    def test_remove_role(self):
+        assign_role('editor', [self.user, self.group], self.keycards)
+        remove_role('editor', [self.user, self.group], self.keycards[:2])
+        self.assertEqual([role.object_id
+            for role in UserObjectRole.objects.all()], [self.keycards[2].pk])
+        self.assertEqual(GroupObjectRole.objects.count(), 1)
+
+    def test_shortcuts(self):
+        self.user.groups.add(self.group)
+        joe = User.objects.create(username='joe')
+        assign_role('editor', [joe], self.keycards[:1])
+        assign_role('editor', [self.group], self.keycards[1:2])
+        self.assertEqual(list(get_objs(Keycard, 'delete_keycard', joe)),
+            self.keycards[:1])
+        self.assertEqual(list(get_objs(Keycard, 'delete_keycard',
+            self.user)), self.keycards[1:2])
+        self.assertEqual(list(iter_objs(Keycard, 'delete_keycard',
+            self.user)), self.keycards[1:2])
+        self.assertEqual(list(get_users_with_perm(self.keycards[0],
+            'change_keycard')), [joe])
+        self.assertEqual(list(get_users_with_perm(self.keycards[1],
+            'change_keycard')), [self.user])
+
+        deny('change_keycard', joe, self.keycards[0])
+        self.assertEqual(list(get_objs(Keycard, 'change_keycard', joe)), [])
+        self.assertEqual(list(iter_objs(Keycard, 'change_keycard', joe,
+            ids_only=True)), [])
+        self.assertEqual(list(get_users_with_perm(self.keycards[0],
+            'change_keycard')), [])
+
+    def test_copy_perms(self):
+        past = datetime.datetime.now() - datetime.timedelta(hours=1)
+        joe = User.objects.create(username='joe')
+        assign_role('editor', [self.user, self.group], self.keycards[:1])
+        assign_role('editor', [joe], self.keycards[:1], past)
+        self.assertEqual(copy_perms(self.keycards[0], self.keycards[1:],
+            include_groups=False), 2)
+        self.assertEqual(GroupObjectRole.objects.count(), 1)
+        self.assertEqual(copy_perms(self.keycards[0], self.keycards[1:]), 2)
+        self.assertEqual(copy_perms(self.keycards[0], self.keycards[1:]), 0)
+        # access comes from copied roles only
+        for keycard in self.keycards[1:]:
+            self.assertTrue(self.user.has_perm('delete_keycard', keycard))
+            self.assertFalse(joe.has_perm('delete_keycard', keycard))
+        self.assertEqual(list(get_objs(Keycard, 'delete_keycard',
+            self.group).order_by('pk')), self.keycards)
+
+    def test_transfer_perms(self):
+        joe = User.objects.create(username='joe')
+        assign_role('editor', [self.user], self.keycards)
+        assign_role('editor', [joe], self.keycards[:1])
+        self.assertTrue(self.user.has_perm('change_keycard',
+            self.keycards[1]))
+        self.assertEqual(transfer_perms(self.user, joe), 2)
+        self.assertEqual(UserObjectRole.objects.filter(user=self.user)
+            .count(), 0)
+        self.assertEqual(UserObjectRole.objects.filter(user=joe).count(), 3)
+        self.assertFalse(User.objects.get(pk=self.user.pk)
+            .has_perm('change_keycard', self.keycards[1]))
+        self.assertTrue(joe.has_perm('change_keycard', self.keycards[1]))
+        self.assertEqual(transfer_perms(joe, self.user, [Project]), 0)
+
+    def test_clean_expired(self):
+        past = datetime.datetime.now() - datetime.timedelta(hours=1)
+        assign_role('editor', [self.user, self.group], self.keycards[:1],
+            past)
+        assign_role('editor', [self.user], self.keycards[1:2])
+        call_command('clean_expired_obj_perms', stdout=StringIO())
+        self.assertEqual([role.object_id for role in
+            UserObjectRole.objects.all()], [self.keycards[1].pk])
+        self.assertEqual(GroupObjectRole.objects.count(), 0)
+
+    def test_has_roles(self):
+        project_ctype = ContentType.objects.get_for_model(Project)
+        self.assertFalse(has_roles(project_ctype))
+        self.assertEqual(count_queries(has_roles, project_ctype), 0)
+        # role created by other process (sharing the cache)
+        cache.set(ROLE_CTYPES_CACHE_KEY, set([project_ctype.id]))
+        self.assertTrue(has_roles(project_ctype))
+        self.assertFalse(has_roles(self.ctype))
+
+        Role.objects.create(name='owner', content_type=project_ctype)
+        self.assertEqual(cache.get(ROLE_CTYPES_CACHE_KEY), None)
+        self.assertTrue(has_roles(self.ctype))
+        self.assertTrue(has_roles(project_ctype))
+
+    def test_wrong_model(self):
+        project = Project.objects.create(name='roles')
+        self.assertRaises(Role.DoesNotExist, assign_role, self.role,
+            [self.user], [project])
+        self.assertRaises(Role.DoesNotExist, assign_role, 'editor',
+            [self.user], [project])
+        self.assertRaises(ValidationError, UserObjectRole.objects.create,
+            role=self.role, user=self.user, content_object=project)
@@ -0,0 +1,120 @@
+from django.contrib.auth.models import User, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.core.signals import request_started
+from django.db import router
+from django.test import TestCase
+
+from guardian.conf import settings as guardian_settings
+from guardian.core import ObjectPermissionChecker
+from guardian.models import UserObjectPermission
+from guardian.routers import ObjectPermissionRouter, is_pinned, unpin
+from guardian.listeners import clear_perm_cache
+from guardian.shortcuts import assign, get_users_with_perm, get_objs
+from guardian.tests.models import Keycard
+
+class ObjectPermissionRouterTest(TestCase):
+    """
+    ``replica`` database holds permissions only, so reads made by it don't see
+    any object permissions (as if they were not replicated yet).
+    """
+    fixtures = ['tests.json']
+
+    def setUp(self):
+        self.user = User.objects.get(username='jack')
+        self.keycard = Keycard.objects.create(key='routed')
+        for ctype in ContentType.objects.all():
+            ctype.save(using='replica')
+        for perm in Permission.objects.all():
+            perm.save(using='replica')
+        self.settings = (guardian_settings.READ_DATABASES,
+            guardian_settings.ROUTE_AUTH_MODELS)
+        guardian_settings.READ_DATABASES = ['replica']
+        guardian_settings.ROUTE_AUTH_MODELS = True
+        self.router = ObjectPermissionRouter()
+        router.routers.insert(0, self.router)
+        unpin()
+
+    def tearDown(self):
+        router.routers.remove(self.router)
+        (guardian_settings.READ_DATABASES,
+            guardian_settings.ROUTE_AUTH_MODELS) = self.settings
+        unpin()
+
+    def test_routing(self):
+        self.assertEqual(self.router.db_for_read(UserObjectPermission),
+            'replica')
+        self.assertEqual(self.router.db_for_read(Permission), 'replica')
+        self.assertEqual(self.router.db_for_read(Keycard), None)
+        self.assertEqual(self.router.db_for_write(Keycard), None)
+        self.assertFalse(is_pinned())
+
+        self.assertEqual(self.router.db_for_write(UserObjectPermission),
+            'default')
+        self.assertTrue(is_pinned())
+        self.assertEqual(self.router.db_for_read(UserObjectPermission),
+            'default')
+
+        request_started.send(sender=self.__class__)
+        self.assertFalse(is_pinned())
+        self.assertEqual(self.router.db_for_read(UserObjectPermission),
+            'replica')
+
+    def test_auth_models_not_routed(self):
+        guardian_settings.ROUTE_AUTH_MODELS = False
+        self.assertEqual(self.router.db_for_read(Permission), None)
+        self.assertEqual(self.router.db_for_read(User), None)
+        self.assertEqual(self.router.db_for_read(UserObjectPermission),
+            'replica')
+        self.assertEqual(User.objects.db, 'default')
+        # writes of auth models still pin permission reads to the primary
+        self.assertEqual(self.router.db_for_write(User), None)
+        self.assertTrue(is_pinned())
+        self.assertEqual(self.router.db_for_read(UserObjectPermission),
+            'default')
+
+    def test_guardian_reads(self):
+        guardian_settings.ROUTE_AUTH_MODELS = False
+        assign('change_keycard', self.user, self.keycard)
+        self.user.user_permissions.add(
+            Permission.objects.get(codename='delete_keycard'))
+        # pinned to the primary by the writes
+        check = ObjectPermissionChecker(self.user, global_perms=True)
+        self.assertEqual(sorted(check.get_perms(self.keycard)),
+            ['change_keycard', 'delete_keycard'])
+        self.assertEqual(list(get_objs(Keycard, 'change_keycard',
+            self.user)), [self.keycard])
+
+        # checks, shortcuts and model level permissions are read from the
+        # replica, although auth models are not routed
+        request_started.send(sender=self.__class__)
+        clear_perm_cache(sender=None, instance=None)
+        user = User.objects.get(pk=self.user.pk)
+        check = ObjectPermissionChecker(user, global_perms=True)
+        self.assertEqual(check.get_perms(self.keycard), [])
+        self.assertEqual(list(get_objs(Keycard, 'change_keycard', user)), [])
+        self.assertEqual(list(get_users_with_perm(self.keycard,
+            'change_keycard')), [])
+        self.assertEqual(User.objects.db, 'default')
+
+    def test_not_configured(self):
+        guardian_settings.READ_DATABASES = []
+        self.assertEqual(self.router.db_for_read(UserObjectPermission),
+            'default')
+
+    def test_read_your_writes(self):
+        self.assertEqual(UserObjectPermission.objects.db, 'replica')
+        check = ObjectPermissionChecker(self.user)
+        self.assertEqual(check.get_perms(self.keycard), [])
+
+        assign('change_keycard', self.user, self.keycard)
+        self.assertEqual(UserObjectPermission.objects.using('default')
+            .count(), 1)
+        check = ObjectPermissionChecker(self.user)
+        self.assertEqual(check.get_perms(self.keycard), ['change_keycard'])
+        self.assertEqual(list(get_users_with_perm(self.keycard,
+            'change_keycard')), [self.user])
+
+        # next request reads from replica again
+        request_started.send(sender=self.__class__)
+        check = ObjectPermissionChecker(self.user)
+        self.assertEqual(check.get_perms(self.keycard), [])
@@ -0,0 +1,276 @@
+import datetime
+from StringIO import StringIO
+
+from django.contrib.auth.models import User, Group, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.db import router
+from django.test import TransactionTestCase
+
+from guardian.conf import settings as guardian_settings
+from guardian.core import ObjectPermissionChecker
+from guardian.exceptions import TooManyObjects
+from guardian.models import UserObjectPermission, GroupObjectPermission
+from guardian.models import Role, GroupObjectRole
+from guardian.routers import ObjectPermissionRouter
+from guardian.sharding import get_shard, get_model_shards, group_by_shard
+from guardian.sharding import fan_out
+from guardian.shortcuts import assign, deny, remove_perm, get_objs
+from guardian.shortcuts import iter_objs, get_users_with_perm, copy_perms
+from guardian.shortcuts import transfer_perms, assign_role
+from guardian.tests.models import Keycard, Project, Folder
+from guardian.tests.models import ProjectUserObjectPermission
+from guardian.utils import get_obj_perms_models
+
+SHARDS = ['shard1', 'shard2']
+
+class ShardingTestCase(TransactionTestCase):
+    """
+    Shards are used by multiple threads, so changes need to be really
+    committed.
+    """
+    fixtures = ['tests.json']
+    shard_by = 'object_id'
+
+    def setUp(self):
+        self.user = User.objects.get(username='jack')
+        self.group = Group.objects.get(name='jackGroup')
+        self.user.groups.add(self.group)
+        self.keycards = [Keycard.objects.create(key='key%d' % i)
+            for i in xrange(6)]
+        self.ctype = ContentType.objects.get_for_model(Keycard)
+        self.settings = guardian_settings.SHARDS, guardian_settings.SHARD_BY
+        guardian_settings.SHARDS = SHARDS
+        guardian_settings.SHARD_BY = self.shard_by
+        self.router = ObjectPermissionRouter()
+        router.routers.insert(0, self.router)
+
+    def tearDown(self):
+        router.routers.remove(self.router)
+        guardian_settings.SHARDS, guardian_settings.SHARD_BY = self.settings
+        for alias in SHARDS:
+            for model in get_obj_perms_models():
+                model.objects.using(alias).all().delete()
+
+    def get_shard_rows(self, model=UserObjectPermission):
+        return dict((alias, model.objects.using(alias).count())
+            for alias in ['default'] + SHARDS)
+
+class ShardingTest(ShardingTestCase):
+
+    def test_get_shard(self):
+        shards = set(get_shard(self.ctype, key.pk) for key in self.keycards)
+        self.assertEqual(shards, set(SHARDS))
+        self.assertEqual(get_shard(self.ctype, 1), get_shard(self.ctype, '1'))
+        self.assertEqual(get_model_shards(self.ctype), SHARDS)
+        batches = group_by_shard(self.ctype, [key.pk for key in self.keycards])
+        self.assertEqual(sorted(sum(batches.values(), [])),
+            sorted(key.pk for key in self.keycards))
+
+        guardian_settings.SHARDS = []
+        self.assertEqual(get_shard(self.ctype, 1), None)
+        self.assertEqual(get_model_shards(self.ctype), [None])
+
+    def test_fan_out(self):
+        self.assertEqual(fan_out(lambda x: x * 2, [1, 2, 3]), [2, 4, 6])
+        def fail(x):
+            raise ValueError(x)
+        self.assertRaises(ValueError, fan_out, fail, [1, 2])
+
+    def test_assign(self):
+        for key in self.keycards:
+            assign('change_keycard', self.user, key)
+        rows = self.get_shard_rows()
+        self.assertEqual(rows['default'], 0)
+        self.assertEqual(rows['shard1'] + rows['shard2'], 6)
+        self.assertTrue(rows['shard1'] and rows['shard2'])
+        for key in self.keycards:
+            self.assertEqual(UserObjectPermission.objects
+                .using(get_shard(self.ctype, key.pk))
+                .filter(object_id=key.pk).count(), 1)
+
+        # assigning again updates existing row
+        assign('change_keycard', self.user, self.keycards[0],
+            datetime.timedelta(hours=1))
+        self.assertEqual(sum(self.get_shard_rows().values()), 6)
+
+        remove_perm('change_keycard', self.user, self.keycards[0])
+        self.assertEqual(sum(self.get_shard_rows().values()), 5)
+
+    def test_direct(self):
+        project = Project.objects.create(name='sharded')
+        assign('change_project', self.user, project)
+        self.assertEqual(self.get_shard_rows(ProjectUserObjectPermission)
+            [get_shard(ContentType.objects.get_for_model(Project),
+                project.pk)], 1)
+        self.assertTrue(self.user.has_perm('change_project', project))
+
+    def test_checker(self):
+        assign('change_keycard', self.user, self.keycards[0])
+        assign('delete_keycard', self.group, self.keycards[0])
+        for key in self.keycards[1:]:
+            assign('change_keycard', self.group, key)
+        deny('change_keycard', self.user, self.keycards[1])
+
+        check = ObjectPermissionChecker(self.user)
+        self.assertEqual(sorted(check.get_perms(self.keycards[0])),
+            ['change_keycard', 'delete_keycard'])
+
+        # shards are queried in parallel
+        check = ObjectPermissionChecker(self.user)
+        check.prefetch_perms(self.keycards)
+        self.assertEqual(check.get_perms(self.keycards[1]), [])
+        for key in self.keycards[2:]:
+            self.assertEqual(check.get_perms(key), ['change_keycard'])
+
+        check = ObjectPermissionChecker(self.group)
+        self.assertEqual(check.get_perms(self.keycards[1]),
+            ['change_keycard'])
+
+    def test_roles(self):
+        role = Role.objects.create(name='editor', content_type=self.ctype)
+        role.permissions = Permission.objects.filter(
+            codename__in=['change_keycard', 'delete_keycard'])
+        assign_role(role, [self.group], self.keycards[:3])
+        deny('change_keycard', self.user, self.keycards[0])
+        # roles are kept by the main database
+        self.assertEqual(self.get_shard_rows(GroupObjectRole),
+            {'default': 3, 'shard1': 0, 'shard2': 0})
+
+        check = ObjectPermissionChecker(self.user)
+        check.prefetch_perms(self.keycards)
+        self.assertEqual(check.get_perms(self.keycards[0]),
+            ['delete_keycard'])
+        self.assertEqual(sorted(check.get_perms(self.keycards[1])),
+            ['change_keycard', 'delete_keycard'])
+        self.assertEqual(check.get_perms(self.keycards[3]), [])
+        self.assertEqual(sorted(key.pk for key in get_objs(Keycard,
+            'change_keycard', self.user)),
+            [key.pk for key in self.keycards[1:3]])
+        self.assertEqual(list(iter_objs(Keycard, 'change_keycard', self.user,
+            chunk_size=2, ids_only=True)),
+            [key.pk for key in self.keycards[1:3]])
+
+    def test_bulk(self):
+        joe = User.objects.create(username='joe')
+        manager = UserObjectPermission.objects
+        key = self.keycards[0]
+        self.assertEqual(manager.bulk_assign('change_keycard',
+            [self.user, joe], key), 2)
+        self.assertEqual(sum(self.get_shard_rows().values()), 2)
+        self.assertEqual(sorted(user.username for user in
+            get_users_with_perm(key, 'change_keycard')), ['jack', 'joe'])
+        manager.bulk_remove_perm('change_keycard', [self.user, joe], key)
+        self.assertEqual(sum(self.get_shard_rows().values()), 0)
+
+    def test_get_objs(self):
+        for key in self.keycards[:4]:
+            assign('change_keycard', self.group, key)
+        assign('delete_keycard', self.user, self.keycards[5])
+        deny('change_keycard', self.user, self.keycards[0])
+        expected = [key.pk for key in self.keycards[1:4]]
+        self.assertEqual(sorted(key.pk for key in
+            get_objs(Keycard, 'change_keycard', self.user)), expected)
+        self.assertEqual(list(iter_objs(Keycard, 'change_keycard', self.user,
+            chunk_size=1, ids_only=True)), expected)
+        self.assertEqual(sorted(key.pk for key in get_objs(Keycard,
+            ['change_keycard', 'delete_keycard'], self.user)),
+            expected + [self.keycards[5].pk])
+
+    def test_get_objs_limit(self):
+        for key in self.keycards[:4]:
+            assign('change_keycard', self.user, key)
+        limit = guardian_settings.SHARDED_OBJS_LIMIT
+        guardian_settings.SHARDED_OBJS_LIMIT = 3
+        try:
+            self.assertRaises(TooManyObjects, get_objs, Keycard,
+                'change_keycard', self.user)
+            deny('change_keycard', self.user, self.keycards[0])
+            self.assertEqual(len(get_objs(Keycard, 'change_keycard',
+                self.user)), 3)
+        finally:
+            guardian_settings.SHARDED_OBJS_LIMIT = limit
+        # iter_objs is not limited
+        self.assertEqual(len(list(iter_objs(Keycard, 'change_keycard',
+            self.user, chunk_size=2))), 3)
+
+    def test_get_objs_global_perms(self):
+        self.group.permissions.add(
+            Permission.objects.get(codename='change_keycard'))
+        deny('change_keycard', self.user, self.keycards[0])
+        fallback = guardian_settings.GLOBAL_PERMS_FALLBACK
+        guardian_settings.GLOBAL_PERMS_FALLBACK = True
+        try:
+            expected = [key.pk for key in self.keycards[1:]]
+            self.assertEqual(sorted(key.pk for key in
+                get_objs(Keycard, 'change_keycard', self.user)), expected)
+            self.assertEqual(list(iter_objs(Keycard, 'change_keycard',
+                self.user, chunk_size=2, ids_only=True)), expected)
+        finally:
+            guardian_settings.GLOBAL_PERMS_FALLBACK = fallback
+
+    def test_get_objs_inherited(self):
+        project = Project.objects.create(name='sharded')
+        folders = [Folder.objects.create(project=project) for i in xrange(3)]
+        assign('change_project', self.group, project)
+        assign('delete_folder', self.user, folders[0])
+        deny('change_folder', self.user, folders[1])
+        self.assertEqual(sorted(folder.pk for folder in get_objs(Folder,
+            'change_folder', self.user)), [folders[0].pk, folders[2].pk])
+        self.assertEqual(list(get_objs(Folder, 'delete_folder', self.user)),
+            folders[:1])
+        self.assertEqual(list(iter_objs(Folder, 'change_folder', self.user,
+            chunk_size=2)), [folders[0], folders[2]])
+
+    def test_copy_perms(self):
+        assign('change_keycard', self.user, self.keycards[0])
+        deny('delete_keycard', self.group, self.keycards[0])
+        self.assertEqual(copy_perms(self.keycards[0], self.keycards[1:]), 10)
+        self.assertEqual(sum(self.get_shard_rows().values()), 6)
+        for key in self.keycards[1:]:
+            self.assertTrue(self.user.has_perm('change_keycard', key))
+            self.assertEqual(GroupObjectPermission.objects
+                .using(get_shard(self.ctype, key.pk))
+                .filter(object_id=key.pk, deny=True).count(), 1)
+
+    def test_transfer_perms(self):
+        joe = User.objects.create(username='joe')
+        for key in self.keycards:
+            assign('change_keycard', self.user, key)
+        self.assertEqual(transfer_perms(self.user, joe), 6)
+        for key in self.keycards:
+            self.assertTrue(joe.has_perm('change_keycard', key))
+            self.assertFalse(self.user.has_perm('change_keycard', key))
+
+    def test_get_for_objects(self):
+        for key in self.keycards:
+            assign('change_keycard', self.user, key)
+        perms = UserObjectPermission.objects.get_for_objects(self.user,
+            self.keycards)
+        for key in self.keycards:
+            self.assertEqual([obj_perm.permission.codename
+                for obj_perm in perms[key.pk]], ['change_keycard'])
+        self.assertEqual(UserObjectPermission.objects.get_for_object(
+            self.user, self.keycards[0]).count(), 1)
+
+    def test_clean_expired_obj_perms(self):
+        past = datetime.datetime.now() - datetime.timedelta(hours=1)
+        for key in self.keycards:
+            assign('change_keycard', self.user, key, past)
+        assign('delete_keycard', self.group, self.keycards[0])
+        call_command('clean_expired_obj_perms', stdout=StringIO())
+        self.assertEqual(sum(self.get_shard_rows().values()), 0)
+        self.assertEqual(sum(self.get_shard_rows(GroupObjectPermission)
+            .values()), 1)
+
+class ContentTypeShardingTest(ShardingTestCase):
+    shard_by = 'content_type'
+
+    def test_assign(self):
+        shard = get_shard(self.ctype, None)
+        self.assertEqual(get_model_shards(self.ctype), [shard])
+        for key in self.keycards:
+            assign('change_keycard', self.user, key)
+        self.assertEqual(self.get_shard_rows()[shard], 6)
+        self.assertEqual(len(get_objs(Keycard, 'change_keycard', self.user)),
+            6)
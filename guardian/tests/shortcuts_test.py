@@ -1,12 +1,20 @@
+import datetime
+
 from django.test import TestCase
 from django.contrib.auth.models import User, Group, Permission
+from django.contrib.contenttypes.models import ContentType
 
+from guardian.conf import settings as guardian_settings
 from guardian.shortcuts import get_perms_for_model
 from guardian.core import ObjectPermissionChecker
 from guardian.shortcuts import assign, remove_perm, get_perms, get_users_with_perm
-from guardian.exceptions import NotUserNorGroup
+from guardian.shortcuts import get_objs, iter_objs, copy_perms, deny
+from guardian.shortcuts import transfer_perms
+from guardian.exceptions import NotUserNorGroup, ObjectNotPersisted
+from guardian.exceptions import WrongAppError
+from guardian.models import UserObjectPermission, GroupObjectPermission
 
-from guardian.tests.models import Keycard
+from guardian.tests.models import Keycard, Project
 from guardian.tests.core_test import ObjectPermissionTestCase
 
 class ShortcutsTests(TestCase):
@@ -78,6 +86,24 @@ class RemovePermTest(ObjectPermissionTestCase):
         check = ObjectPermissionChecker(self.group)
         self.assertFalse(check.has_perm("change_keycard", self.keycard))
 
+    def test_wrong_app(self):
+        assign("change_keycard", self.user, self.keycard)
+        assign("change_keycard", self.group, self.keycard)
+        self.assertRaises(WrongAppError, remove_perm, "auth.change_keycard",
+            self.user, self.keycard)
+        self.assertRaises(WrongAppError, remove_perm, "auth.change_keycard",
+            self.group, self.keycard)
+        self.assertRaises(WrongAppError,
+            UserObjectPermission.objects.bulk_remove_perm,
+            "auth.change_keycard", [self.user], self.keycard)
+        check = ObjectPermissionChecker(self.user)
+        self.assertRaises(WrongAppError, check.has_perm,
+            "auth.change_keycard", self.keycard)
+        self.assertTrue(check.has_perm("guardian.change_keycard",
+            self.keycard))
+        remove_perm("guardian.change_keycard", self.user, self.keycard)
+        self.assertEqual(UserObjectPermission.objects.count(), 0)
+
 class GetPermsTest(ObjectPermissionTestCase):
     """
     Tests get_perms function (already done at core tests but left here as a
@@ -129,3 +155,224 @@ class GetUsersWithPerm(ObjectPermissionTestCase):
         users = list(get_users_with_perm(self.keycard, 'change_keycard').all())
         self.assertEqual(users.sort(), [self.user, john, mary].sort())
 
+    def test_cache_cleared_on_remove(self):
+        john = User.objects.create(username='John')
+        assign('change_keycard', john, self.keycard)
+        assign('change_keycard', self.group, self.keycard)
+        self.assertEqual(len(get_users_with_perm(self.keycard,
+            'change_keycard')), 2)
+
+        remove_perm('change_keycard', john, self.keycard)
+        self.assertEqual(list(get_users_with_perm(self.keycard,
+            'change_keycard')), [self.user])
+        GroupObjectPermission.objects.get(group=self.group).delete()
+        self.assertEqual(list(get_users_with_perm(self.keycard,
+            'change_keycard')), [])
+
+
+
+class IterObjsTest(ObjectPermissionTestCase):
+
+    def setUp(self):
+        super(IterObjsTest, self).setUp()
+        self.keycards = [Keycard.objects.create(key='key%d' % i)
+            for i in xrange(7)]
+
+    def test_empty(self):
+        self.assertEqual(list(iter_objs(Keycard, 'change_keycard', self.user)),
+            [])
+
+    def test_user_and_groups(self):
+        for key in self.keycards[:4]:
+            assign("change_keycard", self.user, key)
+        for key in self.keycards[2:6]:
+            assign("change_keycard", self.group, key)
+        assign("delete_keycard", self.user, self.keycards[6])
+
+        expected = [key.pk for key in self.keycards[:6]]
+        for chunk_size in (1, 2, 3, 100):
+            ids = list(iter_objs(Keycard, 'guardian.change_keycard', self.user,
+                chunk_size=chunk_size, ids_only=True))
+            self.assertEqual(ids, expected)
+            objs = list(iter_objs(Keycard, 'change_keycard', self.user,
+                chunk_size=chunk_size))
+            self.assertEqual(objs, self.keycards[:6])
+
+        ids = list(iter_objs(Keycard, 'change_keycard', self.group,
+            chunk_size=3, ids_only=True))
+        self.assertEqual(ids, [key.pk for key in self.keycards[2:6]])
+
+    def test_deleted_objects_are_skipped(self):
+        for key in self.keycards:
+            assign("change_keycard", self.user, key)
+        self.keycards[3].delete()
+        objs = list(iter_objs(Keycard, 'change_keycard', self.user,
+            chunk_size=2))
+        self.assertEqual(objs, self.keycards[:3] + self.keycards[4:])
+
+    def test_not_user_nor_group(self):
+        self.assertRaises(NotUserNorGroup, list,
+            iter_objs(Keycard, 'change_keycard', 'not a user'))
+
+
+class GetObjsTest(ObjectPermissionTestCase):
+
+    def test_user_and_groups(self):
+        keys = [Keycard.objects.create(key='key%d' % i) for i in xrange(4)]
+        assign('change_keycard', self.user, keys[0])
+        assign('change_keycard', self.group, keys[1])
+        assign('delete_keycard', self.user, keys[2])
+
+        objs = get_objs(Keycard, 'guardian.change_keycard', self.user)
+        self.assertEqual(set(objs), set(keys[:2]))
+        objs = get_objs(Keycard, ['change_keycard', 'delete_keycard'],
+            self.user)
+        self.assertEqual(set(objs), set(keys[:3]))
+        self.assertEqual(list(get_objs(Keycard, 'change_keycard',
+            self.group)), [keys[1]])
+
+    def test_queryset(self):
+        keys = [Keycard.objects.create(key='key%d' % i) for i in xrange(2)]
+        for key in keys:
+            assign('change_keycard', self.user, key)
+        qs = Keycard.objects.filter(key='key1')
+        self.assertEqual(list(get_objs(qs, 'change_keycard', self.user)),
+            [keys[1]])
+
+    def test_global_perms(self):
+        keys = [Keycard.objects.create(key='key%d' % i) for i in xrange(3)]
+        self.group.permissions.add(
+            Permission.objects.get(codename='change_keycard'))
+        deny('change_keycard', self.user, keys[0])
+        self.assertEqual(list(get_objs(Keycard, 'change_keycard',
+            self.user)), [])
+
+        fallback = guardian_settings.GLOBAL_PERMS_FALLBACK
+        guardian_settings.GLOBAL_PERMS_FALLBACK = True
+        try:
+            self.assertEqual(set(get_objs(Keycard, 'change_keycard',
+                self.user)), set(keys[1:]) | set([self.keycard]))
+            self.assertEqual(set(iter_objs(Keycard, 'change_keycard',
+                self.user, chunk_size=2)), set(keys[1:]) | set([self.keycard]))
+            self.assertEqual(list(get_objs(Keycard, 'delete_keycard',
+                self.user)), [])
+        finally:
+            guardian_settings.GLOBAL_PERMS_FALLBACK = fallback
+
+class CopyPermsTest(ObjectPermissionTestCase):
+
+    def setUp(self):
+        super(CopyPermsTest, self).setUp()
+        self.joe = User.objects.create(username='joe')
+        self.targets = [Keycard.objects.create(key='key%d' % i)
+            for i in xrange(450)]
+
+    def test_copy_perms(self):
+        past = datetime.datetime.now() - datetime.timedelta(hours=1)
+        future = datetime.datetime.now() + datetime.timedelta(hours=1)
+        assign('change_keycard', self.user, self.keycard)
+        assign('delete_keycard', self.user, self.keycard, future)
+        assign('can_use_keycard', self.user, self.keycard, past)
+        deny('change_keycard', self.joe, self.keycard)
+        assign('change_keycard', self.group, self.keycard)
+        # existing object permissions of targets are kept
+        assign('change_keycard', self.joe, self.targets[0])
+
+        self.assertEqual(copy_perms(self.keycard,
+            self.targets + [self.keycard]), 450 * 4 - 1)
+        for target in (self.targets[0], self.targets[449]):
+            self.assertEqual(sorted(get_perms(self.user, target)),
+                ['change_keycard', 'delete_keycard'])
+            self.assertEqual(get_perms(self.group, target),
+                ['change_keycard'])
+        self.assertEqual(UserObjectPermission.objects.get(user=self.user,
+            object_id=self.targets[1].pk,
+            permission__codename='delete_keycard').expires_at, future)
+        self.assertTrue(self.joe.has_perm('change_keycard', self.targets[0]))
+        self.assertFalse(self.joe.has_perm('change_keycard', self.targets[1]))
+
+    def test_without_groups(self):
+        assign('change_keycard', self.group, self.keycard)
+        self.assertEqual(copy_perms(self.keycard, self.targets[:2],
+            include_groups=False), 0)
+        self.assertEqual(GroupObjectPermission.objects.count(), 1)
+
+    def test_direct(self):
+        projects = [Project.objects.create(name='project%d' % i)
+            for i in xrange(3)]
+        assign('change_project', self.user, projects[0])
+        assign('delete_project', self.group, projects[0])
+        self.assertEqual(copy_perms(projects[0], projects[1:]), 4)
+        self.assertTrue(self.user.has_perm('change_project', projects[2]))
+        self.assertEqual(get_perms(self.group, projects[1]),
+            ['delete_project'])
+
+    def test_fallback(self):
+        assign('change_keycard', self.user, self.keycard)
+        manager = UserObjectPermission.objects
+        self.assertEqual(manager._copy_rows(list(manager.all()),
+            ContentType.objects.get_for_model(Keycard),
+            [key.pk for key in self.targets[:3]]), 3)
+        self.assertTrue(self.user.has_perm('change_keycard', self.targets[2]))
+
+    def test_validation(self):
+        self.assertRaises(ValueError, copy_perms, self.keycard, [self.user])
+        self.assertRaises(ObjectNotPersisted, copy_perms, self.keycard,
+            [Keycard()])
+
+class TransferPermsTest(ObjectPermissionTestCase):
+
+    def setUp(self):
+        super(TransferPermsTest, self).setUp()
+        self.joe = User.objects.create(username='joe')
+        self.keycards = [Keycard.objects.create(key='key%d' % i)
+            for i in xrange(5)]
+
+    def test_same_identity(self):
+        for key in self.keycards[:2]:
+            assign('change_keycard', self.user, key)
+        self.assertEqual(transfer_perms(self.user, self.user), 0)
+        self.assertEqual(UserObjectPermission.objects.transfer(self.user,
+            User.objects.get(pk=self.user.pk)), 0)
+        self.assertEqual(UserObjectPermission.objects.filter(
+            user=self.user).count(), 2)
+
+    def test_transfer_perms(self):
+        for key in self.keycards:
+            assign('change_keycard', self.user, key)
+        deny('delete_keycard', self.user, self.keycards[0])
+        # joe's own object permissions win
+        deny('change_keycard', self.joe, self.keycards[1])
+        assign('delete_keycard', self.joe, self.keycards[2])
+        project = Project.objects.create(name='transfer')
+        assign('change_project', self.user, project)
+
+        manager = UserObjectPermission.objects
+        self.assertEqual(manager.transfer(self.user, self.joe,
+            chunk_size=2), 5)
+        self.assertEqual(manager.filter(user=self.user).count(), 0)
+        self.assertEqual(manager.filter(user=self.joe).count(), 7)
+        self.assertFalse(self.joe.has_perm('change_keycard', self.keycards[1]))
+        self.assertTrue(self.joe.has_perm('change_keycard', self.keycards[4]))
+        self.assertFalse(self.joe.has_perm('delete_keycard', self.keycards[0]))
+        self.assertTrue(self.user.has_perm('change_project', project))
+
+        self.assertEqual(transfer_perms(self.user, self.joe), 1)
+        self.assertTrue(self.joe.has_perm('change_project', project))
+        self.assertFalse(self.user.has_perm('change_project', project))
+
+    def test_content_types(self):
+        assign('change_keycard', self.group, self.keycards[0])
+        project = Project.objects.create(name='transfer')
+        assign('change_project', self.group, project)
+        group = Group.objects.create(name='other')
+        self.assertEqual(transfer_perms(self.group, group, [Project]), 1)
+        self.assertEqual(get_perms(group, project), ['change_project'])
+        self.assertEqual(get_perms(group, self.keycards[0]), [])
+        self.assertEqual(transfer_perms(self.group, group,
+            [ContentType.objects.get_for_model(Keycard)]), 1)
+        self.assertEqual(get_perms(group, self.keycards[0]),
+            ['change_keycard'])
+
+    def test_user_to_group(self):
+        self.assertRaises(ValueError, transfer_perms, self.user, self.group)
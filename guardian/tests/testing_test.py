@@ -0,0 +1,78 @@
+from django.contrib.auth.models import User, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase
+
+from guardian.core import ObjectPermissionChecker, has_roles, resolve_perm
+from guardian.models import UserObjectPermission, GroupObjectPermission
+from guardian.testing import PermissionGraphBuilder
+from guardian.testing import assert_num_queries, count_queries
+from guardian.tests.models import Keycard, Project
+from guardian.tests.models import ProjectGroupObjectPermission
+
+class PermissionGraphBuilderTest(TestCase):
+    fixtures = ['tests.json']
+
+    def setUp(self):
+        self.keycards = [Keycard.objects.create(key='key%d' % i)
+            for i in xrange(300)]
+
+    def test_build(self):
+        graph = PermissionGraphBuilder()
+        graph.add_users(['user%d' % i for i in xrange(50)])
+        graph.add_groups(['editors', 'viewers'])
+        graph.add_members('editors', ['user%d' % i for i in xrange(10)])
+        graph.add_members('jackGroup', ['user0', 'jack'])
+        graph.assign('change_keycard', self.keycards, groups=['editors'])
+        graph.assign('delete_keycard', self.keycards[:10],
+            users=['user1', 'jack'])
+        # already existing grants are skipped
+        graph.assign('delete_keycard', self.keycards[:1], users=['user1'])
+        # content type and permissions of the model are fetched once per
+        # process
+        for codename in ('change_keycard', 'delete_keycard'):
+            resolve_perm(codename, self.keycards[0])
+        self.assertEqual(count_queries(graph.build), 8)
+
+        self.assertEqual(User.objects.filter(username__startswith='user')
+            .count(), 50)
+        self.assertEqual(graph.groups['editors'].user_set.count(), 10)
+        self.assertEqual(sorted(user.username for user in
+            graph.groups['jackGroup'].user_set.all()), ['jack', 'user0'])
+        self.assertEqual(GroupObjectPermission.objects.count(), 300)
+        self.assertEqual(UserObjectPermission.objects.count(), 20)
+
+        user = graph.users['user1']
+        self.assertTrue(user.has_perm('change_keycard', self.keycards[299]))
+        self.assertTrue(user.has_perm('delete_keycard', self.keycards[0]))
+        self.assertFalse(graph.users['user20'].has_perm('change_keycard',
+            self.keycards[0]))
+
+    def test_direct(self):
+        project = Project.objects.create(name='graph')
+        graph = PermissionGraphBuilder()
+        graph.assign('change_project', [project], groups=['jackGroup'])
+        graph.build()
+        self.assertEqual(ProjectGroupObjectPermission.objects.count(), 1)
+
+    def test_unknown_perm(self):
+        graph = PermissionGraphBuilder()
+        graph.assign('change_user', self.keycards[:1], users=['jack'])
+        self.assertRaises(Permission.DoesNotExist, graph.build)
+
+class AssertNumQueriesTest(TestCase):
+    fixtures = ['tests.json']
+
+    def test_assert_num_queries(self):
+        jack = User.objects.get(username='jack')
+        key = Keycard.objects.create()
+        # content type, permissions and roles of the model are fetched once
+        # per process
+        has_roles(ContentType.objects.get_for_model(key))
+        resolve_perm('change_keycard', key)
+        check = ObjectPermissionChecker(jack)
+        self.assertEqual(assert_num_queries(1, check.has_perm,
+            'change_keycard', key), False)
+        self.assertEqual(assert_num_queries(0, check.has_perm,
+            'change_keycard', key), False)
+        self.assertRaises(AssertionError, assert_num_queries, 1,
+            check.has_perm, 'change_keycard', key)
@@ -0,0 +1,29 @@
+"""
+URLconf used by admin tests.
+"""
+from django.conf.urls.defaults import *
+from django.contrib import admin
+from django.http import HttpResponseNotFound
+
+from guardian.admin import ObjectPermissionMixin
+from guardian.admin import UserObjectPermissionInline
+from guardian.admin import GroupObjectPermissionInline
+from guardian.tests.models import Keycard, Folder
+
+class KeycardAdmin(ObjectPermissionMixin, admin.ModelAdmin):
+    obj_perms_per_page = 2
+    inlines = [UserObjectPermissionInline, GroupObjectPermissionInline]
+
+site = admin.AdminSite(name='guardian-tests')
+site.register(Keycard, KeycardAdmin)
+site.register(Folder, type('FolderAdmin', (ObjectPermissionMixin,
+    admin.ModelAdmin), {}))
+
+def not_found(request):
+    return HttpResponseNotFound()
+
+handler404 = 'guardian.tests.urls.not_found'
+
+urlpatterns = patterns('',
+    (r'^admin/', include(site.urls)),
+)
@@ -2,7 +2,13 @@ from django.test import TestCase
 from django.contrib.auth.models import User, Group, AnonymousUser
 
 from guardian.tests.core_test import ObjectPermissionTestCase
+from guardian.models import UserObjectPermission, GroupObjectPermission
+from guardian.shortcuts import assign, deny
+from guardian.testing import count_queries
+from guardian.tests.models import Keycard, Project
+from guardian.tests.models import ProjectUserObjectPermission
 from guardian.utils import get_anonymous_user, get_identity
+from guardian.utils import prefetch_obj_perms_related, serialize_obj_perms
 from guardian.exceptions import NotUserNorGroup
 
 class GetAnonymousUserTest(TestCase):
@@ -34,3 +40,52 @@ class GetIdentityTest(ObjectPermissionTestCase):
         self.assertRaises(NotUserNorGroup, get_identity, "User")
         self.assertRaises(NotUserNorGroup, get_identity, User)
 
+
+class SerializeObjPermsTest(ObjectPermissionTestCase):
+
+    def setUp(self):
+        super(SerializeObjPermsTest, self).setUp()
+        self.keycards = [Keycard.objects.create(key='key%d' % i)
+            for i in xrange(5)]
+        for keycard in self.keycards:
+            assign('change_keycard', self.user, keycard)
+            assign('delete_keycard', self.group, keycard)
+        self.project = Project.objects.create(name='serialized')
+        assign('change_project', self.user, self.project)
+
+    def get_obj_perms(self):
+        return list(UserObjectPermission.objects.all()) + \
+            list(GroupObjectPermission.objects.all()) + \
+            list(ProjectUserObjectPermission.objects.all())
+
+    def test_prefetch(self):
+        obj_perms = self.get_obj_perms()
+        # permissions, users, groups, keycards and projects
+        self.assertEqual(count_queries(prefetch_obj_perms_related,
+            obj_perms), 5)
+        self.assertEqual(count_queries(lambda: [unicode(obj_perm)
+            for obj_perm in obj_perms]), 0)
+        self.assertEqual(unicode(obj_perms[0]),
+            u'%s | jack | change_keycard' % self.keycards[0])
+
+    def test_serialize(self):
+        deny('can_use_keycard', self.user, self.keycards[0])
+        obj_perms = self.get_obj_perms()
+        self.assertEqual(count_queries(serialize_obj_perms, obj_perms), 5)
+        data = serialize_obj_perms(UserObjectPermission.objects
+            .filter(deny=True))
+        self.assertEqual(data, [{
+            'id': data[0]['id'],
+            'identity_type': 'user',
+            'identity_id': self.user.pk,
+            'identity': u'jack',
+            'permission': u'can_use_keycard',
+            'content_type': u'guardian.keycard',
+            'object_id': self.keycards[0].pk,
+            'object': unicode(self.keycards[0]),
+            'expires_at': None,
+            'deny': True,
+        }])
+        data = serialize_obj_perms(ProjectUserObjectPermission.objects.all())
+        self.assertEqual(data[0]['object'], u'Project object')
+        self.assertEqual(data[0]['object_id'], self.project.pk)
@@ -1,8 +1,14 @@
 """
 django-guardian helper functions/classes.
 """
-from django.contrib.auth.models import User, AnonymousUser, Group
+import datetime
 
+from django.contrib.auth.models import User, AnonymousUser, Group, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Model, get_model, get_models
+
+from guardian.conf import settings as guardian_settings
 from guardian.exceptions import NotUserNorGroup
 from guardian.conf.settings import ANONYMOUS_USER_ID
 
@@ -52,3 +58,185 @@ def get_identity(identity):
     raise NotUserNorGroup("User/AnonymousUser or Group instance is required "
         "(got %s)" % identity)
 
+def get_expires_at(expires_at):
+    """
+    Returns expiration time of object permission as ``datetime`` (or
+    ``None``). ``expires_at`` may be given as ``datetime`` or as
+    ``timedelta``, counted from now.
+    """
+    if isinstance(expires_at, datetime.timedelta):
+        return datetime.datetime.now() + expires_at
+    return expires_at
+
+
+_perms_models_cache = {}
+
+def get_perms_model(obj):
+    """
+    Returns model object permissions of ``obj`` (model instance or class)
+    are stored and checked for: concrete model for proxy models (which share
+    ``ContentType`` and permissions with it), model set for ``obj``'s model by
+    ``GUARDIAN_PERMS_MODELS`` setting or the model itself. Resolved once per
+    model and cached.
+    """
+    model = isinstance(obj, Model) and obj.__class__ or obj
+    try:
+        return _perms_models_cache[model]
+    except KeyError:
+        pass
+    opts = model._meta
+    label = guardian_settings.PERMS_MODELS.get('%s.%s' % (opts.app_label,
+        opts.object_name))
+    if label is not None:
+        app_label, _, name = label.partition('.')
+        target = get_model(app_label, name)
+        if target is None:
+            raise ImproperlyConfigured("GUARDIAN_PERMS_MODELS refers to "
+                "model %r which is not installed" % label)
+        resolved = get_perms_model(target)
+    else:
+        resolved = model
+        while resolved._meta.proxy:
+            resolved = resolved._meta.proxy_for_model
+    _perms_models_cache[model] = resolved
+    return resolved
+
+def get_content_type(obj):
+    """
+    Returns ``ContentType`` object permissions of ``obj`` (model instance or
+    class) are assigned with - the one of its :func:`get_perms_model`.
+    Content types are cached by Django, so no query is made once it is
+    fetched.
+    """
+    return ContentType.objects.get_for_model(get_perms_model(obj))
+
+
+_obj_perms_models_cache = {}
+
+def get_obj_perms_model(obj, base_cls, generic_cls):
+    """
+    Returns model class holding object permissions for given ``obj`` (a model
+    instance or class). *Direct* permission model (subclass of ``base_cls``
+    with ``content_object`` foreign key pointing to :func:`get_perms_model`
+    of ``obj``) is returned if declared, otherwise ``generic_cls``. Results
+    are cached per model.
+    """
+    obj = get_perms_model(obj)
+    key = (obj, base_cls)
+    if key not in _obj_perms_models_cache:
+        model = generic_cls
+        for rel in obj._meta.get_all_related_objects():
+            if (issubclass(rel.model, base_cls)
+                and rel.field.name == 'content_object'):
+                model = rel.model
+                break
+        _obj_perms_models_cache[key] = model
+    return _obj_perms_models_cache[key]
+
+def get_user_obj_perms_model(obj):
+    """
+    Returns model class holding user object permissions for given ``obj``
+    (``UserObjectPermission`` unless *direct* table is declared for it).
+    """
+    from guardian.models import UserObjectPermissionBase
+    from guardian.models import UserObjectPermission
+    return get_obj_perms_model(obj, UserObjectPermissionBase,
+        UserObjectPermission)
+
+def get_group_obj_perms_model(obj):
+    """
+    Returns model class holding group object permissions for given ``obj``
+    (``GroupObjectPermission`` unless *direct* table is declared for it).
+    """
+    from guardian.models import GroupObjectPermissionBase
+    from guardian.models import GroupObjectPermission
+    return get_obj_perms_model(obj, GroupObjectPermissionBase,
+        GroupObjectPermission)
+
+def get_obj_perms_models():
+    """
+    Returns list of all installed (concrete) object permission models, both
+    generic and *direct* ones.
+    """
+    from guardian.models import UserObjectPermissionBase
+    from guardian.models import GroupObjectPermissionBase
+    return [model for model in get_models() if issubclass(model,
+        (UserObjectPermissionBase, GroupObjectPermissionBase))]
+
+def prefetch_obj_perms_related(obj_perms):
+    """
+    Fetches objects, users/groups and permissions (with their content types)
+    related to given object permission instances and caches them at the
+    instances, so they may be rendered (i.e. by ``unicode``, in admin inlines
+    or logs) or passed to :func:`serialize_obj_perms` without further
+    queries. Uses one query for permissions, one per identity model and one
+    per model of the objects, no matter how many instances are given.
+    Returns list of the instances.
+    """
+    obj_perms = list(obj_perms)
+
+    perms = Permission.objects.select_related('content_type').in_bulk(
+        set(obj_perm.permission_id for obj_perm in obj_perms))
+    # (model, cache attribute, id attribute) of related objects
+    related = []
+    for obj_perm in obj_perms:
+        opts = obj_perm._meta
+        setattr(obj_perm, opts.get_field('permission').get_cache_name(),
+            perms.get(obj_perm.permission_id))
+        field = opts.get_field(obj_perm.__class__.objects.identity_field)
+        related.append((obj_perm, field.rel.to, field.get_cache_name(),
+            getattr(obj_perm, field.attname)))
+        if obj_perm.__class__.objects.is_generic():
+            ctype = ContentType.objects.get_for_id(obj_perm.content_type_id)
+            setattr(obj_perm,
+                opts.get_field('content_type').get_cache_name(), ctype)
+            related.append((obj_perm, ctype.model_class(),
+                obj_perm.__class__.content_object.cache_attr,
+                obj_perm.object_id))
+        else:
+            field = opts.get_field('content_object')
+            related.append((obj_perm, field.rel.to, field.get_cache_name(),
+                getattr(obj_perm, field.attname)))
+
+    ids = {}
+    for obj_perm, model, cache_attr, pk in related:
+        ids.setdefault(model, set()).add(model._meta.pk.to_python(pk))
+    objects = dict((model, model._default_manager.in_bulk(list(pks)))
+        for model, pks in ids.iteritems())
+    for obj_perm, model, cache_attr, pk in related:
+        setattr(obj_perm, cache_attr,
+            objects[model].get(model._meta.pk.to_python(pk)))
+    return obj_perms
+
+def serialize_obj_perms(obj_perms):
+    """
+    Returns list of dicts describing given object permission instances (see
+    :func:`prefetch_obj_perms_related` for queries made)::
+
+        >>> serialize_obj_perms(UserObjectPermission.objects.filter(user=joe))
+        [{'id': 1, 'identity_type': 'user', 'identity_id': 2,
+          'identity': u'joe', 'permission': u'change_site',
+          'content_type': u'sites.site', 'object_id': 1,
+          'object': u'example.com', 'expires_at': None, 'deny': False}]
+    """
+    result = []
+    for obj_perm in prefetch_obj_perms_related(obj_perms):
+        manager = obj_perm.__class__.objects
+        identity_field = manager.identity_field
+        identity = getattr(obj_perm, identity_field)
+        object_field = obj_perm._meta.get_field(manager.get_object_field())
+        obj = obj_perm.content_object
+        ctype = obj_perm.permission.content_type
+        result.append({
+            'id': obj_perm.pk,
+            'identity_type': identity_field,
+            'identity_id': identity.pk,
+            'identity': unicode(identity),
+            'permission': obj_perm.permission.codename,
+            'content_type': u'%s.%s' % (ctype.app_label, ctype.model),
+            'object_id': getattr(obj_perm, object_field.attname),
+            'object': obj is not None and unicode(obj) or None,
+            'expires_at': obj_perm.expires_at,
+            'deny': obj_perm.deny,
+        })
+    return result
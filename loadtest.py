@@ -0,0 +1,274 @@
+"""
+Load generator for ``django-guardian``. Simulates many concurrent workers
+(threads or processes, like gunicorn workers) sharing one database and one
+cache, mixing permission reads and writes through ``ObjectPermissionBackend``
+and the shortcuts::
+
+    $ python loadtest.py --workers 8 --duration 30
+    $ python loadtest.py --mode process --cache file:///tmp/guardian-cache
+    $ python loadtest.py --engine postgresql_psycopg2 --name guardian_load \\
+        --user guardian --password secret
+
+Database is set up (``syncdb`` and some users, groups and objects) if needed.
+At the end throughput, latency, errors (including ``IntegrityError`` raised
+by concurrent ``assign`` calls) and cache coherence of
+``get_users_with_perm`` are reported:
+
+* *stale reads* - cached result differed from the database while workers
+  were running (may include reads racing with concurrent writes)
+* *coherence violations* - cached results still differing from the database
+  once all workers have finished
+"""
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from optparse import OptionParser
+
+READ_OPS = ('has_perm', 'get_users_with_perm')
+WRITE_OPS = ('assign', 'remove_perm')
+PERMS = ('change_keycard', 'delete_keycard', 'can_use_keycard')
+
+def get_parser():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option('--mode', choices=('thread', 'process'),
+        default='thread', help="run workers as threads or processes "
+        "[default: %default]")
+    parser.add_option('--workers', type='int', default=4,
+        help="number of concurrent workers [default: %default]")
+    parser.add_option('--duration', type='float', default=10,
+        help="seconds each worker runs for [default: %default]")
+    parser.add_option('--read-ratio', type='float', default=0.9,
+        help="fraction of read operations [default: %default]")
+    parser.add_option('--users', type='int', default=50)
+    parser.add_option('--groups', type='int', default=5)
+    parser.add_option('--objects', type='int', default=20)
+    parser.add_option('--engine', default='sqlite3',
+        help="Django database backend [default: %default]")
+    parser.add_option('--name', default=os.path.join(tempfile.gettempdir(),
+        'guardian-loadtest.db'), help="database name [default: %default]")
+    parser.add_option('--user', default='')
+    parser.add_option('--password', default='')
+    parser.add_option('--host', default='')
+    parser.add_option('--port', default='')
+    parser.add_option('--cache', default='locmem://',
+        help="CACHE_BACKEND; processes need a shared one, e.g. file:// or "
+        "memcached:// [default: %default]")
+    parser.add_option('--seed', type='int', default=None)
+    return parser
+
+def configure(options):
+    """
+    Configures Django settings based on bundled example project.
+    """
+    os.environ["DJANGO_SETTINGS_MODULE"] = 'example_project.settings'
+    from example_project import settings
+
+    settings.INSTALLED_APPS = (
+        'django.contrib.auth',
+        'django.contrib.contenttypes',
+        'django.contrib.sites',
+        'guardian',
+        'guardian.tests',
+    )
+    settings.DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.%s' % options.engine,
+            'NAME': options.name,
+            'USER': options.user,
+            'PASSWORD': options.password,
+            'HOST': options.host,
+            'PORT': options.port,
+        },
+    }
+    settings.CACHE_BACKEND = options.cache
+    settings.DEBUG = False
+
+def setup_data(options):
+    """
+    Creates tables and objects used by workers (if not created yet).
+    """
+    from django.core.management import call_command
+    from django.contrib.auth.models import User, Group
+    from guardian.tests.models import Keycard
+
+    call_command('syncdb', interactive=False, verbosity=0)
+    for i in xrange(options.groups):
+        Group.objects.get_or_create(name='load-group-%d' % i)
+    groups = list(Group.objects.filter(name__startswith='load-group-'))
+    for i in xrange(options.users):
+        user, created = User.objects.get_or_create(username='load-user-%d' % i)
+        if created:
+            user.groups.add(random.choice(groups))
+    for i in xrange(options.objects):
+        Keycard.objects.get_or_create(key='load-key-%d' % i)
+
+def fresh_users_with_perm(obj, codename):
+    """
+    Returns set of ids of users having ``codename`` for ``obj``, computed by
+    the database (bypassing the cache).
+    """
+    from django.contrib.auth.models import User
+    from django.contrib.contenttypes.models import ContentType
+    from django.db.models import Q
+    from guardian.models import UserObjectPermission, GroupObjectPermission
+
+    ctype = ContentType.objects.get_for_model(obj)
+    lookups = dict(permission__codename=codename, content_type=ctype,
+        object_id=obj.pk)
+    users = UserObjectPermission.objects.filter(**lookups).values('user')
+    groups = GroupObjectPermission.objects.filter(**lookups).values('group')
+    return set(User.objects
+        .filter(Q(pk__in=users) | Q(groups__in=groups))
+        .values_list('pk', flat=True))
+
+def run_worker(args):
+    """
+    Runs random operations for ``options.duration`` seconds and returns
+    statistics dictionary.
+    """
+    worker_id, options = args
+    from django.db import connection, transaction, IntegrityError
+    from django.contrib.auth.models import User, Group
+    from guardian.backends import ObjectPermissionBackend
+    from guardian.shortcuts import assign, remove_perm, get_users_with_perm
+    from guardian.tests.models import Keycard
+
+    rand = random.Random((options.seed or 0) + worker_id)
+    backend = ObjectPermissionBackend()
+    users = list(User.objects.filter(username__startswith='load-user-'))
+    groups = list(Group.objects.filter(name__startswith='load-group-'))
+    objs = list(Keycard.objects.filter(key__startswith='load-key-'))
+    stats = {
+        'ops': dict((op, 0) for op in READ_OPS + WRITE_OPS),
+        'time': dict((op, 0.0) for op in READ_OPS + WRITE_OPS),
+        'errors': {},
+        'integrity_errors': 0,
+        'stale_reads': 0,
+    }
+
+    finish = time.time() + options.duration
+    while time.time() < finish:
+        if rand.random() < options.read_ratio:
+            op = rand.choice(READ_OPS)
+        else:
+            op = rand.choice(WRITE_OPS)
+        perm = rand.choice(PERMS)
+        obj = rand.choice(objs)
+        identity = rand.choice((rand.choice(users), rand.choice(groups)))
+        start = time.time()
+        try:
+            if op == 'has_perm':
+                backend.has_perm(rand.choice(users), perm, obj)
+            elif op == 'get_users_with_perm':
+                cached = set(user.pk for user in
+                    get_users_with_perm(obj, perm))
+                if cached != fresh_users_with_perm(obj, perm):
+                    stats['stale_reads'] += 1
+            elif op == 'assign':
+                assign(perm, identity, obj)
+            else:
+                remove_perm(perm, identity, obj)
+        except IntegrityError:
+            stats['integrity_errors'] += 1
+            transaction.rollback_unless_managed()
+        except Exception, err:
+            name = err.__class__.__name__
+            stats['errors'][name] = stats['errors'].get(name, 0) + 1
+            transaction.rollback_unless_managed()
+        stats['ops'][op] += 1
+        stats['time'][op] += time.time() - start
+    connection.close()
+    return stats
+
+def run_threads(options):
+    results = []
+    def target(worker_id):
+        results.append(run_worker((worker_id, options)))
+    threads = [threading.Thread(target=target, args=(i,))
+        for i in xrange(options.workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def run_processes(options):
+    import multiprocessing
+    from django.db import connection
+    # forked workers must not share parent's connection
+    connection.close()
+    pool = multiprocessing.Pool(options.workers)
+    try:
+        return pool.map(run_worker,
+            [(i, options) for i in xrange(options.workers)])
+    finally:
+        pool.close()
+        pool.join()
+
+def check_coherence():
+    """
+    Returns number of (object, permission) pairs for which cached result of
+    ``get_users_with_perm`` differs from the database.
+    """
+    from django.core.cache import cache
+    from django.contrib.contenttypes.models import ContentType
+    from guardian.tests.models import Keycard
+
+    violations = 0
+    for obj in Keycard.objects.filter(key__startswith='load-key-'):
+        ctype = ContentType.objects.get_for_model(obj)
+        for perm in PERMS:
+            key = 'guardian.shortcuts.get_users_with_perm.{0}.{1}.{2}'\
+                .format(ctype.pk, obj.pk, perm)
+            cached = cache.get(key)
+            if cached is None:
+                continue
+            if set(user.pk for user in cached) != \
+                fresh_users_with_perm(obj, perm):
+                violations += 1
+    return violations
+
+def report(results, options, elapsed, violations):
+    total = {}
+    total_time = {}
+    errors = {}
+    for stats in results:
+        for op, count in stats['ops'].items():
+            total[op] = total.get(op, 0) + count
+            total_time[op] = total_time.get(op, 0) + stats['time'][op]
+        for name, count in stats['errors'].items():
+            errors[name] = errors.get(name, 0) + count
+    ops = sum(total.values())
+
+    print "%d %s workers, %.1fs, %s database, %s cache" % (options.workers,
+        options.mode, elapsed, options.engine, options.cache)
+    print "%-22s %10s %12s" % ('operation', 'count', 'avg [ms]')
+    for op in READ_OPS + WRITE_OPS:
+        avg = total[op] and total_time[op] / total[op] * 1000 or 0
+        print "%-22s %10d %12.2f" % (op, total[op], avg)
+    print "throughput: %.1f ops/s" % (ops / elapsed)
+    print "IntegrityErrors: %d" % sum(s['integrity_errors'] for s in results)
+    print "other errors: %s" % (', '.join('%s=%d' % item
+        for item in sorted(errors.items())) or 0)
+    print "stale reads: %d" % sum(s['stale_reads'] for s in results)
+    print "coherence violations: %d" % violations
+
+def main():
+    options, args = get_parser().parse_args()
+    random.seed(options.seed)
+    configure(options)
+    setup_data(options)
+
+    start = time.time()
+    if options.mode == 'thread':
+        results = run_threads(options)
+    else:
+        results = run_processes(options)
+    elapsed = time.time() - start
+    report(results, options, elapsed, check_coherence())
+
+if __name__ == '__main__':
+    main()
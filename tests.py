@@ -8,6 +8,7 @@ instructions how to interpret ``test`` command when we run::
 """
 import os
 import sys
+import tempfile
 
 os.environ["DJANGO_SETTINGS_MODULE"] = 'example_project.settings'
 from example_project import settings
@@ -22,6 +23,25 @@ settings.INSTALLED_APPS = (
     'guardian',
     'guardian.tests',
 )
+# Additional (empty) database used as read replica by routers tests
+settings.DATABASES['replica'] = {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': ':memory:',
+}
+# Shards used by sharding tests; they are accessed by multiple threads so
+# can't be in-memory databases
+for alias in ('shard1', 'shard2'):
+    settings.DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(tempfile.gettempdir(), 'guardian-%s.db' % alias),
+        'TEST_NAME': os.path.join(tempfile.gettempdir(),
+            'test-guardian-%s.db' % alias),
+    }
+# Example project's context processors come from apps not installed here
+settings.TEMPLATE_CONTEXT_PROCESSORS = (
+    'django.contrib.auth.context_processors.auth',
+    'django.core.context_processors.request',
+)
 
 def main():
     from django.test.utils import get_runner